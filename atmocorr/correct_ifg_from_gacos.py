@@ -15,7 +15,7 @@ Usage:
     [--suffix=<value>] [--rlook=<value>] [--plot=<yes|no>] [--cohpixel=<yes/no>] [--threshold_coh=<value>] \
     [--refstart=<values>] [--refend=<values>] [--format=<value>]  \
     [--ramp=<cst|lin>] [--crop=<values>] [--fitmodel=<yes|no>] [--perc=<value>]  \
-    [--suffix_output=<value>] [--nproc=<nb_cores>]
+    [--suffix_output=<value>] [--nproc=<nb_cores>] [--telemetry=<path>] [--plan=<yes|no>]
 
 correct_ifg_from_gacos.py -h | --help
 
@@ -36,10 +36,13 @@ Options:
 --cohpixel=<yes/no>     If Yes, use amplitude interferogram to weight and mask pixels (e.g Coherence, Colinearity, Amp Filter) [default: no]
 --threshold_coh=<value> Thresold on rmspixel for ramp estimation [default: 2.]   
 --plot=<yes|no>         Display results [default: yes]
---format VALUE          Format input files: ROI_PAC, GAMMA, GTIFF [default: GAMMA]
+--format VALUE          Format input files: only GAMMA is supported [default: GAMMA]
 --perc=<value>          Percentile of hidden LOS pixel for the estimation and clean outliers [default:98.]
 --fitmodel=<yes|no>     If yes, then estimate the proportionlality between gacos and los_map in addition to a polynomial ramp
 --nproc=<values>            number of processor (default: 1)
+--telemetry=<path>      Append timing and resources of each IFG to the JSON-lines files <path>.<host>.<pid> (see telemetry_summary.py)
+--plan=<yes|no>         If yes, write the GACOS model and ramp in the plan $prefix$date1_$date2$suffix$suffix_output.unw.plan
+                        instead of writing the corrected IFG. Corrected IFGs are written in one pass with apply_plan.py [default: no]
 """
 
 import gdal
@@ -62,6 +65,10 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 import docopt
 import shutil
+import gamma as gm
+import telemetry
+import corrections
+import gacosmaps
 
 from contextlib import contextmanager
 from functools import wraps, partial
@@ -78,10 +85,15 @@ warnings.filterwarnings("ignore", category=RuntimeWarning)
 # read arguments
 arguments = docopt.docopt(__doc__)
 
+# logging.basicConfig(level=logging.INFO,\
+logging.basicConfig(level=logging.INFO,\
+        format='%(asctime)s -- %(levelname)s -- %(message)s')
+logger = logging.getLogger('correct_ifg_from_gacos.log')
+
 int_list=arguments["--int_list"]
 
 if arguments["--int_path"] == None:
-    int_path='.'
+    int_path='./'
 else:
     int_path=arguments["--int_path"] + '/'
 
@@ -118,6 +130,10 @@ if arguments["--nproc"] == None:
 else:
     nproc = int(arguments["--nproc"])
 
+telefile = arguments["--telemetry"]
+if telefile is not None:
+    telefile = os.path.abspath(telefile)
+
 if arguments["--plot"] ==  'yes':
     plot = 'yes'
     logger.warning('plot is yes. Set nproc to 1')
@@ -153,6 +169,10 @@ if arguments["--format"] ==  None:
     sformat = 'GAMMA'
 else:
     sformat = arguments["--format"]
+# GACOS maps and IFGs are only read in GAMMA format
+if sformat != 'GAMMA':
+    logger.critical('Argument error: format {0} not supported, only GAMMA'.format(sformat))
+    sys.exit()
 
 if arguments["--perc"] ==  None:
     perc = 98.
@@ -184,6 +204,11 @@ if arguments["--suffix_output"] ==  None:
 else:
     suffout = arguments["--suffix_output"]
 
+if arguments["--plan"] ==  None:
+    plan = 'no'
+else:
+    plan = arguments["--plan"]
+
 # Choose plot option
 cmap = cm.gist_rainbow_r
 # cmap = cm.jet
@@ -249,55 +274,37 @@ def poolcontext(*arg, **kargs):
 #####################################################################################
 
 
-def gacos2ifg(kk):
+def gacos_date(date):
+    """
+    Function that returns the GACOS delays of a date referenced to the ref area,
+    read from the cache of GACOS dates if already computed
     """
-    Function that compute modeled ifgs
-    """ 
-
-    date1, date2 = date_1[kk], date_2[kk]
-    idate = str(date1) + '-' + str(date2) 
 
     if sformat == 'GAMMA':
-        import gamma as gm
-        lines,cols = gm.readpar(gacos_path)
-        infile1 = gacos_path +  str(date1) + '_crop.ztd.unw'
-        infile2 = gacos_path +  str(date2) + '_crop.ztd.unw'
-        checkinfile(infile1); checkinfile(infile2)
-        gacos1 = gm.readgamma(infile1,int_path)
-        gacos2 = gm.readgamma(infile2,int_path)
-
-    if arguments["--zone"] ==  None:
-        refzone = [0,cols,0,lines]
-    else:
-        refzone = map(float,arguments["--clean"].replace(',',' ').split())
-    col_beg,col_end,line_beg,line_end = refzone[0],refzone[1],refzone[2],refzone[3]
+        infile = gacos_path +  str(date) + '_crop.ztd.unw'
+        checkinfile(infile)
+        read = lambda: gm.readgamma(infile,gacos_path)
 
-    # extract range and azimuth coordinates from ref or radar file
-    pix_az, pix_rg = np.indices((lines,cols))
+    # ref area: lines refstart to refend, columns of the crop
+    key = {'format': sformat, 'rows': [refstart, refend], 'cols': [col_beg, col_end]}
+    return gacosmaps.cached(infile, key, (lines,cols),
+        lambda: gacosmaps.reference(read(), (refstart, refend), (col_beg, col_end)))
 
-    _los_map = np.copy(los_map)
-    _los_map[np.logical_or(gacos2==0,gacos2>=9990)] = np.float('NaN')
-    _los_map[np.logical_or(gacos1==0,gacos1>=9990)] = np.float('NaN')
+def cache_date(date):
+    """
+    Function that puts the GACOS delays of a date in the cache
+    """
+    gacos_date(date)
 
-    indexref = np.nonzero(
-        np.logical_and(~np.isnan(gacos2),
-        np.logical_and(pix_lin>refstart,
-        np.logical_and(pix_lin<refend,
-        np.logical_and(los_map!=0.0,
-        np.logical_and(pix_col>col_beg, pix_col<col_end
-        ))))))
-   
-    # compute average phase in the ref area 
-    # we want los ref area to be zero
-    cst1 = np.nanmean(gacos1[indexref].flatten())
-    cst2 = np.nanmean(gacos2[indexref].flatten())
+def gacos2ifg(kk):
+    """
+    Function that compute modeled ifgs as differences of cached GACOS dates
+    """ 
 
-    # remove ref frame
-    gacos2 = gacos2 - cst2
-    gacos1 = gacos1 - cst1
+    date1, date2 = date_1[kk], date_2[kk]
 
     # compute differential los
-    gacosm = (gacos2 - gacos1) * gacos2los
+    gacosm = (gacos_date(date2) - gacos_date(date1)) * gacos2los
     # gacosm = (gacos2 - gacos1) * 4 * math.pi / wavelength
 
     # open gacos corrections
@@ -306,7 +313,7 @@ def gacos2ifg(kk):
     gacosm.flatten().astype('float32').tofile(fid)
     fid.close()
 
-    del gacosm, gacos2, gacos1
+    del gacosm
 
 def correct_ifg(kk):
     """
@@ -321,40 +328,36 @@ def correct_ifg(kk):
         # par_file = ref 
         lines,cols = gm.readpar(int_path)
         infile= int_path + prefix + str(date1) + '_' + str(date2) + suffix + rlook + '.unw'
-        checkinfile(infile)
-        los_map = gm.readgamma(infile,int_path)
+        if not corrections.planned(infile):
+            checkinfile(infile)
+        # with the corrections planned on infile, if any
+        los_map = corrections.read(infile, 'gamma', (lines,cols))[1]
 
     logger.info('lines:{0}, cols:{1}, IFG:{2}:'.format(lines, cols, idate))
 
     # open gacos corrections
     gacosf = gacos_path + str(date1) + '-' + str(date2) + '_gacosmdel' +'.r4'
-    model = np.fromfile(gacosf,dtype=np.float32)
+    model = np.fromfile(gacosf,dtype=np.float32)[:lines*cols].reshape((lines,cols))
 
     # load coherence or whatever
     rms_map = np.ones((lines,cols))
 
     if rmsf=='yes':
         try:
-            if sformat == 'ROI_PAC':
-                rms_map[:ds.RasterYSize,:ds.RasterXSize] = ds_band1.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)[:lines,:cols]
-                k = np.nonzero(np.logical_or(rms_map==0.0, rms_map==9999))
-                rms_map[k] = float('NaN')
-            elif sformat == 'GAMMA':
+            if sformat == 'GAMMA':
                 rmsfile=  int_path + str(date1) + '_' + str(date2) + '.filt.cc'
                 rms_map = gm.readgamma(rmsfile,int_path)
 
         except:
             logger.warning('Coherence file cannot be read')
 
-    if arguments["--zone"] ==  None:
+    # zone of the empirical estimation
+    if crop is False:
         refzone = [0,cols,0,lines]
     else:
-        refzone = map(float,arguments["--clean"].replace(',',' ').split())
+        refzone = crop
     col_beg,col_end,line_beg,line_end = refzone[0],refzone[1],refzone[2],refzone[3]
 
-    # extract range and azimuth coordinates from ref or radar file
-    pix_az, pix_rg = np.indices((lines,cols))
-
     _los_map = np.copy(los_map)
     _los_map[np.logical_or(los_map==0,los_map>=9990)] = np.float('NaN')
     losmin,losmax = np.nanpercentile(_los_map,2.),np.nanpercentile(_los_map,98.)
@@ -402,10 +405,11 @@ def correct_ifg(kk):
     amp_ref = amp_ref/np.nanpercentile(amp_ref,99)
     cst = np.nansum(los_ref*amp_ref) / np.nansum(amp_ref)
     los_map  = los_map - cst
+    cst_ref = cst
     
-    # extract los for empirical estimation
+    # extract los for empirical estimation, coordinates relative to the estimation zone
     temp = np.array(index).T
-    x = temp[:,0]; y = temp[:,1]
+    x = temp[:,0] - line_beg; y = temp[:,1] - col_beg
     los_clean = los_map[index].flatten()
     model_clean = model[index].flatten()
 
@@ -444,23 +448,21 @@ def correct_ifg(kk):
     modelbins = np.array(modelbins)
     xbins, ybins = np.array(xbins),np.array(ybins)
 
+    # ramp coefficients in the basis of corrections.Polynomial
+    rampcoeffs, ramporigin = np.zeros(13), (line_beg, col_beg)
+
     if (ramp == 'cst' and  fitmodel=='no'):
         
         a = cst
-        print 'Remove cst: %f for date: %i'%(a,idates[l])
+        print 'Remove cst: %f for IFG: %s'%(a,idate)
 
-        remove_ramp = np.ones((nlign,ncol)).reshape((nlign,ncol))*cst
-        remove_ramp[model==0.] = 0.
-        remove_ramp[np.isnan(los_map)] = np.float('NaN')
-        
         # los_map = gacos + cst
-        remove = remove_ramp + model
-       
         # Compute ramp for los_map = f(model) 
         functbins = a
         funct = a
         # set coef gacos to 1
         f = 1
+        rampcoeffs[8] = cst
 
     elif (ramp == 'lin' and  fitmodel=='no'):
         # here we want to minimize los_map-gacos = ramp
@@ -480,28 +482,15 @@ def correct_ifg(kk):
         _fprime = lambda x: 2*np.dot(G.T/sigmad, (np.dot(G,x)-d)/sigmad)
         pars = opt.fmin_slsqp(_func,x0,fprime=_fprime,iter=200,full_output=True,iprint=0)[0]
         a = pars[0]; b = pars[1]; c = pars[2]
-        print 'Remove ramp  %f az  + %f r + %f for date: %i'%(a,b,c,idates[l])
+        print 'Remove ramp  %f az  + %f r + %f for IFG: %s'%(a,b,c,idate)
             
+        # los_map = gacos + (a*az + b*rg + cst) 
         # Compute ramp for los_map = f(model)
         functbins = a*xbins + b*ybins + c
         funct = a*x + b*y + c
         # set coef gacos to 1
         f = 1
-
-        # build total G matrix
-        G=np.zeros((len(los_map.flatten()),3))
-        for i in xrange(nlign):
-            G[i*ncol:(i+1)*ncol,0] = i - line_beg 
-            G[i*ncol:(i+1)*ncol,1] = np.arange(ncol) - col_beg
-        G[:,2] = 1
-
-        # compute ramp
-        remove_ramp = np.dot(G,pars).reshape(nlign,ncol)
-        remove_ramp[model==0.] = 0.
-        remove_ramp[np.isnan(los_map)] = np.float('NaN')
-        
-        # los_map = gacos + (a*rg + b*az + cst) 
-        remove = model + remove_ramp
+        rampcoeffs[5], rampcoeffs[2], rampcoeffs[8] = a, b, c
 
     elif fitmodel=='yes':
         # invers both digitized los_map and ref frame together
@@ -524,72 +513,42 @@ def correct_ifg(kk):
         _fprime = lambda x: 2*np.dot(G.T/sigmad, (np.dot(G,x)-d)/sigmad)
         pars = opt.fmin_slsqp(_func,x0,fprime=_fprime,iter=200,full_output=True,iprint=0)[0]
         a = pars[0]; b = pars[1]; c = pars[2]; d = pars[3]; e = pars[4]; f = pars[5]
-        print 'Remove ramp %f az**2, %f az  + %f r**2 + %f r + %f + %f model for date: %i'%(a,b,c,d,e,f,idates[l])
+        print 'Remove ramp %f az**2, %f az  + %f r**2 + %f r + %f + %f model for IFG: %s'%(a,b,c,d,e,f,idate)
 
+        # los_map = a*gacos + ramp
         #Compute ramp for los_map = f(model)
         funct = a*x**2 + b*x + c*y**2 + d*y + e
         functbins = a*xbins**2 + b*xbins + c*ybins**2 + d*ybins + e
+        rampcoeffs[4], rampcoeffs[5], rampcoeffs[1], rampcoeffs[2], rampcoeffs[8] = a, b, c, d, e
 
-        # build total G matrix
-        G=np.zeros((len(los_map.flatten()),6))
-        for i in xrange(nlign):
-                G[i*ncol:(i+1)*ncol,0] = (i - line_beg)**2
-                G[i*ncol:(i+1)*ncol,1] = i - line_beg
-                G[i*ncol:(i+1)*ncol,2] = np.arange((ncol - col_beg))**2
-                G[i*ncol:(i+1)*ncol,3] = np.arange(ncol - col_beg)
-        G[:,4] = 1
-        G[:,5] = model.flatten()
-
-        # los_map = a*gacos + ramp
-        remove = np.dot(G,pars).reshape(nlign,ncol)
-        remove[model==0.] = 0.
-        remove[np.isnan(los_map)] = np.float('NaN')
-
-        # build total G matrix
-        G=np.zeros((len(los_map.flatten()),5))
-        for i in xrange(nlign):
-            G[i*ncol:(i+1)*ncol,0] = (i - line_beg)**2
-            G[i*ncol:(i+1)*ncol,1] = i - line_beg
-            G[i*ncol:(i+1)*ncol,2] = np.arange((ncol - col_beg))**2
-            G[i*ncol:(i+1)*ncol,3] = np.arange(ncol - col_beg)
-        G[:,4] = 1
-
-        # ramp only
-        remove_ramp = np.dot(G,pars[:-1]).reshape(nlign,ncol)
-        remove_ramp[model==0.] = 0.
-        remove_ramp[np.isnan(los_map)] = np.float('NaN')
+    # ramp on the whole IFG, as applied by the plan
+    remove_ramp = corrections.Polynomial(rampcoeffs, origin=ramporigin, sign=1.).block((0,lines), cols)
+    remove_ramp = np.array(remove_ramp)
+    remove_ramp[model==0.] = 0.
+    remove_ramp[np.isnan(los_map)] = np.float('NaN')
+    remove = f*model + remove_ramp
 
     # correction
     # los_map_flat = los_map - (gacos + ramp)
-    los_map_flat[:,:] = los_map - remove
+    los_map_flat = los_map - remove
     los_map_flat[np.isnan(los_map)] = np.float('NaN')
     los_map_flat[los_map_flat>999.]= np.float('NaN')
 
     # model = gacos + ramp
-    model_flat[:,:,l] = gacos[:,:,l] + remove_ramp
-
-    # # Refer los_map again (just to check)
-    # rms_ref = rms[indexref].flatten()
-    # amp_ref = 1./rms_ref
-    # amp_ref = amp_ref/np.nanmax(amp_ref)
-    # cst = np.nansum(los_map_flat[indexref]*amp_ref) / np.nansum(amp_ref)
-    # print 'Average phase within ref area, iter=2:', cst 
-    # los_map_flat = los_map_flat - cst
+    model_flat = model + remove_ramp
 
     # compute variance flatten los_map
-    var[l] = np.sqrt(np.nanmean(los_map_flat**2))
-    print 'Var: ', var[l]
+    var = np.sqrt(np.nanmean(los_map_flat**2))
+    print 'Var: ', var
 
-    
     # initiate figure depl
-    fig = plt.figure(nfigure,figsize=(14,7))
-    nfigure += 1
+    fig = plt.figure(0,figsize=(14,7))
     ax = fig.add_subplot(3,2,1)
     im = ax.imshow(los_map,cmap=cmap,vmax=losmax,vmin=losmin)
     divider = make_axes_locatable(ax)
     cax = divider.append_axes("right", size="5%", pad=0.05)
     plt.colorbar(im, cax=cax)
-    ax.set_title('los_map {}'.format(idates[l]),fontsize=6)
+    ax.set_title('los_map {}'.format(idate),fontsize=6)
 
     # initiate figure depl
     ax = fig.add_subplot(3,2,2)
@@ -597,15 +556,15 @@ def correct_ifg(kk):
     divider = make_axes_locatable(ax)
     cax = divider.append_axes("right", size="5%", pad=0.05)
     plt.colorbar(im, cax=cax)
-    ax.set_title('Model {}'.format(idates[l]),fontsize=6)
+    ax.set_title('Model {}'.format(idate),fontsize=6)
     
     # initiate figure depl
     ax = fig.add_subplot(3,2,3)
-    im = ax.imshow(model_flat[:,:,l],cmap=cmap)
+    im = ax.imshow(model_flat,cmap=cmap)
     divider = make_axes_locatable(ax)
     cax = divider.append_axes("right", size="5%", pad=0.05)
     plt.colorbar(im, cax=cax)
-    ax.set_title('Flatten Model {}'.format(idates[l]),fontsize=6)
+    ax.set_title('Flatten Model {}'.format(idate),fontsize=6)
 
     # initiate figure depl
     ax = fig.add_subplot(3,2,4)
@@ -613,7 +572,7 @@ def correct_ifg(kk):
     divider = make_axes_locatable(ax)
     cax = divider.append_axes("right", size="5%", pad=0.05)
     plt.colorbar(im, cax=cax)
-    ax.set_title('Correct los_map {}'.format(idates[l]),fontsize=6)
+    ax.set_title('Correct los_map {}'.format(idate),fontsize=6)
 
     ax = fig.add_subplot(3,2,5)
     g = np.linspace(np.nanmax(model_clean),np.nanmin(model_clean),100)
@@ -627,36 +586,30 @@ def correct_ifg(kk):
     ax.set_title('los_map/Model')
 
     fig.tight_layout()
-    fig.savefig('{}-gacos-cor.png'.format(idates[l]), format='PNG',dpi=150)
-
-    if plot == 'yes':
-        plt.show()
-        # sys.exit()
+    fig.savefig('{}-gacos-cor.png'.format(idate), format='PNG',dpi=150)
 
-    elif sformat == 'GAMMA':
-        outfile = out_path + prefix + str(date1) + '_' + str(date2) + suffix +  suffout + rlook + '.unw' 
-        fid = open(outfile, 'wb')
-        los_map_flat.flatten().astype('>f4').tofile(fid)
+    if sformat == 'GAMMA':
+        outfile = int_path + prefix + str(date1) + '_' + str(date2) + suffix +  suffout + rlook + '.unw' 
+        if plan == 'yes':
+            # los_map - (f*gacos + ramp), applied later with the other corrections of infile
+            p = corrections.plan(infile, 'gamma', (lines,cols))
+            p.add(corrections.RasterModel(gacosf, (lines,cols), sign=-f))
+            rampcoeffs[8] += cst_ref
+            p.add(corrections.Polynomial(rampcoeffs, origin=ramporigin))
+            p.save(outfile)
+        else:
+            gm.writegamma(outfile, los_map_flat)
 
     if plot=='yes':
         plt.show()
 
     plt.close('all')
-    try:
-        del dst_ds, ds, drv
-    except:
-        pass
     del los_map, rms_map
 
 #####################################################################################
 # INITIALISE 
 #####################################################################################
 
-# logging.basicConfig(level=logging.INFO,\
-logging.basicConfig(level=logging.INFO,\
-        format='%(asctime)s -- %(levelname)s -- %(message)s')
-logger = logging.getLogger('correct_ifg_from_gacos.log')
-
 # read int
 date_1,date_2=np.loadtxt(int_list,comments="#",unpack=True,usecols=(0,1),dtype='i,i')
 Nifg=len(date_1)
@@ -675,20 +628,43 @@ cst = np.copy(imd[0])
 for i in range((nmax)):
     bt.append(imd[i]-cst)
 
+def ifglabel(kk):
+    ''' Return date1-date2 of IFG kk '''
+    return '{0}-{1}'.format(date_1[kk], date_2[kk])
+
+def traced(name, label=ifglabel):
+    ''' Return the function name, recording each call with --telemetry '''
+    if telefile is None:
+        return globals()[name]
+    return telemetry.Traced(globals()[name], name, telefile, label=label)
+
+# size of the GACOS grids and ref area
+if sformat == 'GAMMA':
+    lines,cols = gm.readpar(gacos_path)
+if crop is False:
+    col_beg,col_end = 0,cols
+else:
+    col_beg,col_end = crop[0],crop[1]
+
 #####################################################################################
 # MAIN
 #####################################################################################
 
+# resample and reference each date once
+with TimeIt():
+    with poolcontext(processes=nproc) as pool:
+        pool.map(traced('cache_date', label=None), im)
+
 # compute model IFGs
 with TimeIt():
     # for kk in range(Nifg):
     work = range(Nifg)
     with poolcontext(processes=nproc) as pool:
-        results = pool.map(gacos2ifg, work)
+        results = pool.map(traced('gacos2ifg'), work)
 
 # apply corrections
 with TimeIt():
     # for kk in range(Nifg):
     work = range(Nifg)
     with poolcontext(processes=nproc) as pool:
-        results = pool.map(empirical_cor, work)
+        results = pool.map(traced('correct_ifg'), work)
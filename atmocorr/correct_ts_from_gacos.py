@@ -12,9 +12,9 @@ Correct Time Series data from Gacos atmospheric models. 1) convert .ztd files to
 3) correct data
 
 Usage: 
-    correct_ts_from_gacos.py [--cube=<path>] [--path=<path>] [--list_images=<path>] [--imref=<value>] [--crop=<values>] [--gacos2data=<value>] [--proj=<value>] [--plot=<yes|no>] [--load=<path>] [--rmspixel=<path>] [--threshold_rms=<value>] [--refstart=<values>] [--refend=<values>]  
-    correct_ts_from_gacos.py [--cube=<path>] [--path=<path>] [--list_images=<path>] [--imref=<value>] [--crop=<values>] [--gacos2data=<value>] [--proj=<value>] [--plot=<yes|no>] [--load=<path>] [--rmspixel=<path>] [--threshold_rms=<value>] [--refstart=<values>] [--refend=<values>]  [--ramp=<cst|lin>] [--zone=<values>] [--topofile=<path>] 
-    correct_ts_from_gacos.py [--cube=<path>] [--path=<path>] [--list_images=<path>] [--imref=<value>] [--crop=<values>] [--gacos2data=<value>] [--proj=<value>] [--plot=<yes|no>] [--load=<path>] [--rmspixel=<path>] [--threshold_rms=<value>] [--refstart=<values>] [--refend=<values>]  [--fitmodel=<yes|no>] [--zone=<values>] [--topofile=<path>] 
+    correct_ts_from_gacos.py [--cube=<path>] [--path=<path>] [--list_images=<path>] [--imref=<value>] [--crop=<values>] [--gacos2data=<value>] [--proj=<value>] [--plot=<yes|no>] [--load=<path>] [--rmspixel=<path>] [--threshold_rms=<value>] [--refstart=<values>] [--refend=<values>] [--nproc=<values>]
+    correct_ts_from_gacos.py [--cube=<path>] [--path=<path>] [--list_images=<path>] [--imref=<value>] [--crop=<values>] [--gacos2data=<value>] [--proj=<value>] [--plot=<yes|no>] [--load=<path>] [--rmspixel=<path>] [--threshold_rms=<value>] [--refstart=<values>] [--refend=<values>]  [--ramp=<cst|lin|quad>] [--zone=<values>] [--topofile=<path>] [--nproc=<values>]
+    correct_ts_from_gacos.py [--cube=<path>] [--path=<path>] [--list_images=<path>] [--imref=<value>] [--crop=<values>] [--gacos2data=<value>] [--proj=<value>] [--plot=<yes|no>] [--load=<path>] [--rmspixel=<path>] [--threshold_rms=<value>] [--refstart=<values>] [--refend=<values>]  [--fitmodel=<yes|no>] [--zone=<values>] [--topofile=<path>] [--nproc=<values>]
 
 correct_ts_from_gacos.py -h | --help
 
@@ -37,19 +37,22 @@ Options:
 --plot=<yes|no>      Display results [default: yes]
 --load=<file>        If a file is given, load directly GACOS cube 
 --fitmodel=<yes|no>  If yes, then estimate the proportionlality between gacos and data in addition to a polynomial ramp
+--nproc=<values>     Number of processes re-projecting GACOS dates and fitting them to the data (one process if plot=yes) [default: 4]
 """
 
 import gdal
 from osgeo import osr
 import sys,os
 import numpy as np
-import scipy.optimize as opt
 import scipy.linalg as lst
 import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from numpy.lib.stride_tricks import as_strided
-import subprocess
+import multiprocessing
+from functools import partial
+import headers
+import gacosmaps
 np.warnings.filterwarnings('ignore')
 
 try:
@@ -100,17 +103,22 @@ if arguments["--load"] ==  None:
 else:
     load = 'no'
     loadf = arguments["--load"]
+if arguments["--nproc"] ==  None:
+    nproc = 4
+else:
+    nproc = int(arguments["--nproc"])
 if arguments["--topofile"] ==  None:
    radar = None
 else:
    radar = arguments["--topofile"]
 # read lect.in: size maps
-ncol, nlign = map(int, open('lect.in').readline().split(None, 2)[0:2])
+ncol, nlign = headers.size('lect.in')
 if arguments["--zone"] ==  None:
     refzone = [0,ncol,0,nlign]
     col_beg,col_end,line_beg,line_end = 0 , ncol, 0., nlign
 else:
-    refzone = map(float,arguments["--clean"].replace(',',' ').split())
+    refzone = map(float,arguments["--zone"].replace(',',' ').split())
+    col_beg,col_end,line_beg,line_end = refzone[0],refzone[1],refzone[2],refzone[3]
 
 if arguments["--refstart"] == None:
     refstart = 0
@@ -120,7 +128,6 @@ if arguments["--refend"] == None:
     refend = nlign
 else:
     refend = int(arguments["--refend"])
-   col_beg,col_end,line_beg,line_end = refzone[0],refzone[1],refzone[2],refzone[3]
 
 if arguments["--rmspixel"] ==  None:
     rms = np.ones((nlign,ncol))
@@ -168,88 +175,35 @@ if radar is not None:
 else:
     elev = np.ones((nlign,ncol))
 
-# load cube of displacements
-cubei = np.fromfile(cubef,dtype=np.float32)
-cube = as_strided(cubei[:nlign*ncol*N])
-print 'Number of line in the cube: ', cube.shape
-maps = cube.reshape((nlign,ncol,N))
+# map cube of displacements, shared (not copied) by the processes fitting the dates
+maps = np.memmap(cubef,dtype=np.float32,mode='r',shape=(nlign,ncol,N))
+print 'Size of the cube: ', maps.shape
 
 # ini
 nfigure = 0
 
 if load == 'yes':
     gacos = np.zeros((nlign,ncol,N))
-    for i in xrange((N)):
-
-        print 'Read ',idates[i], i
-        infile = path+'{}.ztd'.format(int(idates[i]))
-        rsc = path+'{}.ztd.rsc'.format(int(idates[i]))
-        temp1 = path+'{}_temp1.tif'.format(int(idates[i]))
-        outtif = path+'{}_gacos.tif'.format(int(idates[i]))
-
-        # read .rsc
-        nncol = np.int(open(rsc).readlines()[0].split(None, 2)[1])
-        nnlign = np.int(open(rsc).readlines()[1].split(None, 2)[1])
-        xfirst = np.float(open(rsc).readlines()[6].split(None, 2)[1])
-        yfirst = np.float(open(rsc).readlines()[7].split(None, 2)[1])
-        xstep = np.float(open(rsc).readlines()[8].split(None, 2)[1])
-        ystep = np.float(open(rsc).readlines()[9].split(None, 2)[1])
-        geotransform = (xfirst, xstep, 0, yfirst, 0, ystep)
-        print 'Read .rsc and set Geotransform', geotransform
-        ztd_ = np.fromfile(infile, dtype='float32').reshape(nnlign,nncol)
-
-        # transform gacos format to samething humanily readeable
-        driver = gdal.GetDriverByName('GTiff')
-        ds = driver.Create(temp1, nncol, nnlign, 1, gdal.GDT_Float32)
-        band = ds.GetRasterBand(1)
-        band.WriteArray(ztd_)
-        ds.SetGeoTransform(geotransform)
-        srs = osr.SpatialReference()
-        srs.ImportFromEPSG(4326)
-        ds.SetProjection(srs.ExportToWkt())
-        band.FlushCache()
-        del ds,band
-
-        # crop, re-preoject and resample
-        if proj and crop is not False:
-            print "gdalwarp -overwrite -s_srs EPSG:4326 -t_srs EPSG:"+str(EPSG)+\
-            " -ts "+str(ncol)+" "+str(nlign)+" -r average -te "+str(crop[0])+" "+str(crop[1])+" "+str(crop[2])+" "+str(crop[3])+" "\
-            +temp1+" "+outtif+" -of GTiff"
-            r = subprocess.call("gdalwarp -overwrite -s_srs EPSG:4326 -t_srs EPSG:"+str(EPSG)+\
-                " -te "+str(crop[0])+" "+str(crop[1])+" "+str(crop[2])+" "+str(crop[3])+" "\
-                +" -ts "+str(ncol)+" "+str(nlign)+" -r average "+temp1+" "+outtif+" -of GTiff", shell=True)
-            if r != 0:
-                raise Exception("gdalwarp failed")
-
-        elif crop is not False and proj is False:
-            print "gdalwarp -overwrite -s_srs EPSG:4326-ts "+str(ncol)+" "+str(nlign)+" -r average \
-            -te "+str(crop[0])+" "+str(crop[1])+" "+str(crop[2])+" "+str(crop[3])+" "+temp1+" "+outtif+" -of GTiff"
-            r = subprocess.call("gdalwarp -overwrite -s_srs EPSG:4326 -ts "+str(ncol)+" "+str(nlign)+" -r average \
-                -te "+str(crop[0])+" "+str(crop[1])+" "+str(crop[2])+" "+str(crop[3])+" "+temp1+" "+outtif+" -of GTiff", shell=True)
-            if r != 0:
-                raise Exception("gdalwarp failed")
-
-        elif proj and crop is False:
-            print "gdalwarp -overwrite -s_srs EPSG:4326 -t_srs EPSG:"+str(EPSG)+" -ts "+str(ncol)+" "+str(nlign)+" -r average "+temp1+" "+outtif+" -of GTiff"
-            r = subprocess.call("gdalwarp -overwrite -s_srs EPSG:4326 -t_srs EPSG:"+str(EPSG)+" -ts "+str(ncol)+" "+str(nlign)+" -r average "+temp1+" "+outtif+" -of GTiff", shell=True)
-            if r != 0:
-                raise Exception("gdalwarp failed")
-
-        else:
-            print "gdalwarp -overwrite -ts "+str(ncol)+" "+str(nlign)+" -r average "+temp1+" "+outtif+" -of GTiff"
-            r = subprocess.call("gdalwarp -overwrite -ts "+str(ncol)+" "+str(nlign)+" -r average "+temp1+" "+outtif+" -of GTiff", shell=True)
-            if r != 0:
-                raise Exception("gdalwarp failed")
-
-        # del temporary files
-        cmd = 'rm -f {}'.format(temp1)
-        os.system(cmd)
-
-        # open gacos
-        ds = gdal.Open(path+'{}_gacos.tif'.format(int(idates[i])), gdal.GA_ReadOnly)
-        band = ds.GetRasterBand(1)
-        gacos[:,:,i] = band.ReadAsArray()*gacos2data
-        del ds,band
+    # crop, re-project and resample each date in memory, dates in parallel
+    if proj and crop is not False:
+        print 'Warp GACOS to EPSG:{0}, {1}x{2}, bounds {3}'.format(EPSG,ncol,nlign,crop)
+    elif crop is not False:
+        print 'Warp GACOS to {0}x{1}, bounds {2}'.format(ncol,nlign,crop)
+    elif proj:
+        print 'Warp GACOS to EPSG:{0}, {1}x{2}'.format(EPSG,ncol,nlign)
+    else:
+        print 'Warp GACOS to {0}x{1}'.format(ncol,nlign)
+    work = [path+'{}.ztd'.format(int(idates[i])) for i in xrange((N))]
+    # dates already resampled on this grid (e.g. by a previous run) are read from the cache
+    warp = partial(gacosmaps.cached_warp, width=ncol, length=nlign, epsg=EPSG if proj else None, crop=crop)
+    pool = multiprocessing.Pool(processes=min(nproc,N))
+    try:
+        for i, ztd in enumerate(pool.imap(warp, work)):
+            print 'Read ',idates[i], i
+            gacos[:,:,i] = ztd*gacos2data
+    finally:
+        pool.close()
+        pool.join()
 
     # Ref atmo models to the reference image
     cst = np.copy(gacos[:,:,imref])
@@ -283,30 +237,66 @@ if load == 'yes':
     gacos.flatten().astype('float32').tofile(fid)
     fid.close()
 
-# # load gacos cube
-gcubei = np.fromfile(loadf,dtype=np.float32)
-gcube = as_strided(gcubei[:nlign*ncol*N])
-# why did you mask gacos2data here? put gacos2data=1 if you already did the conversion before
-gacos = gcube.reshape((nlign,ncol,N))*gacos2data
-
-# Apply correction
-maps_flat = np.zeros((nlign,ncol,N))
-model_flat = np.zeros((nlign,ncol,N))
+# # load gacos cube, shared (not copied) by the processes fitting the dates
+gcube = np.memmap(loadf,dtype=np.float32,mode='r',shape=(nlign,ncol,N))
 
-# initialise variance
-var = np.zeros((N))
+# Apply correction: each process writes its dates in the output cubes
+maps_flat = np.memmap('depl_cumule_gacos',dtype=np.float32,mode='w+',shape=(nlign,ncol,N))
+model_flat = np.memmap('gacos_ref',dtype=np.float32,mode='w+',shape=(nlign,ncol,N))
 
-for l in xrange((N)):
+# maximum number of pixels used for the fit of each date
+nsamp = 1000000
+# pixel coordinates relative to the empirical estimation zone
+az_map = (np.arange(nlign) - line_beg)[:,np.newaxis]
+rg_map = (np.arange(ncol) - col_beg)[np.newaxis,:]
 
-  data = as_strided(maps[:,:,l]) 
-  data_flat = as_strided(maps_flat[:,:,l])
-  model = as_strided(gacos[:,:,l])
-  
-  if l == imref:
-    # check if data and model are set to zeros
-    print "REF DATE:", np.nanmean(data-model)
-  
-  else:
+if fitmodel == 'yes' or ramp == 'quad':
+    terms = ['az**2','az','r**2','r']
+elif ramp == 'lin':
+    terms = ['az','r']
+else:
+    terms = []
+
+def ramp_terms(az,rg):
+    ''' Return the ramp functions (without constant) at coordinates az, rg '''
+    t = {'az**2': lambda: az**2, 'az': lambda: az, 'r**2': lambda: rg**2, 'r': lambda: rg}
+    return [t[name]() for name in terms]
+
+def design(index,model):
+    ''' Return the matrix of the functions [ramp, cst, (gacos)] at pixels index '''
+    az, rg = index[0] - line_beg, index[1] - col_beg
+    cols = ramp_terms(az,rg) + [np.ones(len(az))]
+    if fitmodel == 'yes':
+        cols.append(model[index])
+    return np.column_stack(cols)
+
+def subsample(index):
+    step = int(len(index[0])/nsamp) + 1
+    return index[0][::step], index[1][::step]
+
+def fit(G,d,sigma,gref,dref):
+    ''' Weighted least-squares solution of G x = d such that gref x = dref
+    (the weighted mean of the corrected data is zero in the ref area):
+    the constant is eliminated and the other parameters solved in closed form '''
+    kc = len(terms)
+    free = [k for k in xrange(G.shape[1]) if k != kc]
+    pars = np.zeros(G.shape[1])
+    if len(free) > 0:
+        A = (G[:,free] - gref[free])/sigma[:,np.newaxis]
+        pars[free] = lst.lstsq(A,(d - dref)/sigma)[0]
+    pars[kc] = dref - np.dot(gref[free],pars[free])
+    return pars
+
+def correct_date(l):
+    ''' Fit data = f*gacos + ramp for date l, write the corrected data and
+    the flatten model in the output cubes and return the RMS of the corrected data '''
+    data = np.array(maps[:,:,l],dtype=np.float64)
+    model = np.array(gcube[:,:,l],dtype=np.float64)*gacos2data
+
+    if l == imref:
+        # check if data and model are set to zeros
+        print "REF DATE:", np.nanmean(data-model)
+        return 0.
 
     _los_map = np.copy(data)
     _los_map[np.logical_or(data==0,data>=9990)] = np.float('NaN')
@@ -318,240 +308,87 @@ for l in xrange((N)):
     else:
         maxtopo,mintopo = 1e8, -1e8
 
-    # index = np.nonzero(data>2)
-    # data[index] = np.float('NaN')
-    # plt.imshow(data)
-    # plt.show()
-    # sys.exit()
+    pix_lin, pix_col = np.arange(nlign)[:,np.newaxis], np.arange(ncol)[np.newaxis,:]
+    valid = ~np.isnan(data) & (data<losmax) & (data>losmin) & (rms<threshold_rms) & (rms>1.e-6) & \
+        (model<gacosmax) & (model>gacosmin) & (elev<maxtopo) & (elev>mintopo) & (data!=0.0) & (model!=0.0) & \
+        (pix_col>col_beg) & (pix_col<col_end)
 
-    funct = 0.
-    pix_lin, pix_col = np.indices((nlign,ncol))
-   
     # find proportionality between data and model
-    index = np.nonzero(
-        np.logical_and(~np.isnan(data),
-        np.logical_and(pix_lin>line_beg,
-        np.logical_and(pix_lin<line_end,
-        np.logical_and(data<losmax,
-        np.logical_and(data>losmin,
-        np.logical_and(rms<threshold_rms,
-        np.logical_and(rms>1.e-6,
-        np.logical_and(model<gacosmax,
-        np.logical_and(model>gacosmin,
-        np.logical_and(elev<maxtopo,
-        np.logical_and(elev>mintopo,
-        np.logical_and(data!=0.0,
-        np.logical_and(model!=0.0,
-        np.logical_and(pix_col>col_beg, pix_col<col_end
-        )))))))))))))))
-
-    indexref = np.nonzero(
-        np.logical_and(~np.isnan(data),
-        np.logical_and(pix_lin>refstart,
-        np.logical_and(pix_lin<refend,
-        np.logical_and(data<losmax,
-        np.logical_and(data>losmin,
-        np.logical_and(rms<threshold_rms,
-        np.logical_and(rms>1.e-6,
-        np.logical_and(model<gacosmax,
-        np.logical_and(model>gacosmin,
-        np.logical_and(elev<maxtopo,
-        np.logical_and(elev>mintopo,
-        np.logical_and(data!=0.0,
-        np.logical_and(model!=0.0,
-        np.logical_and(pix_col>col_beg, pix_col<col_end
-        )))))))))))))))
-
-    temp = np.array(index).T
-    x = temp[:,0]; y = temp[:,1]
-    los_clean = data[index].flatten()
-    model_clean = model[index].flatten()
-   
-    # compute average phase in the ref area 
+    index = subsample(np.nonzero(valid & (pix_lin>line_beg) & (pix_lin<line_end)))
+    indexref = subsample(np.nonzero(valid & (pix_lin>refstart) & (pix_lin<refend)))
+    los_clean = data[index]
+    model_clean = model[index]
+
+    # data = f*gacos + ramp or data - gacos = ramp
+    G = design(index,model)
+    d = np.copy(los_clean)
+    Gref = design(indexref,model)
+    dref = data[indexref]
+    if fitmodel != 'yes':
+        d -= model_clean
+        dref = dref - model[indexref]
+
+    # compute average phase in the ref area
     # we want los ref area to be zero
-    los_ref = data[indexref].flatten() - model[indexref].flatten()
-    rms_ref = rms[indexref].flatten()
-    amp_ref = 1./rms_ref
+    amp_ref = 1./rms[indexref]
     amp_ref = amp_ref/np.nanpercentile(amp_ref,99)
     print 'Ref area set to zero:', refstart,refend
     # weigth average of the phase
-    rg_ref, az_ref,model_ref = np.nanmean(pix_col[indexref]),np.nanmean(pix_lin[indexref]),np.nanmean(model[indexref])
-    cst = np.nansum(los_ref*amp_ref) / np.nansum(amp_ref)
+    cst = np.nansum(dref*amp_ref) / np.nansum(amp_ref)
+    gref = np.nansum(Gref*amp_ref[:,np.newaxis],axis=0) / np.nansum(amp_ref)
     print 'Average phase within ref area:', cst
-    logger.info('Average rg: {0}, az:{1}, topo:{2}, within ref area'.format(np.int(rg_ref), np.int(az_ref), np.int(model_ref)))
-
-    # digitize data in bins, compute median and std
-    bins = np.arange(gacosmin,gacosmax,abs(gacosmax-gacosmin)/500.)
-    inds = np.digitize(model_clean,bins)
-    modelbins = []
-    losbins = []
-    losstd = []
-    xbins, ybins = [], []
-    for j in range(len(bins)-1):
-            uu = np.flatnonzero(inds == j)
-            if len(uu)>500:
-                modelbins.append(bins[j] + (bins[j+1] - bins[j])/2.)
-
-                indice = np.flatnonzero(np.logical_and(los_clean[uu]>np.percentile(\
-                    los_clean[uu],10.),los_clean[uu]<np.percentile(los_clean[uu],90.)))
-
-                losstd.append(np.std(los_clean[uu][indice]))
-                losbins.append(np.median(los_clean[uu][indice]))
-                xbins.append(np.median(x[uu][indice]))
-                ybins.append(np.median(y[uu][indice]))
-
-    losbins = np.array(losbins)
-    losstd = np.array(losstd)
-    modelbins = np.array(modelbins)
-    xbins, ybins = np.array(xbins),np.array(ybins)
-
-    if (ramp == 'cst' and  fitmodel=='no'):
-        
-        a = cst
-        print 'Remove cst: %f for date: %i'%(a,idates[l])
-
-        remove_ramp = np.ones((nlign,ncol)).reshape((nlign,ncol))*cst
-        remove_ramp[model==0.] = 0.
-        remove_ramp[np.isnan(data)] = np.float('NaN')
-        
-        # data = gacos + cst
-        remove = remove_ramp + model
-       
-        # Compute ramp for data = f(model) 
-        functbins = a
-        funct = a
-        # set coef gacos to 1
-        f = 1
 
-    elif (ramp == 'lin' and  fitmodel=='no'):
-        # here we want to minimize data-gacos = ramp
-        # invers both digitized data and ref frame together
-        d = np.hstack([losbins-modelbins,cst])
-        # give a strong weigth to ref frame
-        sigmad = np.hstack([losstd,1e-3])       
-
-        G=np.zeros((len(d),3))
-        G[:-1,0] = xbins
-        G[:-1,1] = ybins
-        G[:,2] = 1
-        G[-1,0] = az_ref
-        G[-1,1] = rg_ref
-
-        x0 = lst.lstsq(G,d)[0]
-        # print x0
-        _func = lambda x: np.sum(((np.dot(G,x)-d)/sigmad)**2)
-        _fprime = lambda x: 2*np.dot(G.T/sigmad, (np.dot(G,x)-d)/sigmad)
-        pars = opt.fmin_slsqp(_func,x0,fprime=_fprime,iter=200,full_output=True,iprint=0)[0]
-        a = pars[0]; b = pars[1]; c = pars[2]
-        print 'Remove ramp  %f az  + %f r + %f for date: %i'%(a,b,c,idates[l])
-            
-        # Compute ramp for data = f(model)
-        functbins = a*xbins + b*ybins + c
-        funct = a*x + b*y + c
+    # fit, then fit again without the 10% largest and smallest residuals
+    sigma = rms[index]
+    pars = fit(G,d,sigma,gref,cst)
+    res = d - np.dot(G,pars)
+    kk = np.flatnonzero(np.logical_and(res>np.percentile(res,10.),res<np.percentile(res,90.)))
+    if len(kk) > G.shape[1]:
+        pars = fit(G[kk],d[kk],sigma[kk],gref,cst)
+
+    kc = len(terms)
+    if fitmodel == 'yes':
+        f = pars[-1]
+        print 'Remove ramp %s + %f model for date: %i'%(' + '.join(['%f %s'%(p,t) for p,t in zip(pars[:kc],terms)] + ['%f'%(pars[kc])]),f,idates[l])
+    else:
         # set coef gacos to 1
         f = 1
+        print 'Remove ramp %s for date: %i'%(' + '.join(['%f %s'%(p,t) for p,t in zip(pars[:kc],terms)] + ['%f'%(pars[kc])]),idates[l])
+
+    # compute ramp
+    remove_ramp = np.zeros((nlign,ncol)) + pars[kc]
+    for p, t in zip(pars[:kc],ramp_terms(az_map,rg_map)):
+        remove_ramp += p*t
+    remove_ramp[model==0.] = 0.
+    remove_ramp[np.isnan(data)] = np.float('NaN')
 
-        # build total G matrix
-        G=np.zeros((len(data.flatten()),3))
-        for i in xrange(nlign):
-            G[i*ncol:(i+1)*ncol,0] = i - line_beg 
-            G[i*ncol:(i+1)*ncol,1] = np.arange(ncol) - col_beg
-        G[:,2] = 1
-
-        # compute ramp
-        remove_ramp = np.dot(G,pars).reshape(nlign,ncol)
-        remove_ramp[model==0.] = 0.
-        remove_ramp[np.isnan(data)] = np.float('NaN')
-        
-        # data = gacos + (a*rg + b*az + cst) 
-        remove = model + remove_ramp
-
-    elif fitmodel=='yes':
-        # invers both digitized data and ref frame together
-        # here we invert data = a*gacos + ramp
-        d = np.hstack([losbins,cst])
-        # give a strong weigth to ref frame
-        sigmad = np.hstack([losstd,1e-3])       
-            
-        G=np.zeros((len(d),6))
-        G[:-1,0] = xbins**2
-        G[:-1,1] = xbins
-        G[:-1,2] = ybins**2
-        G[:-1,3] = ybins
-        G[:,4] = 1
-        G[:-1,5] = modelbins
-        G[-1,0] = az_ref**2
-        G[-1,1] = az_ref
-        G[-1,2] = rg_ref**2
-        G[-1,3] = rg_ref
-        G[-1,5] = modelref
-
-        x0 = lst.lstsq(G,d)[0]
-        # print x0
-        _func = lambda x: np.sum(((np.dot(G,x)-d)/sigmad)**2)
-        _fprime = lambda x: 2*np.dot(G.T/sigmad, (np.dot(G,x)-d)/sigmad)
-        pars = opt.fmin_slsqp(_func,x0,fprime=_fprime,iter=200,full_output=True,iprint=0)[0]
-        a = pars[0]; b = pars[1]; c = pars[2]; d = pars[3]; e = pars[4]; f = pars[5]
-        print 'Remove ramp %f az**2, %f az  + %f r**2 + %f r + %f + %f model for date: %i'%(a,b,c,d,e,f,idates[l])
-
-        #Compute ramp for data = f(model)
-        funct = a*x**2 + b*x + c*y**2 + d*y + e
-        functbins = a*xbins**2 + b*xbins + c*ybins**2 + d*ybins + e
-
-        # build total G matrix
-        G=np.zeros((len(data.flatten()),6))
-        for i in xrange(nlign):
-                G[i*ncol:(i+1)*ncol,0] = (i - line_beg)**2
-                G[i*ncol:(i+1)*ncol,1] = i - line_beg
-                G[i*ncol:(i+1)*ncol,2] = np.arange((ncol - col_beg))**2
-                G[i*ncol:(i+1)*ncol,3] = np.arange(ncol - col_beg)
-        G[:,4] = 1
-        G[:,5] = model.flatten()
-
-        # data = a*gacos + ramp
-        remove = np.dot(G,pars).reshape(nlign,ncol)
-        remove[model==0.] = 0.
-        remove[np.isnan(data)] = np.float('NaN')
-
-        # build total G matrix
-        G=np.zeros((len(data.flatten()),5))
-        for i in xrange(nlign):
-            G[i*ncol:(i+1)*ncol,0] = (i - line_beg)**2
-            G[i*ncol:(i+1)*ncol,1] = i - line_beg
-            G[i*ncol:(i+1)*ncol,2] = np.arange((ncol - col_beg))**2
-            G[i*ncol:(i+1)*ncol,3] = np.arange(ncol - col_beg)
-        G[:,4] = 1
-
-        # ramp only
-        remove_ramp = np.dot(G,pars[:-1]).reshape(nlign,ncol)
-        remove_ramp[model==0.] = 0.
-        remove_ramp[np.isnan(data)] = np.float('NaN')
-    
     # correction
-    # data_flat = data - (gacos + ramp)
-    data_flat[:,:] = data - remove
+    # data_flat = data - (f*gacos + ramp)
+    data_flat = data - (f*model + remove_ramp)
     data_flat[np.isnan(data)] = np.float('NaN')
     data_flat[data_flat>999.]= np.float('NaN')
-    
+    maps_flat[:,:,l] = data_flat
+
     # model = gacos + ramp
-    model_flat[:,:,l] = gacos[:,:,l] + remove_ramp
- 
+    model_flat[:,:,l] = model + remove_ramp
+
     # Refer data again (just to check)
-    rms_ref = rms[indexref].flatten()
-    amp_ref = 1./rms_ref
+    amp_ref = 1./rms[indexref]
     amp_ref = amp_ref/np.nanmax(amp_ref)
     cst = np.nansum(data_flat[indexref]*amp_ref) / np.nansum(amp_ref)
-    print 'Average phase within ref area, iter=2:', cst 
+    print 'Average phase within ref area, iter=2:', cst
     data_flat = data_flat - cst
 
     # compute variance flatten data
-    var[l] = np.sqrt(np.nanmean(data_flat**2))
-    print 'Var: ', var[l]
+    var = np.sqrt(np.nanmean(data_flat**2))
+    print 'Var: ', var
 
     if plot == 'yes':
+        # Compute ramp for data = f(model)
+        funct = np.dot(G[:,:kc+1],pars[:kc+1])
+
         # initiate figure depl
-        fig = plt.figure(nfigure,figsize=(14,7))
-        nfigure += 1
+        fig = plt.figure(l+1,figsize=(14,7))
         ax = fig.add_subplot(3,2,1)
         im = ax.imshow(data,cmap=cmap,vmax=losmax,vmin=losmin)
         divider = make_axes_locatable(ax)
@@ -566,7 +403,7 @@ for l in xrange((N)):
         cax = divider.append_axes("right", size="5%", pad=0.05)
         plt.colorbar(im, cax=cax)
         ax.set_title('Model {}'.format(idates[l]),fontsize=6)
-        
+
         # initiate figure depl
         ax = fig.add_subplot(3,2,3)
         im = ax.imshow(model_flat[:,:,l],cmap=cmap)
@@ -586,7 +423,6 @@ for l in xrange((N)):
         ax = fig.add_subplot(3,2,5)
         g = np.linspace(np.nanmax(model_clean),np.nanmin(model_clean),100)
         ax.scatter(model_clean,los_clean - funct, s=0.005, alpha=0.1, rasterized=True)
-        ax.plot(modelbins,losbins - functbins,'-r', lw =.5)
         ax.plot(g,f*g,'-r', lw =4.)
         ax.set_ylim([(los_clean-funct).min(),(los_clean-funct).max()])
         ax.set_xlim([model_clean.min(),model_clean.max()])
@@ -597,16 +433,24 @@ for l in xrange((N)):
         fig.tight_layout()
         fig.savefig('{}-gacos-cor.eps'.format(idates[l]), format='EPS',dpi=150)
         plt.show()
-        # sys.exit()
-
-# save new cube
-fid = open('depl_cumule_gacos', 'wb')
-maps_flat.flatten().astype('float32').tofile(fid)
-fid.close()
-# save gacos ref spatialy
-fid = open('gacos_ref', 'wb')
-model_flat.flatten().astype('float32').tofile(fid)
-fid.close()
+
+    return var
+
+if plot == 'yes':
+    # figures are displayed one date after the other
+    var = np.array(map(correct_date, xrange(N)))
+else:
+    pool = multiprocessing.Pool(processes=min(nproc,N))
+    try:
+        var = np.array(pool.map(correct_date, xrange(N)))
+    finally:
+        pool.close()
+        pool.join()
+
+# save new cube and gacos ref spatialy
+maps_flat.flush()
+model_flat.flush()
+del maps_flat, model_flat
 
 # save rms
 np.savetxt('rms_gacos.txt', var, header='# date   |   RMS', fmt=('%.8f'))
@@ -19,8 +19,8 @@ usage: invert_ramp_topo_unw.py --int_list=<path> [--refstart=<value>] [--refend=
 [--estim=yes/no] [--mask=<path>] [--threshold_mask=<value>]  \
 [--cohpixel=<yes/no>] [--threshold_coh=<value>] [--ibeg_mask=<value>] [--iend_mask=<value>] \
 [--perc=<value>] [--perc_topo=<value>] [--perc_slope=<value>] [--samp=<value>] \
-[--plot=<yes/no>] [--suffix_output=<value>]\
-[<ibeg>] [<iend>] [<jbeg>] [<jend>] [--nproc=<nb_cores>] 
+[--plot=<yes/no>] [--suffix_output=<value>] [--plan=<yes/no>]\
+[<ibeg>] [<iend>] [<jbeg>] [<jend>] [--nproc=<nb_cores>] [--queue=<path>] [--worker=<path>] [--lease=<value>] [--telemetry=<path>]
 
 --int_list PATH       Text file containing list of interferograms dates in two colums, $data1 $date2
 --int_path PATh       Relative path to input interferograms directory
@@ -38,6 +38,11 @@ usage: invert_ramp_topo_unw.py --int_list=<path> [--refstart=<value>] [--refend=
 --nfit VALUE          fit degree in azimuth or in elevation
 --ivar VALUE          define phase/elevation relationship: ivar=0 function of elevation, ivar=1 crossed function of azimuth and elevation
 --nproc=<nb_cores>    Use <nb_cores> local cores to create delay maps [Default: 4]
+--queue=<path>        Shared directory where the estimations and corrections are sent instead of the local pool (see --worker)
+--worker=<path>       Run <nb_cores> workers pulling tasks from the shared directory <path> until the coordinator
+                      (same command with --queue=<path>) is done. Can be run on any node
+--lease=<value>       Seconds without news from a worker before its task is given to another one [default: 600]
+--telemetry=<path>    Append timing and resources of each estimation and correction to the JSON-lines files <path>.<host>.<pid> (see telemetry_summary.py)
 
 
 if ivar=0 and nfit=0, add linear elev. term (z) to ramps estimation defined by the flat argument such as:
@@ -71,6 +76,9 @@ if ivar=1 and nfit=1, add quadratic cross function of elev. (z) and azimuth to r
 --samp=<value>        Undersampling for empirical estimation [default: 2]
 --plot yes/no         If yes, plot figures for each ints [default: no]
 --suffix_output value Suffix output file name $prefix$date1-$date2$suffix$suffix_output [default:_corrunw]
+--plan yes/no         If yes, write the correction in the plan $prefix$date1-$date2$suffix$suffix_output.unw.plan instead of
+                      writing the corrected IFG (ROI_PAC and GAMMA). Planned input IFGs are read with their corrections.
+                      Corrected IFGs are written in one pass with apply_plan.py [default: no]
 --ibeg VALUE          Line number bounding the estimation zone [default: 0]
 --iend VALUE          Line number bounding the estimation zone [default: mlines]
 --jbeg VALUE          Column numbers bounding the estimation zone [default: 0]
@@ -84,7 +92,7 @@ gdal.UseExceptions()
 
 # system
 from os import path, environ
-import os
+import os, sys
 
 # plot
 import matplotlib
@@ -110,6 +118,10 @@ try:
 except:
     import docopt
 import shutil
+import rmg
+import corrections
+import workqueue
+import telemetry
 
 from contextlib import contextmanager
 from functools import wraps, partial
@@ -1367,18 +1379,17 @@ def empirical_cor(kk):
         rscfile=int_path + folder + prefix + str(date1) + '-' + str(date2) + suffix + rlook + '.unw.rsc'
         infile=int_path + folder + prefix + str(date1) + '-' + str(date2) + suffix + rlook + '.unw'
 
-        checkinfile(infile)
+        if not corrections.planned(infile):
+            checkinfile(infile)
         checkinfile(rscfile)
 
-        ds = gdal.Open(infile, gdal.GA_ReadOnly)
-        # Get the band that have the data we want
-        ds_band1 = ds.GetRasterBand(1)
-        ds_band2 = ds.GetRasterBand(2)
+        # read both bands in one pass (with the corrections planned on infile, if any)
+        amp_map, phi_map = corrections.read(infile)
+        lines, cols = phi_map.shape
 
         los_map = np.zeros((mlines,mcols))
-        los_map[:ds.RasterYSize,:ds.RasterXSize] = ds_band2.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)[:mlines,:mcols]
+        los_map[:lines,:cols] = phi_map[:mlines,:mcols]
         # los_map[los_map==0] = np.float('NaN')
-        lines, cols = ds.RasterYSize, ds.RasterXSize
 
 
     elif sformat == 'GTIFF':
@@ -1399,8 +1410,9 @@ def empirical_cor(kk):
         # par_file = ref 
         lines,cols = gm.readpar(int_path)
         infile= int_path + prefix + str(date1) + '_' + str(date2) + suffix + rlook + '.unw'
-        checkinfile(infile)
-        los_map = gm.readgamma(infile,int_path)
+        if not corrections.planned(infile):
+            checkinfile(infile)
+        los_map = corrections.read(infile, 'gamma', (lines,cols))[1]
 
     logger.info('lines:{0}, cols:{1}, IFG:{2}:'.format(lines, cols, idate))
 
@@ -1411,7 +1423,7 @@ def empirical_cor(kk):
     if rmsf=='yes':
         try:
             if sformat == 'ROI_PAC':
-                rms_map[:ds.RasterYSize,:ds.RasterXSize] = ds_band1.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)[:mlines,:mcols]
+                rms_map[:lines,:cols] = amp_map[:mlines,:mcols]
                 k = np.nonzero(np.logical_or(rms_map==0.0, rms_map==9999))
                 rms_map[k] = float('NaN')
             elif sformat == 'GAMMA':
@@ -1639,13 +1651,9 @@ def apply_cor(kk, sp, sp_inv):
         outfile = int_path + folder + prefix + str(date1) + '-' + str(date2) + suffix +  suffout +  rlook + '.unw'  
         outrsc = int_path + folder + prefix + str(date1) + '-' + str(date2) + suffix +  suffout +  rlook + '.unw.rsc' 
         
-        ds = gdal.Open(infile, gdal.GA_ReadOnly)
-        # Get the band that have the data we want
-        ds_band1 = ds.GetRasterBand(1)
-        ds_band2 = ds.GetRasterBand(2)
-        los_map = ds_band2.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)
-        rms_map = ds_band1.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)
-        lines, cols = ds.RasterYSize, ds.RasterXSize
+        # copy-on-write views of both bands (with the corrections planned on infile, if any)
+        rms_map, los_map = corrections.read(infile)
+        lines, cols = los_map.shape
 
     elif sformat == 'GTIFF':
 
@@ -1663,7 +1671,7 @@ def apply_cor(kk, sp, sp_inv):
         outfile = out_path + prefix + str(date1) + '_' + str(date2) + suffix +  suffout + rlook + '.unw' 
         # par_file = ref 
         lines,cols = gm.readpar(int_path)
-        los_map = gm.readgamma(infile,int_path)
+        los_map = corrections.read(infile, 'gamma', (lines,cols))[1]
         
         if rmsf == 'yes':
           rmsfile=  int_path + str(date1) + '_' + str(date2) + '.filt.cc'
@@ -1719,15 +1727,20 @@ def apply_cor(kk, sp, sp_inv):
         corr_inv = corr_inv + cst
     logger.info('Iterate ref frame: {}'.format(cst))
 
-    if sformat == 'ROI_PAC':
-        dst_ds = driver.Create(outfile, cols, lines, 2, gdal.GDT_Float32)
-        dst_band1 = dst_ds.GetRasterBand(1)
-        dst_band2 = dst_ds.GetRasterBand(2)
-        dst_band1.WriteArray(rms_map,0,0)
-        dst_band2.WriteArray(flatlos,0,0)
-        shutil.copy(rscfile,outrsc)
-        dst_band1.FlushCache()
-        dst_band2.FlushCache()
+    if plan == 'yes' and sformat in ('ROI_PAC', 'GAMMA'):
+        # los - corr_inv, applied later with the other corrections of infile
+        sol = np.copy(sp_inv[kk,3:])
+        if not np.isnan(cst):
+            sol[8] += cst
+        if sformat == 'ROI_PAC':
+            p = corrections.plan(infile)
+        else:
+            p = corrections.plan(infile, 'gamma', (lines,cols))
+        p.add(corrections.Polynomial(sol, elevation=elevmodel))
+        p.save(outfile)
+
+    elif sformat == 'ROI_PAC':
+        rmg.writermg(outfile, rms_map, flatlos, rscfile=rscfile)
 
     elif sformat == 'GTIFF':
         dst_ds = driver.Create(outfile, cols, lines, 1, gdal.GDT_Float32)
@@ -1738,8 +1751,7 @@ def apply_cor(kk, sp, sp_inv):
         dst_band2.FlushCache()
 
     elif sformat == 'GAMMA':
-        fid = open(outfile, 'wb')
-        flatlos.flatten().astype('>f4').tofile(fid)
+        gm.writegamma(outfile, flatlos)
 
     fig = plt.figure(5,figsize=(9,4))
 
@@ -1948,11 +1960,29 @@ if arguments["--suffix_output"] ==  None:
 else:
     suffout = arguments["--suffix_output"]
 
+if arguments["--plan"] ==  None:
+    plan = 'no'
+else:
+    plan = arguments["--plan"]
+
 if arguments["--samp"] == None:
     samp = 2
 else:
     samp = int(arguments["--samp"])
 
+telefile = arguments["--telemetry"]
+if telefile is not None:
+    telefile = os.path.abspath(telefile)
+
+if arguments["--lease"] == None:
+    lease = 600.
+else:
+    lease = float(arguments["--lease"])
+if arguments["--queue"] == None:
+    queue = None
+else:
+    queue = workqueue.WorkQueue(arguments["--queue"], lease=lease)
+
 # print(nproc, plot)
 # sys.exit()
 
@@ -2031,11 +2061,8 @@ if radar is not None:
 
         elif sformat == 'ROI_PAC':
             driver = gdal.GetDriverByName("roi_pac")
-            ds = gdal.Open(radar, gdal.GA_ReadOnly)
-            ds_band2 = ds.GetRasterBand(2)
-            mlines,mcols = ds.RasterYSize, ds.RasterXSize
-            elev_map = ds_band2.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)
-            del ds
+            elev_map = np.array(rmg.openrmg(radar).band(2))
+            mlines,mcols = elev_map.shape
         
         elif sformat == 'GAMMA':
             import gamma as gm
@@ -2072,6 +2099,16 @@ else:
     slope_map = np.zeros((mlines,mcols))
     minslope = -1
 
+# elevation of the planned corrections
+elevmodel = None
+if radar is not None:
+    if os.path.splitext(radar)[1] == '.r4':
+        elevmodel = corrections.RasterModel(radar, (mlines,mcols))
+    elif sformat == 'ROI_PAC':
+        elevmodel = corrections.RMGModel(radar)
+    elif sformat == 'GAMMA':
+        elevmodel = corrections.RasterModel(radar, (mlines,mcols), '>f4')
+
 # open mask file
 if maskfile is not None:
     fid = open(maskfile,'r')
@@ -2127,6 +2164,31 @@ pix_az, pix_rg = np.indices((mlines,mcols))
 spint = np.zeros((Nifg,16))
 M = 13 # harcoding of the number of cols....
 
+def ifglabel(kk,*args,**kwargs):
+    ''' Return date1-date2 of IFG kk '''
+    return '{0}-{1}'.format(date_1[kk], date_2[kk])
+
+def traced(name):
+    ''' Return the function name, recording each call with --telemetry '''
+    if telefile is None:
+        return globals()[name]
+    return telemetry.Traced(globals()[name], name, telefile, label=ifglabel)
+
+def worker(i):
+    ''' Run the tasks of the shared queue '''
+    functions = dict((name, traced(name)) for name in ('empirical_cor', 'apply_cor'))
+    workqueue.work(workqueue.WorkQueue(arguments["--worker"], lease=lease), functions)
+
+if arguments["--worker"] != None:
+    logger.info('Start {0} workers on {1}'.format(nproc,arguments["--worker"]))
+    with poolcontext(processes=nproc) as pool:
+        pool.map(worker, range(nproc))
+    sys.exit()
+
+if queue is not None:
+    queue.start()
+    logger.info('Tasks sent to {0}. Start workers with: {1} --worker={0}'.format(queue.dirname,' '.join(sys.argv)))
+
 # fill dates
 spint[:,0],spint[:,1] = date_1, date_2 
 
@@ -2151,8 +2213,11 @@ if estim=='yes':
     with TimeIt():
         # for kk in range(Nifg):
         work = range(Nifg)
-        with poolcontext(processes=nproc) as pool:
-            results = pool.map(empirical_cor, work)
+        if queue is not None:
+            results = queue.map('empirical_cor', [(kk,) for kk in work])
+        else:
+            with poolcontext(processes=nproc) as pool:
+                results = pool.map(traced('empirical_cor'), work)
         output.append(results)
 
         for kk in range(Nifg):
@@ -2272,5 +2337,9 @@ print()
 # go 
 with TimeIt():
     work = range(Nifg)
-    with poolcontext(processes=nproc) as pool:
-        pool.map(partial(apply_cor, sp=spint, sp_inv=spint_inv), work)
+    if queue is not None:
+        queue.map('apply_cor', [(kk,) for kk in work], kwargs={'sp': spint, 'sp_inv': spint_inv})
+        queue.stop()
+    else:
+        with poolcontext(processes=nproc) as pool:
+            pool.map(partial(traced('apply_cor'), sp=spint, sp_inv=spint_inv), work)
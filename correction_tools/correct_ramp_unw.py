@@ -18,7 +18,7 @@ usage: correct_ramp_unw.py --int_list=<path> --int_path=<path> \
 --prefix=<value> --suffix=<value> --rlook=<value>  \
 [--suffix_range_file=<path>] [--preffix_range_file=<path>] \
 [--suffix_azimuth_file=<path>] [--preffix_azimuth_file=<path>] \
-[--suffix_output=<value>] [--rlook_factor=<path>] [--plot=<yes/no>]
+[--suffix_output=<value>] [--rlook_factor=<path>] [--plot=<yes/no>] [--plan=<yes/no>]
 
 --int_list PATH         Text file containing list of interferograms dates in two colums, $data1 $date2
 --int_path PATh         Absolute path to interferograms directory
@@ -32,6 +32,8 @@ usage: correct_ramp_unw.py --int_list=<path> --int_path=<path> \
 --suffix_output value   Suffix output file name $prefix$date1-$date2$suffix_output [default: '']
 --rlook_factor  value   Look factor between wrapped correction and unwrapped file 
 --plot yes/no           If yes, plot figures for each ints [default: no]
+--plan yes/no           If yes, write the ramps in the plan $prefix$date1-$date2$suffix_output_$rlookrlks.unw.plan instead of
+                        writing the corrected IFG. Corrected IFGs are written in one pass with apply_plan.py [default: no]
 """
 
 
@@ -62,6 +64,7 @@ gdal.UseExceptions()
 
 from nsbas import docopt
 import shutil
+import corrections
 
 # read arguments
 arguments = docopt.docopt(__doc__)
@@ -115,6 +118,11 @@ if arguments["--plot"] ==  None:
 else:
     plot = str(arguments["--plot"])
 
+if arguments["--plan"] ==  None:
+    plan = 'no'
+else:
+    plan = str(arguments["--plan"])
+
 
 print
 # read int
@@ -143,6 +151,14 @@ for kk in xrange((kmax)):
         print 'Open range file:', rgfile
         rg_a, rg_b, rg_c, rg_d, rg_f, rg_g = np.loadtxt(rgfile,comments="#",usecols=(0,1,2,3,4,5),unpack=True,dtype='f,f,f,f,f,f')
 
+    if plan == 'yes':
+        # ramps removed later with the other corrections of infile
+        p = corrections.plan(infile)
+        p.add(corrections.Ramp([rg_a, rg_b, rg_c, rg_d, rg_f, rg_g], 1, factor))
+        p.add(corrections.Ramp([az_a, az_b, az_c, az_d, az_f, az_g], 0, factor))
+        p.save(folder + prefix + str(date1) + '-' + str(date2) + suffout + '_' + rlook + 'rlks.unw')
+        continue
+
     ds = gdal.Open(infile, gdal.GA_ReadOnly)
     # Get the band that have the data we want
     ds_band1 = ds.GetRasterBand(1)
@@ -157,10 +173,10 @@ for kk in xrange((kmax)):
     az = np.tile(np.arange(1,ds.RasterYSize+1)*factor,ds.RasterXSize).reshape(ds.RasterXSize,ds.RasterYSize).T
     rg = np.tile(np.arange(1,ds.RasterXSize+1)*factor,ds.RasterYSize).reshape(ds.RasterYSize, ds.RasterXSize)
 
-    rg_corr = rg_a*rg + rg_b*rg**2 + rg_c*rg**3 + rg_d**rg**4 + rg_f*rg**5 + rg_g*rg**6
+    rg_corr = rg_a*rg + rg_b*rg**2 + rg_c*rg**3 + rg_d*rg**4 + rg_f*rg**5 + rg_g*rg**6
     print 'Add range ramp %f r, %f r**2  + %f r**3 + %f r**4 + %f r**5 + %f r**6'%(rg_a, rg_b, rg_c, rg_d, rg_f, rg_g)
 
-    az_corr = az_a*az + az_b*az**2 + az_c*az**3 + az_d**az**4 + az_f*az**5 + az_g*az**6
+    az_corr = az_a*az + az_b*az**2 + az_c*az**3 + az_d*az**4 + az_f*az**5 + az_g*az**6
     print 'Add azimuthal ramp %f az, %f az**2  + %f az**3 + %f az**4 + %f az**5 + %f az**6'%(az_a, az_b, az_c, az_d, az_f, az_g)
     
     corr_map = rg_corr + az_corr
@@ -176,7 +192,7 @@ for kk in xrange((kmax)):
         ds2.RasterXSize, ds2.RasterYSize)
 
     rg = np.tile(np.arange(1,ds2.RasterXSize+1),ds2.RasterYSize).reshape(ds2.RasterYSize, ds2.RasterXSize)
-    rg_corr = rg_a*rg + rg_b*rg**2 + rg_c*rg**3 + rg_d**rg**4 + rg_f*rg**5 + rg_g*rg**6
+    rg_corr = rg_a*rg + rg_b*rg**2 + rg_c*rg**3 + rg_d*rg**4 + rg_f*rg**5 + rg_g*rg**6
     wrapcorr = (np.cos(rg_corr) + np.sin(rg_corr)*1j)
     
     flatwrap = wrapphi*wrapcorr
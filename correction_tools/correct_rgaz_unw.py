@@ -14,18 +14,20 @@ correct_flatr_unw.py
 -------------
 Add ramp correction to unrapped file
 
-usage: correct_flatr_unw.py --infile=<path> --param=<path> --outfile=<path> [--rlook_factor=<path>] [--plot=<yes/no>]
+usage: correct_flatr_unw.py --infile=<path> --param=<path> --outfile=<path> [--rlook_factor=<path>] [--plot=<yes/no>] [--plan=<yes/no>]
 
 --infile=<path>           Unwrapped IFG to be corrected from ramp in range
 --param=<path>            Parameter text file .flatr containing containing polynomial fit in range (.flatr) or azimuth (.flata)
 --outfile=<outfile>       Prefix name $prefix$date1-$date2$suffix_$rlookrlks.unw
 --rlook_factor=<value>    Look factor between wrapped correction and unwrapped file [default: 1]
 --plot=<yes/no>           If yes, plot figures for each ints [default: no]
+--plan=<yes/no>           If yes, write the ramp in the plan outfile.plan instead of writing outfile.
+                          outfile is written in one pass with the other planned corrections with apply_plan.py [default: no]
 """
 
 
 from os import path, environ
-import os
+import os, sys
 import matplotlib
 if environ["TERM"].startswith("screen"):
     matplotlib.use('Agg') # Must be before importing matplotlib.pyplot or pylab!
@@ -42,6 +44,8 @@ from numpy.lib.stride_tricks import as_strided
 import gdal
 gdal.UseExceptions()
 from nsbas import docopt
+import rmg
+import corrections
 import shutil
 
 # read arguments
@@ -62,30 +66,35 @@ if arguments["--plot"] ==  None:
 else:
     plot = str(arguments["--plot"])
 
-ds = gdal.Open(infile, gdal.GA_ReadOnly)
-# Get the band that have the data we want
-ds_band1 = ds.GetRasterBand(1)
-ds_band2 = ds.GetRasterBand(2)
+param = arguments["--param"]
 
-los_map = ds_band2.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)
-coh_map = ds_band1.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)
+if arguments["--plan"] == 'yes':
+    # ramp removed later with the other corrections of infile
+    p = corrections.plan(infile)
+    p.add(corrections.loadramp(param, factor=factor))
+    p.save(outfile)
+    print 'Planned:', outfile
+    sys.exit()
+
+# read both bands in one pass
+coh_map, los_map = rmg.readrmg(infile)
+nlign, ncol = los_map.shape
 print
-print 'Nlign:{}, Ncol:{}:'.format(ds.RasterYSize, ds.RasterXSize)
+print 'Nlign:{}, Ncol:{}:'.format(nlign, ncol)
 
-param = arguments["--param"]
 extension = os.path.splitext(param)[1]
 if extension == '.flatr':
     print 'Add back range correction...'
     print 'Open range file:', param
     rg_a, rg_b, rg_c, rg_d, rg_f, rg_g = np.loadtxt(param,comments="#",usecols=(0,1,2,3,4,5),unpack=True,dtype='f,f,f,f,f,f')
-    rg = np.tile(np.arange(1,ds.RasterXSize+1)*factor,ds.RasterYSize).reshape(ds.RasterYSize, ds.RasterXSize)
-    corr_map = rg_a*rg + rg_b*rg**2 + rg_c*rg**3 + rg_d**rg**4 + rg_f*rg**5 + rg_g*rg**6
+    rg = np.tile(np.arange(1,ncol+1)*factor,nlign).reshape(nlign, ncol)
+    corr_map = rg_a*rg + rg_b*rg**2 + rg_c*rg**3 + rg_d*rg**4 + rg_f*rg**5 + rg_g*rg**6
     print 'Add range ramp %f r, %f r**2  + %f r**3 + %f r**4 + %f r**5 + %f r**6'%(rg_a, rg_b, rg_c, rg_d, rg_f, rg_g)
 if extension == '.flata':
     print 'Add back azimutal correction...'
     print 'Open azimutal file:', param
     az_a, az_b, az_c, az_d, az_f, az_g = np.loadtxt(azfile,comments="#",usecols=(0,1,2,3,4,5),unpack=True,dtype='f,f,f,f,f,f')
-    corr_map = az_a*az + az_b*az**2 + az_c*az**3 + az_d**az**4 + az_f*az**5 + az_g*az**6
+    corr_map = az_a*az + az_b*az**2 + az_c*az**3 + az_d*az**4 + az_f*az**5 + az_g*az**6
     print 'Add azimuthal ramp %f az, %f az**2  + %f az**3 + %f az**4 + %f az**5 + %f az**6'%(az_a, az_b, az_c, az_d, az_f, az_g)
 
 flatlos = np.copy(los_map) - corr_map
@@ -121,10 +130,4 @@ if extension == '.flatr':
 if plot=='yes':
     plt.show()
 
-drv = gdal.GetDriverByName("roi_pac")
-dst_ds = drv.Create(outfile, ds.RasterXSize, ds.RasterYSize, 2, gdal.GDT_Float32)
-dst_band1 = dst_ds.GetRasterBand(1)
-dst_band2 = dst_ds.GetRasterBand(2)
-dst_band1.WriteArray(coh_map,0,0)
-dst_band2.WriteArray(flatlos,0,0)
-shutil.copy(rscfile,outrsc)
+rmg.writermg(outfile, coh_map, flatlos, rscfile=rscfile)
@@ -12,7 +12,8 @@ nsb_filtflatunw.py
 
 usage:
   nsb_filtflatunw.py [-v] [-f] [--nproc=<nb_cores>] [--prefix=<value>] [--suffix=<value>] [--jobs=<job1/job2/...>] [--list_int=<path>] [--look=<value>] \
-  [--model=<path>] [--ibeg_mask=<value>] [--iend_mask=<value>] [--jbeg_mask=<value>] [--jend_mask=<value>]  <proc_file> 
+  [--model=<path>] [--ibeg_mask=<value>] [--iend_mask=<value>] [--jbeg_mask=<value>] [--jend_mask=<value>] [--dry_run] [--queue=<path>] [--worker=<path>] [--lease=<value>] \
+  [--scratch=<path>] [--keep=<job1/job2>] [--telemetry=<path>]  <proc_file> 
   nsb_filtflatunw.py -h | --help
 
 options:
@@ -20,7 +21,7 @@ options:
   --prefix=<value>      Prefix of the IFG at the starting of the processes $prefix$date1-$date2$suffix_$rlookrlks.int [default: '']
   --suffix=<value>      Suffix of the IFG at the starting of the processes $prefix$date1-$date2$suffix_$rlookrlks.int [default: '_sd']
   --jobs<job1/job2/...> List of Jobs to be done (eg. --jobs=#do_list =replace_amp/flat_atmo/colin/look_int/unwrapping/add_atmo_back) 
-Job list is: erai look_int replace_amp filterSW filterROI flatr flat_atmo flat_model colin unwrapping add_model_back add_atmo_back add_flata_back add_flatr_back
+Job list is: erai look_int replace_amp filterSW filterROI flatr flat_atmo flat_model colin unwrapping add_model_back add_atmo_back add_flata_back add_flatr_back add_back
   --list_int=<path>     Overwrite liste ifg in proc file            
   --look=<value>        starting look number, default is Rlooks_int
   --model=<path>        Model to be removed from wrapped IFG [default: None]
@@ -28,11 +29,21 @@ Job list is: erai look_int replace_amp filterSW filterROI flatr flat_atmo flat_m
   --jbeg_mask,jend_mask Starting and Ending lines defining mask for empirical estimations [default: 0,0]
   -v                    Verbose mode. Show more information about the processing
   -f                    Force mode. Overwrite output files
+  --dry_run             Print the tasks left to be done for each job and IFG with their estimated cost and exit
+  --queue=<path>        Shared directory where the tasks are sent instead of the local pool (see --worker)
+  --worker=<path>       Run <nb_cores> workers pulling tasks from the shared directory <path> until the
+                        coordinator (same command with --queue=<path> --jobs=...) is done. Can be run on any node
+  --lease=<value>       Seconds without news from a worker before its task is given to another one [default: 600]
+  --scratch=<path>      Node-local directory (tmpfs, local disk) where all the jobs of each IFG are run. Only the
+                        outputs of the kept jobs and the logs are copied back in IntDir, with checksums
+  --keep=<job1/job2>    Jobs whose outputs are copied back from scratch (default: last job)
+  --telemetry=<path>    Append timing and resources of each job on each IFG to the JSON-lines files
+                        <path>.<host>.<pid> (see telemetry_summary.py)
   -h --help             Show this screen.
 """
 
 from __future__ import print_function
-import shutil, sys
+import shutil, sys, time
 from os import path, environ, system, chdir, remove, getcwd, listdir, symlink
 import matplotlib
 if environ["TERM"].startswith("screen"):
@@ -47,7 +58,8 @@ import multiprocessing
 from contextlib import contextmanager
 from functools import wraps, partial
 # from nsbas import docopt, gdal, procparser, subprocess
-import subprocess, gdal, procparser
+import subprocess, gdal, procparser, headers, filters, pointtable, workqueue, staging, telemetry, corrections
+import glob
 gdal.UseExceptions()
 import filecmp
 from operator import methodcaller
@@ -157,18 +169,30 @@ def poolcontext(*arg, **kargs):
     pool.terminate()
     pool.join()
 
-def go(config,job,nproc):
-    ''' RUN processing function '''
+def go(config,job,nproc,tasks=None):
+    ''' RUN processing function
+    tasks: planned tasks of the job (see plan()), only the IFGs to be done are sent to the pool
+    (or to the shared queue with --queue)
+    '''
 
     with TimeIt():
 
         work = range(config.Nifg)
-        pool = multiprocessing.Pool(processes=nproc)
-
-        with poolcontext(processes=nproc) as pool:
-            results = pool.map(partial(eval(job), config), work)
-        
-    return results
+        if tasks is not None:
+            work = [kk for kk in work if tasks[ifgkey(config,kk)].todo]
+            logger.info('{0}: {1} IFGs to be done, {2} up to date'.format(job,len(work),config.Nifg-len(work)))
+
+        results = []
+        if len(work) > 0 and queue is not None:
+            # run by the workers of the shared queue
+            results = queue.map(job, [(config, kk) for kk in work])
+        elif len(work) > 0:
+            with poolcontext(processes=nproc) as pool:
+                results = pool.map(partial(traced(job), config), work)
+        results = dict(zip(work, results))
+
+    # IFGs up to date keep the names planned for them
+    return [results[kk] if kk in results else tasks[ifgkey(config,kk)].config for kk in range(config.Nifg)]
 
 def run(cmd):
     """
@@ -182,8 +206,10 @@ def run(cmd):
     """
 
     logger.info(cmd)
+    start = time.time()
     r = subprocess.call(cmd, shell=True, stdout=sys.stdout, stderr=subprocess.STDOUT,
         env=environ)
+    telemetry.command(cmd, time.time() - start, r)
     if r != 0:
         logger.critical(r)
     return
@@ -194,7 +220,7 @@ def run(cmd):
 
 class Job():
     """ Create a class of Jobs to be run: 
-    Job list is: erai look_int replace_amp filterSW filterROI flatr flat_atmo flat_model colin unwrapping add_model_back add_atmo_back add_flata_back add_flatr_back """
+    Job list is: erai look_int replace_amp filterSW filterROI flatr flat_atmo flat_model colin unwrapping add_model_back add_atmo_back add_flata_back add_flatr_back add_back """
 
     def __init__(self, names):
         self.names = names.split()
@@ -225,7 +251,7 @@ class Job():
     def info(self):
         print('List of possible Jobs:') 
         print('erai look_int replace_amp filter flatr flat_atmo flat_model colin \
-            unwrapping add_model_back add_atmo_back add_ramp_back')
+            unwrapping add_model_back add_atmo_back add_flata_back add_flatr_back add_back')
         print('Choose them in the order that you want')
 
 class PileInt:
@@ -385,11 +411,12 @@ class FiltFlatUnw:
     seedx, seedy.threshold_unw, unw_method
     Additional parameters not in the proc file (yet?): ibeg_mask, iend_mask, jbeg_mask, jend_mask (default: 0.)
     defining the boundary of the mask zone for emprical estimations
+    colin_win: half size of the colinearity window (default: 3)
     suffix, preffix: define name of the interferogram at the start of the processes
     model: model to be removed from wrapped interferograms (default: None)
     """
 
-    def __init__(self, params, prefix='', suffix='_sd', look=2, ibeg_mask=0, iend_mask=0, jbeg_mask=0, jend_mask=0, model=None,force=False):
+    def __init__(self, params, prefix='', suffix='_sd', look=2, ibeg_mask=0, iend_mask=0, jbeg_mask=0, jend_mask=0, model=None,force=False,colin_win=3):
         (self.ListInterfero, self.SARMasterDir, self.IntDir, self.EraDir,
         self.Rlooks_int, self.Rlooks_unw, 
         self.nfit_range, self.thresh_amp_range,
@@ -417,6 +444,9 @@ class FiltFlatUnw:
         # mask empirical estimations
         self.ibeg_mask, self.iend_mask, self.jbeg_mask, self.jend_mask = ibeg_mask, iend_mask, jbeg_mask, jend_mask
 
+        # colinearity window
+        self.colin_win = colin_win
+
         # define list of interferograms
         dates1, dates2=np.loadtxt(self.ListInterfero,comments="#",unpack=True,usecols=(0,1),dtype='i,i') 
         self.stack = PileInt(dates1,dates2,self.prefix,self.suffix,self.Rlooks_int, self.Rlooks_unw, self.look,self.filterstyle, self.IntDir, self.EraDir)
@@ -450,11 +480,14 @@ def look_file(config,file):
             print(look_file.__doc__)
 
 def computesize(config,file):
-    ''' Extract width anf length with gdal
+    ''' Extract width anf length from the .rsc file (cached in the header registry)
+    or with gdal if there is no .rsc
     '''
     try:
         dirname, filename = path.split(path.abspath(file))
         with Cd(dirname):
+            if path.exists(filename) and path.exists(filename + '.rsc'):
+                return headers.size(filename)
             ds_int = gdal.Open(filename, gdal.GA_ReadOnly)
             driver = ds_int.GetDriver()
             return ds_int.RasterXSize, ds_int.RasterYSize
@@ -572,7 +605,7 @@ def filterSW(config, kk):
     return config.getconfig(kk)
 
 def filterROI(config, kk):
-    ''' ROI-PAC Filter function
+    ''' ROI-PAC adaptative filter function (Goldstein filter computed in python, see filters.py)
     Requiered proc file parameter: filterStrength
     '''
 
@@ -596,7 +629,10 @@ def filterROI(config, kk):
         do = checkoutfile(config,filtfile)
         if do:
           try:
-            run("adapt_filt "+str(infile)+" "+str(filtfile)+" "+str(width)+" 0.25"+" "+str(config.filterStrength)+"> log_filtROI.txt")
+            # share the cores left by the pool between the strips of the filter
+            logger.info('Goldstein filter on {0} with strength {1}'.format(infile,config.filterStrength))
+            filters.filter_int(infile, filtfile, width=int(width), alpha=float(config.filterStrength),
+                nthreads=max(1, multiprocessing.cpu_count() // nproc))
           except Exception as e:
             logger.critical(e)
             logger.critical('Failed filtering {0} with ROI-PAC adaptative filter Failed!'.format(infile))
@@ -771,45 +807,36 @@ def flat_atmo(config, kk):
         stratrsc =  stratfile + '.rsc'
         copyrsc(inrsc,stratrsc)
 
-        # select points
-        i, j, z, phi, coh, deltaz = np.loadtxt('ncycle_topo',comments='#', usecols=(0,1,2,3,5,10), unpack=True,dtype='f,f,f,f,f,f')
-        z = z - float(config.z_ref)
-        phi = phi*0.00020944
-
         b1, b2, b3, b4, b5 =  np.loadtxt(topfile,usecols=(0,1,2,3,4), unpack=True, dtype='f,f,f,f,f')
 
         if ((config.jend_mask > config.jbeg_mask) or (config.iend_mask > config.ibeg_mask)) and config.ivar<2 :
             sys.exit(0)
             b1, b2, b3, b4, b5 = 0, 0, 0, 0, 0
 
-            index = np.nonzero(
-            np.logical_and(coh>config.thresh_amp_atmo,
-            np.logical_and(deltaz>75.,
-            np.logical_and(np.logical_or(i<config.ibeg_mask,pix_az>config.iend_mask),
-            np.logical_or(j<config.jbeg_mask,j>config.jend_mask),
-            ))))
+            # select points
+            # ncycle_topo has just been rewritten by flatten_topo: no sidecar
+            i, j, z, phi, coh, deltaz = pointtable.loadtable('ncycle_topo', usecols=(0,1,2,3,5,10), cache=False)
+            z = z - float(config.z_ref)
+            phi = phi*0.00020944
+
+            index = (coh > float(config.thresh_amp_atmo)) & (deltaz > 75.) & \
+                ((i < config.ibeg_mask) | (i > config.iend_mask)) & \
+                ((j < config.jbeg_mask) | (j > config.jend_mask))
 
             phi_select = phi[index]
             z_select = z[index]
 
-            if config.nfit_atmo == -1:
+            nfit_atmo = int(config.nfit_atmo)
+            if nfit_atmo == -1:
                 b1 = np.nanmedian(phi_select)
                 fit = z_select*b1
-            elif config.nfit_atmo == 0:
+            elif nfit_atmo == 0:
                 b1 = np.nanmean(phi_select)
                 fit = z_select*b1
-            elif config.nfit_atmo == 1:
-                from sklearn.linear_model import LinearRegression
-                model = LinearRegression()
-                model.fit(z_select, phi_select)
-                fit = model.predict(z_select)
             else:
-                from sklearn.preprocessing import PolynomialFeatures
-                polynomial_features= PolynomialFeatures(degree=config.nfit_atmo)
-                x_poly = polynomial_features.fit_transform(z_select)
-                model = LinearRegression()
-                model.fit(x_poly, phi_select)
-                fit = model.predict(x_poly)
+                # polynomial fit phi = p0*z**n + ... + pn
+                pars = np.polyfit(z_select, phi_select, nfit_atmo)
+                fit = np.polyval(pars, z_select)
             
             # save median phase/topo
             strattxt = path.splitext(infile)[0] + '_strat.top'
@@ -978,10 +1005,9 @@ def colin(config,kk):
         do = checkoutfile(config,outfile)
         if do:
             try:
-                copyrsc(infile,'temp')
-                run("colin "+str(infile)+" temp "+str(outfile)+" "+str(width)+" "+str(length)+\
-                " 3 0.0001 2 > log_colin.txt")
-                rm('temp')
+                logger.info('Colinearity on {0} with window {1}'.format(infile,config.colin_win))
+                filters.colin_int(infile, outfile, width=int(width), win=int(config.colin_win), threshold=0.0001,
+                    nthreads=max(1, multiprocessing.cpu_count() // nproc))
             except Exception as e:
                 logger.critical(e)
                 logger.critical('Failed replacing Amplitude by colinearity on IFG: {0}'.format(infile))
@@ -1083,8 +1109,7 @@ def unwrapping(config,kk):
         if path.exists(filtROIfile) == False:
             filterROI(config, kk)
             checkinfile(filtROIfile)
-            logger.info("length.pl "+str(filtROIfile))
-            r = subprocess.call("length.pl "+str(filtROIfile), shell=True)
+            headers.setlength(filtROIfile)
 
         if force: 
             rm(unwfiltROI); rm(unwfiltSW)
@@ -1099,8 +1124,7 @@ def unwrapping(config,kk):
                 if path.exists(filtSWfile) == False:
                     filterSW(config, kk)
                     checkinfile(filtSWfile)
-                    logger.info("length.pl "+str(filtSWfile))
-                    run("length.pl "+str(filtSWfile))
+                    headers.setlength(filtSWfile)
 
                 if path.exists(bridgefile) == False:
                     wf = open(bridgefile,"w")
@@ -1134,161 +1158,106 @@ def unwrapping(config,kk):
 
     return config.getconfig(kk)
 
-def add_atmo_back(config,kk):
-    ''' Add back stratified model computed by flatten_topo'''
-
-    with Cd(config.stack.getpath(kk)):
+# models re-added by add_back: suffix tag, flattening job, log file
+back_tags = collections.OrderedDict([('_flatz', ('flat_atmo', 'log_flatatmo.txt')),
+    ('_flatr', ('flatr', 'log_flatr.txt')), ('_flata', ('flata', 'log_flata.txt'))])
 
+def back_model(config,kk,tag):
+    ''' Return the correction re-adding the model removed with the suffix tag on IFG kk '''
+    if tag == '_flatz':
         # look strat file
         stratfile = str(config.stack[kk].date1) + '-' + str(config.stack[kk].date2) + '_strat_' + config.Rlooks_int + 'rlks.unw'
         look_file(config,stratfile)
-        
+        stratfile = config.stack.getstratfile(kk) + '.unw'; checkinfile(stratfile)
+        return corrections.RMGModel(stratfile)
+    param = config.stack.getflatrfile(kk) if tag == '_flatr' else config.stack.getflatafile(kk)
+    if not path.exists(param):
+        raise IOError('Param file {0} does not exist'.format(param))
+    # assume flatr done on Rlooks_int...but it is always the case?
+    look_factor = int(config.Rlooks_unw) - int(config.Rlooks_int)
+    return corrections.loadramp(param, factor=look_factor)
+
+def add_back(config,kk,tags=None):
+    ''' Add back on unwrapped IFG the models removed on wrapped IFG by flat_atmo (stratified model),
+    flatr (range ramp) and flata (azimuthal ramp), in a single read and write of the unwrapped IFG.
+    Models whose flattening has not been done are skipped.
+    Requiered strat file, .flatr and .flata parameter files
+    !!! Supposed flattening estimated on Rlooks_int file.
+    '''
+
+    strict = tags is not None
+    if tags is None:
+        tags = list(back_tags)
+
+    with Cd(config.stack.getpath(kk)):
+
         # update look unw in case not done already
         config.stack.updatelook(kk,config.Rlooks_unw)
 
         # the final product is always filtROI
         unwfile = config.stack.getfiltROI(kk) + '.unw'; checkinfile(unwfile)
-        if "_flatz" in unwfile:
-            stratfile = config.stack.getstratfile(kk) + '.unw'; checkinfile(stratfile)
-            unwrsc = unwfile + '.rsc'
+        unwrsc = unwfile + '.rsc'
+        prefix, suffix = config.stack.getfix(kk)
 
-            # update names
-            prefix, suffix = config.stack.getfix(kk)
-            newsuffix = suffix.replace("_flatz", "")
-            config.stack.updatefix(kk,prefix,newsuffix)
-            outfile = config.stack.getfiltROI(kk) + '.unw'
-            outrsc = outfile + '.rsc'
-            copyrsc(unwrsc,outrsc)
+        done = [tag for tag in tags if tag in suffix]
+        for tag in tags:
+            if strict and tag not in done:
+                logger.critical('{0}() does not seem to have been done... Exit!'.format(back_tags[tag][0]))
+                config.stack.updatesuccess(kk)
+        if len(done) == 0:
+            return config.getconfig(kk)
 
-            if force:
-                rm(outfile)
-            do = checkoutfile(config,outfile)
-            if do:
-                try:
-                    run("length.pl "+str(unwfile))
-                    run("add_rmg.py --infile="+str(unwfile)+" --outfile="+str(outfile)+" --add="+str(stratfile)+" >> log_flatatmo.txt")
-                except Exception as e:
-                    logger.critical(e)
-                    logger.critical('Failed adding back {0} on IFG: {1}'.format(stratfile,unwfile))
-                    config.stack.updatesuccess(kk)
-                    print(add_atmo_back.__doc__)
+        # update names
+        newsuffix = suffix
+        for tag in done:
+            newsuffix = newsuffix.replace(tag, "")
+        config.stack.updatefix(kk,prefix,newsuffix)
+        outfile = config.stack.getfiltROI(kk) + '.unw'
+        outrsc = outfile + '.rsc'
+        copyrsc(unwrsc,outrsc)
 
-        else:
-            logger.critical('flat_atmo() does not seem to have been done... Exit!')
+        try:
+            models = [back_model(config,kk,tag) for tag in done]
+        except (IOError, ValueError) as e:
+            logger.critical(e)
             config.stack.updatesuccess(kk)
-            print(add_atmo_back.__doc__)
- 
+            print(add_back.__doc__)
+            return config.getconfig(kk)
+
+        if force:
+            rm(outfile)
+        do = checkoutfile(config,outfile)
+        if do:
+            try:
+                headers.setlength(unwfile)
+                corrections.apply(unwfile, outfile, models)
+                with open(back_tags[done[-1]][1], 'a') as log:
+                    log.write('{0} = {1} {2}\n'.format(outfile, unwfile, ' '.join(str(m) for m in models)))
+            except Exception as e:
+                logger.critical(e)
+                logger.critical('Failed adding back {0} on IFG: {1}'.format(' '.join(str(m) for m in models),unwfile))
+                config.stack.updatesuccess(kk)
+                print(add_back.__doc__)
 
     return config.getconfig(kk)
 
+def add_atmo_back(config,kk):
+    ''' Add back stratified model computed by flatten_topo'''
+    return add_back(config,kk,['_flatz'])
+
 def add_flatr_back(config,kk):
     ''' Add range ramp estimated on wrapped IFG back on unwrapped IFG
     Requiered .flatr parameter file containing polynomial fit
     !!! Supposed flattening estimated on Rlooks_int file. 
     '''
-
-    with Cd(config.stack.getpath(kk)):
-   
-        # update look unw in case not done already
-        config.stack.updatelook(kk,config.Rlooks_unw)
-
-        # the final product is always filtROI
-        unwfile = config.stack.getfiltROI(kk) + '.unw'; checkinfile(unwfile)
-        if "_flatr" in unwfile:
-            param = config.stack.getflatrfile(kk)
-            unwrsc = unwfile + '.rsc'
-
-            # assume flatr done on Rlooks_int...but it is always the case?
-            look_factor = int(config.Rlooks_unw) - int(config.Rlooks_int)
-
-            # update names
-            prefix, suffix = config.stack.getfix(kk)
-            newsuffix = suffix.replace("_flatr", "")
-            config.stack.updatefix(kk,prefix,newsuffix)
-            outfile = config.stack.getfiltROI(kk) + '.unw'
-            outrsc = outfile + '.rsc'
-            copyrsc(unwrsc,outrsc)
-
-            if path.exists(param):
-                if force:
-                    rm(outfile)
-                do = checkoutfile(config,outfile)
-                if do:
-                    try:
-                        run("length.pl "+str(unwfile))
-                        run("correct_rgaz_unw.py --infile="+str(unwfile)+" --outfile="+str(outfile)+" --param="+str(param)+" --rlook_factor="+str(look_factor)+" >> log_flatr.txt")
-                    except Exception as e:
-                        logger.critical(e)
-                        logger.critical('Failed adding back {0} on IFG: {1}'.format(param,unwfile))
-                        config.stack.updatesuccess(kk)
-                        print(add_flatr_back.__doc__)
-
-            else:
-                logger.critical('Param file {0} does not exist. Exit!'.format(param))
-                config.stack.updatesuccess(kk)
-                print(add_flatr_back.__doc__)
-
-        else:
-            logger.critical('flatr() does not seem to have been done... Exit!')
-            config.stack.updatesuccess(kk)
-            print(add_flatr_back.__doc__)
-
-    return config.getconfig(kk)
+    return add_back(config,kk,['_flatr'])
 
 def add_flata_back(config,kk):
     ''' Add azimutal ramp estimated on wrapped IFG back on unwrapped IFG
     Requiered .flata parameter file containing polynomial fit
     !!! Supposed flattening estimated on Rlooks_int file. 
     '''
-
-    with Cd(config.stack.getpath(kk)):
-   
-        # update look unw in case not done already
-        config.stack.updatelook(kk,config.Rlooks_unw)
-
-        # the final product is always filtROI
-        unwfile = config.stack.getfiltROI(kk) + '.unw'; checkinfile(unwfile)
-        if "_flata" in unwfile:
-
-            param = config.stack.getflatafile(kk)
-            unwrsc = unwfile + '.rsc'
-
-            # assume flatr done on Rlooks_int...but it is always the case?
-            look_factor = int(config.Rlooks_unw) - int(config.Rlooks_int)
-
-            # update names
-            prefix, suffix = config.stack.getfix(kk)
-            newsuffix = suffix.replace("_flata", "")
-            config.stack.updatefix(kk,prefix,newsuffix)
-            outfile = config.stack.getfiltROI(kk) + '.unw'
-            outrsc = outfile + '.rsc'
-            copyrsc(unwrsc,outrsc)
-
-            if force:
-                rm(outfile)
-            do = checkoutfile(config,outfile)
-            if do:
-                if path.exists(outfile) == False:
-                    try:
-                        run("length.pl "+str(unwfile))
-                        run("correct_rgaz_unw.py --infile="+str(unwfile)+" --outfile="+str(outfile)+" --param="+str(param)+" --rlook_factor="+str(look_factor)+" >> log_flata.txt")
-                    except Exception as e:
-                        logger.critical(e)
-                        logger.critical('Failed adding back {0} on IFG: {1}'.format(param,unwfile))
-                        config.stack.updatesuccess(kk)
-                        print(add_flata_back.__doc__)
-
-            else:
-                logger.critical('Param file {0} does not exist. Exit!'.format(param))
-                config.stack.updatesuccess(kk)
-                print(add_flata_back.__doc__)  
-        else:
-            logger.critical('flata() does not seem to have been done... Exit!')
-            config.stack.updatesuccess(kk)
-            print(add_flata_back.__doc__) 
-                    
-
-    return config.getconfig(kk)
+    return add_back(config,kk,['_flata'])
 
 def add_model_back(config,kk):
     ''' Function adding model on unwrapped IFG previously removed on wrapped IFG  (See Daout et al., 2017)
@@ -1321,7 +1290,7 @@ def add_model_back(config,kk):
                     do = checkoutfile(config,outfile)
                     if do:
                         try:
-                            run("length.pl "+str(unwfile))
+                            headers.setlength(unwfile)
                             run("unflatten_stack "+str(unwfile)+" "+str(outfile)+" "+str(config.model)+" "+str(param)+" >> log_flatmodel.txt")
                         except Exception as e:
                             logger.critical(e)
@@ -1346,6 +1315,202 @@ def add_model_back(config,kk):
 
     return config.getconfig(kk)
 
+##################################################################################
+###  PLANNER
+##################################################################################
+
+Task = collections.namedtuple('Task', 'job ifg inputs outputs todo missing cost config')
+
+# relative cost of the jobs per MB of input
+job_weights = {'erai': 1., 'look_int': 1., 'replace_amp': 1., 'filterSW': 3., 'filterROI': 5.,
+    'flatr': 2., 'flata': 2., 'flat_atmo': 4., 'flat_model': 3., 'colin': 2., 'unwrapping': 10.,
+    'add_model_back': 1., 'add_atmo_back': 1., 'add_flata_back': 1., 'add_flatr_back': 1., 'add_back': 1.}
+
+def ifgkey(config,kk):
+    return (config.stack[kk].date1, config.stack[kk].date2)
+
+def ifglabel(config,*args):
+    ''' Return date1-date2 of the IFG kk of job(config,...,kk) '''
+    return '{0}-{1}'.format(*ifgkey(config,args[-1]))
+
+def traced(job):
+    ''' Return the job function, recording each call with --telemetry '''
+    if telefile is None:
+        return eval(job)
+    return telemetry.Traced(eval(job), job, telefile, label=ifglabel)
+
+def plan_job(config,job,kk):
+    ''' Return the input and output files of job for IFG kk, updating the IFG names
+    as the job function does, without running anything '''
+
+    stack = config.stack
+    prefix, suffix = stack.getfix(kk)
+    name = lambda: stack.getname(kk) + '.int'
+    unw = lambda: stack.getfiltROI(kk) + '.unw'
+    inputs, outputs = [], []
+
+    if job == 'erai':
+        inputs = [name()] + list(stack.geterafiles(kk)[:2])
+        stack.updatefix(kk,prefix,suffix + '_era')
+        outputs = [name()]
+    elif job == 'replace_amp':
+        inputs = [name(), stack.getcor(kk)]
+        stack.updatefix(kk,'coh_' + prefix,suffix)
+        outputs = [name()]
+    elif job == 'filterSW':
+        inputs = [name(), stack.getcor(kk)]
+        outputs = [stack.getfiltSW(kk) + '.int']
+    elif job == 'filterROI':
+        inputs = [name()]
+        outputs = [stack.getfiltROI(kk) + '.int']
+    elif job in ('flatr', 'flata', 'flat_model'):
+        inputs = [name(), stack.getfiltSW(kk) + '.int']
+        newsuffix, param = {'flatr': ('_flatr', stack.getflatrfile(kk)),
+            'flata': ('_flataz', stack.getflatafile(kk)),
+            'flat_model': ('_nomodel', stack.getmodelfile(kk))}[job]
+        # parameter file written by the flattening, linked to param
+        estim = stack.getname(kk) + {'flatr': '.flatr', 'flata': '.flata', 'flat_model': '.stack'}[job]
+        stack.updatefix(kk,prefix,suffix + newsuffix)
+        outputs = [name(), estim, param]
+    elif job == 'flat_atmo':
+        inputs = [name(), stack.getfiltSW(kk) + '.int', config.dem]
+        stratfile = stack.getstratfile(kk) + '.unw'
+        topfile = stack.getname(kk) + '.top'
+        stack.updatefix(kk,prefix,suffix + '_flatz')
+        outputs = [name(), stack.getfiltSW(kk) + '.int', stratfile, topfile, 'ncycle_topo']
+    elif job == 'colin':
+        inputs = [name()]
+        stack.updatefix(kk,'col_',suffix)
+        outputs = [name()]
+    elif job == 'look_int':
+        inputs = [name(), stack.getcor(kk)]
+        stack.updatelook(kk,config.Rlooks_unw)
+        outputs = [name(), stack.getcor(kk)]
+    elif job == 'unwrapping':
+        stack.updatelook(kk,config.Rlooks_unw)
+        inputs = [name()]
+        outputs = [unw()]
+    elif job in ('add_atmo_back', 'add_flatr_back', 'add_flata_back', 'add_model_back'):
+        stack.updatelook(kk,config.Rlooks_unw)
+        tag, param = {'add_atmo_back': ('_flatz', stack.getstratfile(kk) + '.unw'),
+            'add_flatr_back': ('_flatr', stack.getflatrfile(kk)),
+            'add_flata_back': ('_flata', stack.getflatafile(kk)),
+            'add_model_back': ('_nomodel', stack.getmodelfile(kk))}[job]
+        inputs = [unw(), param]
+        if job == 'add_atmo_back':
+            # stratified model looked by the job
+            inputs.append(str(stack[kk].date1) + '-' + str(stack[kk].date2) + '_strat_' + config.Rlooks_int + 'rlks.unw')
+        # no output if the flattening has not been done: the job reports it
+        if tag in suffix:
+            stack.updatefix(kk,prefix,suffix.replace(tag, ''))
+            outputs = [unw()]
+    elif job == 'add_back':
+        stack.updatelook(kk,config.Rlooks_unw)
+        inputs = [unw()]
+        done = [tag for tag in back_tags if tag in suffix]
+        if '_flatz' in done:
+            inputs += [stack.getstratfile(kk) + '.unw',
+                str(stack[kk].date1) + '-' + str(stack[kk].date2) + '_strat_' + config.Rlooks_int + 'rlks.unw']
+        if '_flatr' in done:
+            inputs.append(stack.getflatrfile(kk))
+        if '_flata' in done:
+            inputs.append(stack.getflatafile(kk))
+        for tag in done:
+            suffix = suffix.replace(tag, '')
+        if done:
+            stack.updatefix(kk,prefix,suffix)
+            outputs = [unw()]
+
+    return inputs, outputs
+
+def plan(config,jobs):
+    ''' Expand the job list into the input and output files of each job for each IFG, and
+    compare them to the disk. A task is to be done if one of its outputs does not exist (or with -f).
+    Files to be produced are assumed to have the size of the first input of their task.
+    Return a list (one per job) of dictionaries of Task indexed by (date1, date2)
+    '''
+
+    tasks = []
+    # size of the files to be produced by previous tasks
+    produced = [{} for kk in range(config.Nifg)]
+    for p in jobs:
+        job = getattr(p,'name')
+        tasks.append({})
+        for kk in range(config.Nifg):
+            dirname = config.stack.getpath(kk)
+            ifg = config.stack.getname(kk)
+            inputs, outputs = plan_job(config,job,kk)
+            inputs = [path.join(dirname, f) for f in inputs]
+            outputs = [path.join(dirname, f) for f in outputs]
+
+            todo = force or len(outputs) == 0 or not np.all([path.exists(f) for f in outputs])
+            missing = [f for f in inputs if not path.exists(f) and f not in produced[kk]]
+            sizes = [produced[kk][f] if f in produced[kk] else path.getsize(f) if path.exists(f) else 0 for f in inputs]
+            cost = 0.
+            if todo:
+                produced[kk].update((f, sizes[0] if sizes else 0) for f in outputs)
+                cost = job_weights.get(job, 1.) * np.sum(sizes) / 1.e6
+            tasks[-1][ifgkey(config,kk)] = Task(job, ifg, inputs, outputs,
+                todo, missing, cost, config.getconfig(kk))
+    return tasks
+
+def chain(config,jobs,tasks,kk):
+    ''' Run all the jobs on IFG kk in a scratch directory: copy the existing files of the IFG
+    read or written by the jobs in scratch, run the jobs to be done, and copy back the outputs of
+    the kept jobs (--keep) and the log files with checksums '''
+
+    key = ifgkey(config,kk)
+    ifgtasks = [jobtasks[key] for jobtasks in tasks]
+    dirname = config.stack.getpath(kk)
+    files = sorted(set(f for t in ifgtasks for f in t.inputs + t.outputs
+        if path.dirname(f) == dirname and path.lexists(f)))
+
+    intdir = config.stack.dir
+    config.stack.dir = scratch
+    workdir = config.stack.getpath(kk)
+    try:
+        logger.info('Stage {0} files of {1} in {2}'.format(len(files),dirname,workdir))
+        staging.stage_in(files, workdir)
+
+        for pos, (p, t) in enumerate(zip(jobs, ifgtasks)):
+            if t.todo:
+                traced(getattr(p,'name'))(config,kk)
+            else:
+                # up to date: only update the names
+                prefix, suffix, look = t.config[:3]
+                config.stack.updatefix(kk,prefix,suffix)
+                config.stack.updatelook(kk,look)
+            if config.stack[kk].success == 0:
+                break
+
+        products = [path.join(workdir, path.basename(f)) for t in ifgtasks if t.job in keep for f in t.outputs]
+        products += glob.glob(path.join(workdir, 'log_*'))
+        staging.stage_out(products, dirname)
+    except Exception as e:
+        logger.critical(e)
+        logger.critical('Failed running jobs on IFG {0} in {1}'.format(dirname,workdir))
+        config.stack.updatesuccess(kk)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        config.stack.dir = intdir
+
+    return config.getconfig(kk)
+
+def print_plan(jobs,tasks):
+    ''' Print the tasks to be done and their estimated cost (MB of input x job weight) '''
+
+    total = 0.
+    for p, jobtasks in zip(jobs,tasks):
+        todo = [t for t in jobtasks.values() if t.todo]
+        cost = np.sum([t.cost for t in todo])
+        total += cost
+        print('{0}: {1}/{2} IFGs to be done, cost: {3:.1f}'.format(getattr(p,'name'),len(todo),len(jobtasks),cost))
+        for t in sorted(todo, key=lambda t: t.ifg):
+            status = 'missing: ' + ' '.join(path.basename(f) for f in t.missing) if t.missing else ''
+            print('    {0:<50} {1:>10.1f} {2}'.format(t.ifg, t.cost, status))
+    print('Total cost: {0:.1f}'.format(total))
+    print()
+
 ##################################################################################
 ###  READ IMPUT PARAMETERS
 ##################################################################################
@@ -1372,14 +1537,38 @@ if arguments["--suffix"] == None:
     suffix = '_sd'
 else:
     suffix=arguments["--suffix"]
-if arguments["--jobs"] ==  None:
+split = methodcaller('replace','/',' ')
+if arguments["--worker"] != None:
+    do_list = ''
+elif arguments["--jobs"] ==  None:
     print('--jobs list is empty. Nothing to be done. Exit!')
     print(Job.__doc__)
     sys.exit()
 else:
-    split = methodcaller('replace','/',' ')
     do_list = split(arguments["--jobs"])
 
+if arguments["--scratch"] == None:
+    scratch = None
+else:
+    scratch = path.abspath(arguments["--scratch"])
+if arguments["--keep"] == None:
+    keep = do_list.split()[-1:]
+else:
+    keep = split(arguments["--keep"]).split()
+
+telefile = arguments["--telemetry"]
+if telefile is not None:
+    telefile = path.abspath(telefile)
+
+if arguments["--lease"] == None:
+    lease = 600.
+else:
+    lease = float(arguments["--lease"])
+if arguments["--queue"] == None:
+    queue = None
+else:
+    queue = workqueue.WorkQueue(arguments["--queue"], lease=lease)
+
 if arguments["--model"] == None:
     model = None
 else:
@@ -1439,6 +1628,7 @@ proc_defaults = {
     "unw_method": "roi",
     "threshold_unw": "0.35", # threshold on filtered colinearity 
     "threshold_unfilt": "0.03", # threshold on colinearity 
+    "colin_win": "3", # half size of the colinearity window
     "seedx": "50", # starting col for unw
     "seedy": "50", # starting line for unw
     }
@@ -1522,6 +1712,17 @@ else:
         format='%(asctime)s -- %(levelname)s -- %(message)s')
 logger = logging.getLogger('filtflatunw_log.log')
 
+def worker(i):
+    ''' Run the tasks of the shared queue '''
+    functions = dict((job, traced(job)) for job in list(job_weights) + ['chain'])
+    workqueue.work(workqueue.WorkQueue(arguments["--worker"], lease=lease), functions)
+
+if arguments["--worker"] != None:
+    logger.info('Start {0} workers on {1}'.format(nproc,arguments["--worker"]))
+    with poolcontext(processes=nproc) as pool:
+        pool.map(worker, range(nproc))
+    sys.exit()
+
 # initialise job list
 jobs = Job(do_list)
 print('List of Post-Processing Jobs:')
@@ -1551,9 +1752,9 @@ if arguments["--look"] == None:
 else:
     look = str(int(arguments["--look"]))
 
-# RUN
-for p in jobs:
-    postprocess = FiltFlatUnw(
+def init_config(ListInterfero,prefix,suffix,look):
+    ''' Return the FiltFlatUnw configuration of the IFGs of ListInterfero '''
+    return FiltFlatUnw(
         [ListInterfero,SARMasterDir,IntDir,EraDir,
         proc["Rlooks_int"], proc["Rlooks_unw"], 
         proc["nfit_range"], proc["thresh_amp_range"],
@@ -1562,30 +1763,17 @@ for p in jobs:
         proc["filterStrength"],
         proc["nfit_topo"], proc["thresh_amp_topo"], proc["ivar"], proc["z_ref"],
         proc["seedx"], proc["seedy"], proc["threshold_unw"], proc["threshold_unfilt"], proc["unw_method"]], 
-        prefix=prefix, suffix=suffix, look=look, model=model, force=force
-        ) 
-
-    print()
-    job = getattr(p,'name')
-    # print ifgs list at the begining of each process
-    postprocess.stack.info()
-
-    print('----------------------------------')
-    print('Run {} ....'.format(job))
-    
-    # run process
-    output = []
-    output.append(go(postprocess, job, nproc))
-
-    # update name
-    prefix, suffix, look = output[0][0][:3]
+        prefix=prefix, suffix=suffix, look=look, model=model, force=force, colin_win=proc["colin_win"]
+        )
 
+def save_success(ListInterfero,output):
+    ''' Save the list of the IFGs of ListInterfero processed successfully. Return its name '''
     # load list of dates
     dates1, dates2 = np.loadtxt(ListInterfero,comments="#",unpack=True,usecols=(0,1),dtype='i,i') 
     dates = np.vstack([dates1,dates2]).T; Nifg = len(dates1)
 
     # update list ifg
-    success = []; [success.append(output[0][i][3]) for i in range(Nifg)]; success = np.array(success)
+    success = []; [success.append(output[i][3]) for i in range(Nifg)]; success = np.array(success)
     index = np.flatnonzero(success==1); newdates =  dates[index,:] 
 
     # save new list
@@ -1595,9 +1783,63 @@ for p in jobs:
     for i in range(len(index)):
         wf.write("%i  %i\n" % (newdates[i][0], newdates[i][1]))
     wf.close()
+    return ListInterfero
+
+# PLAN
+planner = init_config(ListInterfero,prefix,suffix,look)
+tasks = plan(planner,jobs)
+print('----------------------------------')
+print('Planned tasks:')
+print_plan(jobs,tasks)
+if arguments["--dry_run"]:
+    sys.exit()
+
+if queue is not None:
+    queue.start()
+    logger.info('Tasks sent to {0}. Start workers with: {1} --worker={0}'.format(queue.dirname,' '.join(sys.argv)))
 
+# RUN
+if scratch is not None:
+    # run the chain of jobs of each IFG in scratch
+    postprocess = init_config(ListInterfero,prefix,suffix,look)
     print('----------------------------------')
+    print('Run {0} in {1} ....'.format(' '.join(getattr(p,'name') for p in jobs),scratch))
+    with TimeIt():
+        work = range(postprocess.Nifg)
+        if queue is not None:
+            output = queue.map('chain', [(postprocess, jobs, tasks, kk) for kk in work])
+        else:
+            with poolcontext(processes=nproc) as pool:
+                output = pool.map(partial(traced('chain'), postprocess, jobs, tasks), work)
+    ListInterfero = save_success(ListInterfero,output)
+    print('----------------------------------')
+    print()
+
+for pos, p in enumerate(jobs if scratch is None else []):
+    postprocess = init_config(ListInterfero,prefix,suffix,look)
+
     print()
+    job = getattr(p,'name')
+    # print ifgs list at the begining of each process
+    postprocess.stack.info()
+
+    print('----------------------------------')
+    print('Run {} ....'.format(job))
+    
+    # run process
+    output = []
+    output.append(go(postprocess, job, nproc, tasks[pos]))
+
+    # update name
+    prefix, suffix, look = output[0][0][:3]
+
+    ListInterfero = save_success(ListInterfero,output[0])
+
+    print('----------------------------------')
+    print()
+
+if queue is not None:
+    queue.stop()
 
 print("That's all folks")
 
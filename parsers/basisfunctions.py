@@ -0,0 +1,201 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Temporal basis functions of the time series decompositions.
+
+Basis functions (functions of the time: reference, interseismic,
+seasonal and semi-annual terms, coseismic steps, postseismic and
+slow-slip transients) and kernel functions (functions of the date index:
+perpendicular baseline, vectors) shared by invers_disp2coef.py,
+invers_disp_pixel.py, invert_vector.py, invers_disp_gps.py and
+correct_ts_from_model.py. Each function is evaluated on a vector of
+times at once and design() builds the full matrix of a list of
+functions, cached by times and functions: per-pixel inversions take the
+rows of their valid dates instead of evaluating the functions again.
+
+Example:
+>>> from basisfunctions import reference, interseismic, corrdem, design
+>>> basis = [reference(name='reference',date=datemin,reduction='ref'),
+...          interseismic(name='interseismic',reduction='lin',date=datemin)]
+>>> kernels = [corrdem(name='dem correction',reduction='corrdem',bp0=base[imref],bp=base)]
+>>> G = design(basis, kernels, dates)
+>>> m, sigmam = consInvert(G[k], disp[k], inaps[k])
+"""
+
+from __future__ import print_function
+import numpy as np
+from collections import OrderedDict
+
+# number of design matrices kept by design()
+cachesize = 16
+_cache = OrderedDict()
+
+class pattern:
+    def __init__(self,name,reduction,date):
+        self.name=name
+        self.reduction=reduction
+        self.date=date
+
+    def info(self):
+        print(self.name, self.date)
+
+    def spec(self):
+        ''' Return the key identifying the function in the cache of design() '''
+        # dates given by date2dec() are lists of one date
+        return (self.__class__.__name__, tuple(np.ravel(self.date)))
+
+### BASIS FUNCTIONS: function of time
+
+def Heaviside(t):
+        h=np.zeros((len(t)))
+        h[t>=0]=1.0
+        return h
+
+def Box(t):
+        return Heaviside(t+0.5)-Heaviside(t-0.5)
+
+class coseismic(pattern):
+      def __init__(self,name,reduction,date):
+          pattern.__init__(self,name,reduction,date)
+          self.to=date
+
+      def g(self,t):
+        return Heaviside(t-self.to)
+
+class postseismic(pattern):
+      def __init__(self,name,reduction,date,tcar=1):
+          pattern.__init__(self,name,reduction,date)
+          self.to=date
+          self.tcar=tcar
+
+      def g(self,t):
+        t=(t-self.to)/self.tcar
+        t[t<=0] = 0
+        g = np.log10(1+t)
+        return g
+
+      def spec(self):
+          return pattern.spec(self) + (self.tcar,)
+
+class reference(pattern):
+    def __init__(self,name,reduction,date):
+        pattern.__init__(self,name,reduction,date)
+    def g(self,t):
+        return np.ones((t.size))
+
+class interseismic(pattern):
+    def __init__(self,name,reduction,date):
+        pattern.__init__(self,name,reduction,date)
+        self.to=date
+
+    def g(self,t):
+        func=(t-self.to)
+        return func
+
+class sin2var(pattern):
+     def __init__(self,name,reduction,date):
+         pattern.__init__(self,name,reduction,date)
+         self.to=date
+
+     def g(self,t):
+         return np.sin(4*np.pi*(t-self.to))
+
+class cos2var(pattern):
+     def __init__(self,name,reduction,date):
+         pattern.__init__(self,name,reduction,date)
+         self.to=date
+
+     def g(self,t):
+         return np.cos(4*np.pi*(t-self.to))
+
+class sinvar(pattern):
+    def __init__(self,name,reduction,date):
+        pattern.__init__(self,name,reduction,date)
+        self.to=date
+
+    def g(self,t):
+        return np.sin(2*np.pi*(t-self.to))
+
+class cosvar(pattern):
+    def __init__(self,name,reduction,date):
+        pattern.__init__(self,name,reduction,date)
+        self.to=date
+
+    def g(self,t):
+        return np.cos(2*np.pi*(t-self.to))
+
+class slowslip(pattern):
+      def __init__(self,name,reduction,date,tcar=1):
+          pattern.__init__(self,name,reduction,date)
+          self.to=date
+          self.tcar=tcar
+
+      def g(self,t):
+          t=(t-self.to)/self.tcar
+          funct = 0.5*(np.tanh(t)-1) + 1
+          return funct
+
+      def spec(self):
+          return pattern.spec(self) + (self.tcar,)
+
+### KERNEL FUNCTIONS: not function of time
+class corrdem(pattern):
+    def __init__(self,name,reduction,bp0,bp):
+        self.name = name
+        self.reduction = reduction
+        self.bpo=bp0
+        self.bp=bp
+
+    def info(self):
+        print(self.name)
+
+    def g(self,index):
+        func = (self.bp-self.bpo)
+        return func[index]
+
+    def spec(self):
+        return ('corrdem', self.bpo, np.asarray(self.bp, dtype=float).tobytes())
+
+class vector(pattern):
+    def __init__(self,name,reduction,vect):
+        self.name = name
+        self.reduction = reduction
+        self.func=vect
+
+    def info(self):
+        print(self.name)
+
+    def g(self,index):
+        return self.func[index]
+
+    def spec(self):
+        return ('vector', np.asarray(self.func, dtype=float).tobytes())
+
+def design(basis, kernels=(), t=None, index=None):
+    """ Return the matrix G (len(t), len(basis)+len(kernels)) of the basis
+    functions at times t followed by the kernel functions at date indices
+    index (default: all dates). The matrix is cached and read-only: take
+    its rows (G[k]) or copy it before modifying it
+    """
+    t = np.asarray(t, dtype=float)
+    if index is None:
+        index = np.arange(len(t))
+    index = np.asarray(index)
+    key = (t.tobytes(), index.tobytes(), tuple(f.spec() for f in basis), tuple(f.spec() for f in kernels))
+    if key in _cache:
+        return _cache[key]
+
+    G = np.zeros((len(t), len(basis) + len(kernels)))
+    for l in range(len(basis)):
+        G[:,l] = basis[l].g(t)
+    for l in range(len(kernels)):
+        G[:,len(basis)+l] = kernels[l].g(index)
+    G.flags.writeable = False
+
+    while len(_cache) >= cachesize:
+        _cache.popitem(last=False)
+    _cache[key] = G
+    return G
@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Bound-constrained least squares of many problems sharing a matrix.
+
+Minimize sum((w*(A x - b))**2) subject to lb <= x <= ub for the P columns
+b of B at once, each with its own bounds: e.g. the pixels of a line with
+the same valid dates, whose postseismic terms are bounded by the sign of
+their own coseismic steps. The problems are solved together by projected
+Newton iterations (Bertsekas, 1982) on H x = c, with H = A^T W^2 A shared
+by all of them. At each iteration, the variables at a bound with a
+gradient pointing out of the bounds are fixed and the Newton step of the
+free ones is projected on the bounds, with a backtracking search. The
+inverse of the free part of H is computed once per set of free variables
+and shared by the problems having this set. Started from the
+unconstrained solution, the solution is found in a few iterations: one
+when no bound is active.
+
+Example:
+>>> import boundedlsq
+>>> x = boundedlsq.lstsq(A, B, lb, ub, x0=minit, w=1./sigmad)   # x (P, M)
+"""
+
+from __future__ import print_function
+import numpy as np
+
+def _objective(x, H, c):
+    """ Return 0.5 x^T H x - c^T x of each problem (rows of x) """
+    return 0.5*np.einsum('pi,pi->p', np.dot(x, H), x) - np.einsum('pi,pi->p', c, x)
+
+def lstsq(A, B, lb, ub, x0=None, w=None, maxiter=100, tol=1.0e-10, rcond=1.0e-10):
+    """ Return the solutions (P, M) of the problems of the columns of B (n, P)
+    :param lb, ub: bounds (P, M) or (M,), -inf/inf for unbounded variables
+    :param x0: starting points (P, M), projected on the bounds (default: zeros)
+    :param w: weight of each row of A (default: 1)
+    :param tol: stop when the projected gradient of a problem is below tol
+    times the norm of its right-hand side c
+    """
+    n, M = A.shape
+    B = np.asarray(B, dtype=np.float64).reshape(n, -1)
+    P = B.shape[1]
+    if w is None:
+        w = np.ones(n)
+    Aw = A*w[:, np.newaxis]
+    H = np.dot(Aw.T, Aw)
+    c = np.dot((B*w[:, np.newaxis]).T, Aw)
+    lb = np.broadcast_to(np.asarray(lb, dtype=np.float64), (P, M))
+    ub = np.broadcast_to(np.asarray(ub, dtype=np.float64), (P, M))
+    if x0 is None:
+        x = np.clip(np.zeros((P, M)), lb, ub)
+    else:
+        x = np.clip(np.asarray(x0, dtype=np.float64).reshape(P, M), lb, ub)
+    threshold = tol*np.maximum(np.sqrt(np.sum(c**2, axis=1)), np.finfo(float).tiny)
+
+    # inverses of the free part of H by set of free variables
+    inverses = {}
+    todo = np.arange(P)
+    for it in range(maxiter):
+        xt, ct, lt, ut = x[todo], c[todo], lb[todo], ub[todo]
+        g = np.dot(xt, H) - ct
+        pgrad = np.sqrt(np.sum((xt - np.clip(xt - g, lt, ut))**2, axis=1))
+        going = pgrad > threshold[todo]
+        todo, xt, ct, lt, ut, g, pgrad = todo[going], xt[going], ct[going], lt[going], ut[going], g[going], pgrad[going]
+        if len(todo) == 0:
+            break
+
+        # variables fixed at (or within eps of) a bound they are pushed against
+        eps = np.minimum(pgrad, 1.0e-3)[:, np.newaxis]
+        fixed = np.logical_or(np.logical_and(xt <= lt + eps, g > 0), np.logical_and(xt >= ut - eps, g < 0))
+        free = ~fixed
+
+        # Newton step on the free variables, gradient step on the fixed ones
+        d = -g
+        patterns, group = np.unique(free, axis=0, return_inverse=True)
+        for p in range(len(patterns)):
+            f = np.flatnonzero(patterns[p])
+            if len(f) == 0:
+                continue
+            key = patterns[p].tobytes()
+            if key not in inverses:
+                inverses[key] = np.linalg.pinv(H[np.ix_(f, f)], rcond=rcond)
+            sel = np.flatnonzero(group.ravel() == p)
+            d[np.ix_(sel, f)] = -np.dot(g[np.ix_(sel, f)], inverses[key])
+
+        # backtracking along the projection on the bounds
+        fx = _objective(xt, H, ct)
+        alpha = np.ones(len(todo))
+        xn = np.copy(xt)
+        accepted = np.zeros(len(todo), dtype=bool)
+        for search in range(30):
+            left = ~accepted
+            xl = np.clip(xt[left] + alpha[left, np.newaxis]*d[left], lt[left], ut[left])
+            ok = _objective(xl, H, ct[left]) <= fx[left] + 1.0e-4*np.sum(g[left]*(xl - xt[left]), axis=1)
+            index = np.flatnonzero(left)[ok]
+            xn[index], accepted[index] = xl[ok], True
+            if np.all(accepted):
+                break
+            alpha[~accepted] *= 0.5
+        x[todo] = xn
+        # no decrease left: solution at the precision of the objective
+        todo = todo[np.logical_and(accepted, np.any(xn != xt, axis=1))]
+        if len(todo) == 0:
+            break
+    return x
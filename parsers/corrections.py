@@ -0,0 +1,349 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Corrections of unwrapped files in one streamed pass.
+
+A correction is a model evaluated on a block of lines: the phase of an RMG
+file (e.g. the stratified model removed by flat_atmo), a single band
+float32 file (e.g. a GACOS differential delay map), a polynomial ramp in
+range or azimuth (``.flatr`` / ``.flata`` files of flatten_range and
+flatten_az) or the 13 coefficient polynomial in range, azimuth and
+elevation of invert_ramp_topo_unw.py. Several corrections are summed and
+added to the phase of the unwrapped file block by block, so that the file
+is read and written only once whatever the number of corrections. The
+amplitude is copied.
+
+Ramps and polynomials are removed from the unwrapped phase (convention of
+correct_rgaz_unw.py and correct_ramp_unw.py), RMG models are added back
+(convention of add_rmg.py). Pixels of null or NaN phase, or where a model
+is not defined, are set to 0.
+
+A Plan is the list of corrections to be applied on an input file. It is
+saved as ``<outfile>.plan`` (JSON) in place of the corrected file, so that
+a chain of corrections only writes its final product. Corrections read
+through read() see a planned file as if it had been written, and
+plan() extends the plan of a planned input, so that successive scripts
+accumulate their corrections on the original file.
+
+Example:
+>>> import corrections
+>>> models = [corrections.RMGModel('20070218-20070706_strat_4rlks.unw'),
+...     corrections.loadramp('20070218-20070706_sd_flatr_2rlks.flatr', factor=2)]
+>>> corrections.apply('filt_20070218-20070706_sd_flatr_flatz_4rlks.unw',
+...     'filt_20070218-20070706_sd_4rlks.unw', models)
+>>> # plan mode
+>>> p = corrections.plan('20070218-20070706_gacos_4rlks.unw')
+>>> amp, phi = p.read()
+>>> p.add(corrections.Polynomial(sol, elevation=corrections.RMGModel('radar_4rlks.hgt')))
+>>> p.save('20070218-20070706_gacos_corrunw_4rlks.unw')
+>>> corrections.Plan.load('20070218-20070706_gacos_corrunw_4rlks.unw').apply('20070218-20070706_gacos_corrunw_4rlks.unw')
+"""
+
+from __future__ import print_function
+import os
+import json
+import shutil
+import numpy as np
+
+import rmg
+import headers
+
+def _relpath(filename, dirname):
+    return os.path.relpath(os.path.abspath(filename), os.path.abspath(dirname))
+
+def _joinpath(filename, dirname):
+    return os.path.normpath(os.path.join(dirname, filename))
+
+class RMGModel(object):
+    """ Phase band of an RMG file, multiplied by sign """
+
+    def __init__(self, filename, sign=1.):
+        self.filename = filename
+        self.sign = sign
+        self._raster = None
+
+    def block(self, rows, ncols):
+        if self._raster is None:
+            self._raster = rmg.openrmg(self.filename, mode='r')
+        return self.sign * self._raster.band(2, rows)[:, :ncols]
+
+    def close(self):
+        if self._raster is not None:
+            self._raster.close()
+            self._raster = None
+
+    def todict(self, dirname):
+        return {'type': 'rmg', 'filename': _relpath(self.filename, dirname), 'sign': self.sign}
+
+    def __str__(self):
+        return '{0:+g} * {1}'.format(self.sign, self.filename)
+
+class RasterModel(object):
+    """ Single band float32 file multiplied by sign: little-endian ('<f4', .r4)
+    or big-endian ('>f4', GAMMA)
+    :param shape: (nlines, ncols) of the file (default: from the header of filename)
+    """
+
+    def __init__(self, filename, shape=None, dtype='<f4', sign=1.):
+        if shape is None:
+            ncols, nlines = headers.size(filename)
+            shape = (nlines, ncols)
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.sign = sign
+        self._map = None
+
+    def block(self, rows, ncols):
+        if self._map is None:
+            self._map = np.memmap(self.filename, dtype=np.dtype(self.dtype), mode='r', shape=self.shape)
+        return self.sign * self._map[rows[0]:rows[1], :ncols].astype(np.float32)
+
+    def close(self):
+        self._map = None
+
+    def todict(self, dirname):
+        return {'type': 'raster', 'filename': _relpath(self.filename, dirname),
+            'shape': list(self.shape), 'dtype': self.dtype, 'sign': self.sign}
+
+    def __str__(self):
+        return '{0:+g} * {1}'.format(self.sign, self.filename)
+
+class Ramp(object):
+    """ Polynomial ramp sign * (a*x + b*x**2 + ... + g*x**6) along range
+    (axis=1) or azimuth (axis=0), x = (pixel + 1) * factor being the pixel
+    number at the resolution where the ramp was estimated """
+
+    def __init__(self, coeffs, axis, factor=1, sign=-1.):
+        self.coeffs = np.asarray(coeffs, dtype=np.float64)
+        self.axis = axis
+        self.factor = factor
+        self.sign = sign
+
+    def _poly(self, x):
+        # Horner scheme, no constant term
+        ramp = np.zeros(x.shape)
+        for c in self.coeffs[::-1]:
+            ramp = (ramp + c) * x
+        return self.sign * ramp
+
+    def block(self, rows, ncols):
+        if self.axis == 1:
+            ramp = self._poly(np.arange(1, ncols + 1, dtype=np.float64) * self.factor)
+            return np.broadcast_to(ramp, (rows[1] - rows[0], ncols))
+        ramp = self._poly(np.arange(rows[0] + 1, rows[1] + 1, dtype=np.float64) * self.factor)
+        return np.broadcast_to(ramp[:, np.newaxis], (rows[1] - rows[0], ncols))
+
+    def close(self):
+        pass
+
+    def todict(self, dirname):
+        return {'type': 'ramp', 'coeffs': self.coeffs.tolist(), 'axis': self.axis,
+            'factor': self.factor, 'sign': self.sign}
+
+    def __str__(self):
+        return '{0:+g} * {1} ramp {2}'.format(self.sign, ('azimuth', 'range')[self.axis],
+            ' '.join('{0:g}'.format(c) for c in self.coeffs))
+
+class Polynomial(object):
+    """ sign * polynomial of invert_ramp_topo_unw.py in range rg, azimuth az
+    and elevation z, with coefficients
+    0:rg**3 1:rg**2 2:rg 3:az**3 4:az**2 5:az 6:(rg*az)**2 7:rg*az 8:cst 9:z 10:z**2 11:az*z 12:(az*z)**2
+    :param elevation: model giving z (default: z = 0)
+    :param origin: (line, column) of az = 0, rg = 0
+    """
+
+    def __init__(self, coeffs, elevation=None, origin=(0, 0), sign=-1.):
+        self.coeffs = np.zeros(13)
+        self.coeffs[:len(coeffs)] = coeffs
+        self.elevation = elevation
+        self.origin = tuple(origin)
+        self.sign = sign
+
+    def block(self, rows, ncols):
+        c = self.coeffs
+        rg = np.arange(ncols, dtype=np.float64)[np.newaxis, :] - self.origin[1]
+        az = np.arange(rows[0], rows[1], dtype=np.float64)[:, np.newaxis] - self.origin[0]
+        poly = ((c[0]*rg + c[1])*rg + c[2])*rg + ((c[3]*az + c[4])*az + c[5])*az \
+            + c[6]*(rg*az)**2 + c[7]*rg*az + c[8]
+        if self.elevation is not None and np.any(c[9:] != 0):
+            z = self.elevation.block(rows, ncols)
+            poly = poly + (c[10]*z + c[9])*z + (c[12]*az*z + c[11])*az*z
+        return self.sign * np.broadcast_to(poly, (rows[1] - rows[0], ncols))
+
+    def close(self):
+        if self.elevation is not None:
+            self.elevation.close()
+
+    def todict(self, dirname):
+        return {'type': 'polynomial', 'coeffs': self.coeffs.tolist(), 'origin': list(self.origin),
+            'sign': self.sign, 'elevation': None if self.elevation is None else self.elevation.todict(dirname)}
+
+    def __str__(self):
+        return '{0:+g} * polynomial {1}'.format(self.sign, ' '.join('{0:g}'.format(c) for c in self.coeffs))
+
+def fromdict(d, dirname='.'):
+    ''' Return the model described by the dictionary d (see the todict methods) '''
+    if d is None:
+        return None
+    if d['type'] == 'rmg':
+        return RMGModel(_joinpath(d['filename'], dirname), d['sign'])
+    if d['type'] == 'raster':
+        return RasterModel(_joinpath(d['filename'], dirname), d['shape'], str(d['dtype']), d['sign'])
+    if d['type'] == 'ramp':
+        return Ramp(d['coeffs'], d['axis'], d['factor'], d['sign'])
+    if d['type'] == 'polynomial':
+        return Polynomial(d['coeffs'], fromdict(d['elevation'], dirname), d['origin'], d['sign'])
+    raise ValueError('Unknown correction type {0}'.format(d['type']))
+
+def loadramp(param, factor=1, sign=-1.):
+    """ Return the Ramp of a .flatr (range) or .flata (azimuth) parameter file
+    :param factor: look factor between the estimation and the corrected file
+    :raises: ValueError for another extension
+    """
+    extension = os.path.splitext(param)[1]
+    if extension not in ('.flatr', '.flata'):
+        raise ValueError('Unknown ramp parameter file {0}'.format(param))
+    coeffs = np.loadtxt(param, comments='#', usecols=(0,1,2,3,4,5), ndmin=2)[0]
+    return Ramp(coeffs, 1 if extension == '.flatr' else 0, factor, sign)
+
+def planfile(filename):
+    return filename + '.plan'
+
+def planned(filename):
+    ''' Return True if filename is only planned '''
+    return not os.path.exists(filename) and os.path.exists(planfile(filename))
+
+class Plan(object):
+    """ Corrections to be applied on infile
+    :param fmt: 'rmg' (ROI_PAC two bands) or 'gamma' (big-endian float32 phase)
+    :param shape: (nlines, ncols) of infile (default: from its header)
+    :param rscfile: header of the corrected file (default: infile.rsc)
+    """
+
+    def __init__(self, infile, models=None, fmt='rmg', shape=None, rscfile=None):
+        if shape is None:
+            ncols, nlines = headers.size(infile)
+            shape = (nlines, ncols)
+        self.infile = infile
+        self.models = list(models) if models is not None else []
+        self.fmt = fmt
+        self.shape = tuple(shape)
+        self.rscfile = rscfile
+        if rscfile is None and fmt == 'rmg':
+            self.rscfile = infile + '.rsc'
+
+    def add(self, model):
+        self.models.append(model)
+
+    @classmethod
+    def load(cls, filename):
+        ''' Return the plan of the planned file filename '''
+        dirname = os.path.dirname(os.path.abspath(filename))
+        with open(planfile(filename), 'r') as fid:
+            d = json.load(fid)
+        rscfile = d['rscfile']
+        return cls(_joinpath(d['infile'], dirname), [fromdict(m, dirname) for m in d['models']],
+            str(d['fmt']), d['shape'], None if rscfile is None else _joinpath(rscfile, dirname))
+
+    def save(self, filename):
+        ''' Save the plan as the planned file filename (and its header) '''
+        dirname = os.path.dirname(os.path.abspath(filename))
+        d = {'infile': _relpath(self.infile, dirname), 'fmt': self.fmt, 'shape': list(self.shape),
+            'rscfile': None if self.rscfile is None else _relpath(self.rscfile, dirname),
+            'models': [m.todict(dirname) for m in self.models]}
+        tmp = planfile(filename) + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(d, fid, indent=1)
+        os.rename(tmp, planfile(filename))
+        if self.rscfile is not None:
+            shutil.copy(self.rscfile, filename + '.rsc')
+
+    def _open(self):
+        if self.fmt == 'rmg':
+            return rmg.RMGRaster(self.infile, self.shape[0], self.shape[1], mode='r')
+        return np.memmap(self.infile, dtype=np.dtype('>f4'), mode='r', shape=self.shape)
+
+    def blocks(self, nlines=256, rows=None):
+        """ Iterate over the corrected (first line, amplitude, phase) blocks of nlines
+        lines (amplitude is None for GAMMA files) """
+        l0, l1 = rows if rows is not None else (0, self.shape[0])
+        width = self.shape[1]
+        raster = self._open()
+        try:
+            for b0 in range(l0, l1, nlines):
+                b1 = min(b0 + nlines, l1)
+                if self.fmt == 'rmg':
+                    amp, phi = raster.read((b0, b1))
+                else:
+                    amp, phi = None, raster[b0:b1].astype(np.float32)
+                out = phi.astype(np.float64)
+                for model in self.models:
+                    out += model.block((b0, b1), width)
+                out[(phi == 0) | ~np.isfinite(out)] = 0.
+                yield b0, amp, out
+        finally:
+            if self.fmt == 'rmg':
+                raster.close()
+            del raster
+            for model in self.models:
+                model.close()
+
+    def read(self, rows=None):
+        ''' Return the corrected (amplitude, phase) in memory '''
+        amps, phis = [], []
+        for l0, amp, phi in self.blocks(rows=rows):
+            amps.append(amp); phis.append(phi.astype(np.float32))
+        amp = np.vstack(amps) if self.fmt == 'rmg' else None
+        return amp, np.vstack(phis)
+
+    def apply(self, outfile, nlines=256):
+        ''' Write the corrected file in one pass, and remove the plan of outfile if any '''
+        length, width = self.shape
+        tmp = outfile + '.tmp'
+        if self.fmt == 'rmg':
+            buf = np.empty((min(nlines, length), 2, width), dtype='<f4')
+        else:
+            buf = np.empty((min(nlines, length), width), dtype='>f4')
+        with open(tmp, 'wb') as fid:
+            for l0, amp, phi in self.blocks(nlines):
+                n = phi.shape[0]
+                if self.fmt == 'rmg':
+                    buf[:n, 0, :] = amp
+                    buf[:n, 1, :] = phi
+                else:
+                    buf[:n] = phi
+                buf[:n].tofile(fid)
+        os.rename(tmp, outfile)
+        if self.rscfile is not None and os.path.abspath(self.rscfile) != os.path.abspath(outfile + '.rsc'):
+            shutil.copy(self.rscfile, outfile + '.rsc')
+        if os.path.exists(planfile(outfile)):
+            os.remove(planfile(outfile))
+
+def plan(infile, fmt='rmg', shape=None):
+    ''' Return the plan of infile if it is only planned, otherwise an empty plan on infile '''
+    if planned(infile):
+        return Plan.load(infile)
+    return Plan(infile, fmt=fmt, shape=shape)
+
+def read(filename, fmt='rmg', shape=None, rows=None):
+    ''' Return (amplitude, phase) of filename, computed from its plan if it is only planned '''
+    if planned(filename):
+        return Plan.load(filename).read(rows)
+    if fmt == 'rmg':
+        return rmg.readrmg(filename, rows)
+    if shape is None:
+        ncols, nlines = headers.size(filename)
+        shape = (nlines, ncols)
+    l0, l1 = rows if rows is not None else (0, shape[0])
+    return None, np.memmap(filename, dtype=np.dtype('>f4'), mode='r', shape=tuple(shape))[l0:l1].astype(np.float32)
+
+def apply(infile, outfile, models, nlines=256, rscfile=None):
+    """ Write infile plus the sum of models in outfile, by blocks of nlines lines
+    :param models: list of corrections with a block(rows, ncols) method
+    :param rscfile: header copied to outfile.rsc (default: infile.rsc)
+    """
+    Plan(infile, models, rscfile=rscfile).apply(outfile, nlines)
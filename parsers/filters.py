@@ -0,0 +1,182 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Filtering and colinearity of wrapped interferograms.
+
+Goldstein adaptive filter (Goldstein & Werner, 1998) in the spirit of
+ROI_PAC adapt_filt: the complex interferogram is cut in overlapping
+nfft x nfft patches (step nfft/4), the spectrum of each patch is weighted
+by its smoothed amplitude to the power alpha (filterStrength), and the
+patches are recombined with triangular weights.
+
+Files are processed in strips of lines read from a memory map, and the
+strips are distributed over a thread pool (numpy FFTs release the GIL).
+Each strip reads nfft extra lines on both sides and uses the same patch
+grid as the full image, so that the result does not depend on the strip
+size.
+
+Colinearity (Pinel-Puyssegur et al., 2012) and coherence are local
+window statistics computed with separable box filters on the same strips.
+
+Example:
+>>> import filters
+>>> filters.filter_int('20070218-20070706_4rlks.int', 'filt_20070218-20070706_4rlks.int', alpha=0.5)
+>>> filters.colin_int('20070218-20070706_4rlks.int', 'col_20070218-20070706_4rlks.int', win=3)
+"""
+
+from __future__ import print_function, division
+import multiprocessing
+from functools import partial
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import scipy.ndimage
+
+import headers
+
+def _triangle(nfft):
+    w = 1. - np.abs(np.arange(nfft) - (nfft - 1)/2.) / (nfft/2.)
+    return np.outer(w, w)
+
+def _patches(z, nfft, step):
+    ''' Return a (nrows, ncols, nfft, nfft) view of the patches of z '''
+    npr = (z.shape[0] - nfft) // step + 1
+    npc = (z.shape[1] - nfft) // step + 1
+    s0, s1 = z.strides
+    return as_strided(z, shape=(npr, npc, nfft, nfft), strides=(s0*step, s1*step, s0, s1))
+
+def goldstein(z, alpha=0.5, nfft=32, step=8, smooth=3):
+    """ Goldstein filter of the complex array z. Patches are aligned on
+    line and column -nfft of z, z being zero outside.
+    :param alpha: filter strength, 0 means no filtering
+    :param smooth: size of the boxcar smoothing the spectrum amplitude
+    :returns: filtered complex64 array of the shape of z
+    """
+    if nfft % step != 0:
+        raise ValueError('nfft must be a multiple of step')
+    nlines, ncols = z.shape
+    # pad nfft on each side, and up to a multiple of step
+    pl = nfft + (-(nlines + 2*nfft)) % step
+    pc = nfft + (-(ncols + 2*nfft)) % step
+    zp = np.zeros((nlines + nfft + pl, ncols + nfft + pc), dtype=np.complex64)
+    zp[nfft:nfft+nlines, nfft:nfft+ncols] = z
+
+    # patch rows k = nfft/step apart do not overlap: filter them together
+    # (bounds memory to 4 times the data for the default 75% overlap) and
+    # overlap-add them as one tiled image
+    out = np.zeros(zp.shape, dtype=np.complex128)
+    wsum = np.zeros(zp.shape)
+    tri = _triangle(nfft)
+    k = nfft // step
+    patches = _patches(zp, nfft, step)
+    for a in range(k):
+        spec = np.fft.fft2(patches[a::k])
+        if spec.shape[0] == 0:
+            continue
+        amp = np.abs(spec)
+        if smooth > 1:
+            amp = scipy.ndimage.uniform_filter(amp, size=(1, 1, smooth, smooth), mode='wrap')
+        ampmax = amp.max(axis=(2, 3), keepdims=True)
+        ampmax[ampmax == 0] = 1.
+        spec *= (amp/ampmax)**alpha
+        filt = np.fft.ifft2(spec) * tri
+        del spec, amp
+
+        for b in range(k):
+            sub = filt[:, b::k]
+            nr, nc = sub.shape[:2]
+            if nc == 0:
+                continue
+            r0, c0 = a*step, b*step
+            out[r0:r0+nr*nfft, c0:c0+nc*nfft] += sub.transpose(0, 2, 1, 3).reshape(nr*nfft, nc*nfft)
+            wsum[r0:r0+nr*nfft, c0:c0+nc*nfft] += np.tile(tri, (nr, nc))
+
+    wsum[wsum == 0] = 1.
+    return (out/wsum)[nfft:nfft+nlines, nfft:nfft+ncols].astype(np.complex64)
+
+def _boxmean(a, size):
+    ''' Separable box mean of a real array, zero outside '''
+    a = scipy.ndimage.uniform_filter1d(a, size, axis=0, mode='constant')
+    return scipy.ndimage.uniform_filter1d(a, size, axis=1, mode='constant')
+
+def colinearity(z, win=3, threshold=1.e-4):
+    """ Colinearity of the complex array z (Pinel-Puyssegur et al., 2012):
+    modulus of the mean unit phasor over a (2*win+1)**2 window, pixels of
+    amplitude below threshold being ignored
+    """
+    amp = np.abs(z)
+    valid = amp > threshold
+    u = np.zeros(z.shape, dtype=np.complex64)
+    u[valid] = z[valid] / amp[valid]
+    size = 2*win + 1
+    sr, si = _boxmean(u.real, size), _boxmean(u.imag, size)
+    n = _boxmean(valid.astype(np.float32), size)
+    col = np.zeros(z.shape, dtype=np.float32)
+    k = n > 0
+    col[k] = np.sqrt(sr[k]**2 + si[k]**2) / n[k]
+    return col
+
+def coherence(z, win=3):
+    """ Coherence estimated from the complex interferogram z: modulus of the
+    mean of z over the mean of its amplitude in a (2*win+1)**2 window
+    """
+    size = 2*win + 1
+    amp = _boxmean(np.abs(z).astype(np.float32), size)
+    coh = np.zeros(z.shape, dtype=np.float32)
+    k = amp > 0
+    coh[k] = np.hypot(_boxmean(z.real, size), _boxmean(z.imag, size))[k] / amp[k]
+    return coh
+
+def _replace_amp(z, win=3, threshold=1.e-4):
+    ''' Replace the amplitude of z by its colinearity '''
+    return (colinearity(z, win, threshold) * np.exp(1j*np.angle(z))).astype(np.complex64)
+
+def _strip(z, strip, func=None, halo=0):
+    ''' Apply func on lines strip=(l0, l1) of z, reading halo lines on each side '''
+    l0, l1 = strip
+    e0, e1 = l0 - halo, l1 + halo
+    block = np.zeros((e1 - e0, z.shape[1]), dtype=np.complex64)
+    block[max(0, e0) - e0:min(e1, z.shape[0]) - e0] = z[max(0, e0):min(e1, z.shape[0])]
+    return func(block)[halo:halo + l1 - l0]
+
+def _stream(infile, outfile, func, halo, width=None, nlines=256, nthreads=None, align=1):
+    ''' Apply func on a complex file by strips of nlines lines over nthreads threads '''
+    if width is None:
+        width = headers.width(infile)
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    nlines = max(align, nlines - nlines % align)
+
+    z = np.memmap(infile, dtype=np.complex64, mode='r')
+    length = z.size // width
+    z = z[:length*width].reshape(length, width)
+
+    strips = [(l0, min(l0 + nlines, length)) for l0 in range(0, length, nlines)]
+    pool = ThreadPool(nthreads)
+    try:
+        with open(outfile, 'wb') as fid:
+            for block in pool.imap(partial(_strip, z, func=func, halo=halo), strips):
+                block.tofile(fid)
+    finally:
+        pool.close()
+        pool.join()
+    del z
+
+def filter_int(infile, outfile, width=None, alpha=0.5, nfft=32, step=8, smooth=3, nlines=256, nthreads=None):
+    """ Goldstein filter of a complex .int file, streamed by strips of
+    nlines lines over nthreads threads. Strips start on the patch grid.
+    :param width: number of columns (default: read in infile.rsc)
+    """
+    func = partial(goldstein, alpha=alpha, nfft=nfft, step=step, smooth=smooth)
+    _stream(infile, outfile, func, nfft, width, nlines, nthreads, align=step)
+
+def colin_int(infile, outfile, width=None, win=3, threshold=1.e-4, nlines=256, nthreads=None):
+    """ Replace the amplitude of a complex .int file by its colinearity,
+    streamed by strips of nlines lines over nthreads threads
+    :param width: number of columns (default: read in infile.rsc)
+    """
+    func = partial(_replace_amp, win=win, threshold=threshold)
+    _stream(infile, outfile, func, win, width, nlines, nthreads)
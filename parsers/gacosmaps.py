@@ -0,0 +1,125 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""GACOS zenith delay maps.
+
+GACOS ``.ztd`` files are raw little-endian float32 grids in geographic
+coordinates (EPSG:4326) described by a ROI_PAC ``.ztd.rsc`` header. They
+are opened in place through a VRT raw band (no copy of the grid) and
+cropped, re-projected and resampled on the grid of the data with an
+in-process gdal.Warp to memory, in place of a temporary GeoTIFF and a
+gdalwarp command per date.
+
+Grids are cached per date in a directory next to the source files
+(default: ``cache``), as raw float32 files named after the date and a
+hash of everything they depend on: source file and its modification time
+and the parameters of the computation (output size, projection, crop and
+resampling of a warp, reference area of a referenced grid). Entries are
+reused by later runs and by other processes of a run, but only for the
+same source file: correct_ts_from_gacos.py warps the geographic ``.ztd``
+files, whereas correct_ifg_from_gacos.py references the radar-coded
+``<date>_crop.ztd.unw`` files of GAMMA, so they do not share entries.
+Interferometric models are differences of cached dates, so that each date
+is read or resampled once whatever the number of interferograms.
+
+Example:
+>>> import gacosmaps
+>>> ztd = gacosmaps.warp('GACOS/20070218.ztd', 1420, 2200, epsg=32645, crop=(xmin, ymin, xmax, ymax))
+>>> ztd = gacosmaps.cached_warp('GACOS/20070218.ztd', 1420, 2200, epsg=32645)
+>>> model = gacosmaps.cached_warp('GACOS/20070706.ztd', 1420, 2200) - gacosmaps.cached_warp('GACOS/20070218.ztd', 1420, 2200)
+"""
+
+from __future__ import print_function
+import os
+import json
+import hashlib
+import numpy as np
+import gdal
+from osgeo import osr
+
+import headers
+
+gdal.UseExceptions()
+
+def open_ztd(ztdfile):
+    """ Return an in-memory VRT dataset reading the raw grid of ztdfile in
+    place, georeferenced from ztdfile.rsc """
+    hdr = headers.read(ztdfile + '.rsc')
+    ncol, nlign = hdr.size
+    ds = gdal.GetDriverByName('VRT').Create('', ncol, nlign, 0)
+    ds.AddBand(gdal.GDT_Float32, ['subClass=VRTRawRasterBand',
+        'SourceFilename={0}'.format(os.path.abspath(ztdfile)), 'relativeToVRT=0',
+        'ImageOffset=0', 'PixelOffset=4', 'LineOffset={0}'.format(4*ncol), 'ByteOrder=LSB'])
+    ds.SetGeoTransform(hdr.geotransform)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetProjection(srs.ExportToWkt())
+    return ds
+
+def warp(ztdfile, width, length, epsg=None, crop=None, resampling='average'):
+    """ Return the delays of ztdfile resampled on a width x length grid
+    :param epsg: EPSG code of the output projection (default: EPSG:4326)
+    :param crop: output bounds (xmin, ymin, xmax, ymax) in the output projection
+    (default: extent of the GACOS grid)
+    """
+    src = open_ztd(ztdfile)
+    kwargs = {'format': 'MEM', 'width': width, 'height': length,
+        'srcSRS': 'EPSG:4326', 'resampleAlg': resampling}
+    if epsg is not None:
+        kwargs['dstSRS'] = 'EPSG:{0}'.format(epsg)
+    if crop is not None and crop is not False:
+        kwargs['outputBounds'] = tuple(crop)
+    dst = gdal.Warp('', src, **kwargs)
+    ztd = dst.GetRasterBand(1).ReadAsArray()
+    del dst, src
+    return ztd
+
+def _cachefile(srcfile, key, cachedir=None):
+    ''' Return the cache file of srcfile for the parameters key '''
+    if cachedir is None:
+        cachedir = os.path.join(os.path.dirname(os.path.abspath(srcfile)), 'cache')
+    key = dict(key, source=os.path.abspath(srcfile), mtime=os.path.getmtime(srcfile))
+    digest = hashlib.md5(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    date = os.path.basename(srcfile).split('.')[0]
+    return os.path.join(cachedir, '{0}_{1}.r4'.format(date, digest))
+
+def cached(srcfile, key, shape, compute, cachedir=None):
+    """ Return the grid computed by compute() from srcfile for the parameters key
+    (a JSON-serialisable dictionary), read from the cache if it has already been computed
+    :param shape: (length, width) of the grid
+    """
+    cachefile = _cachefile(srcfile, key, cachedir)
+    if os.path.exists(cachefile):
+        return np.fromfile(cachefile, dtype='<f4').reshape(shape)
+    grid = np.asarray(compute(), dtype='<f4').reshape(shape)
+    dirname = os.path.dirname(cachefile)
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # created by another process in the meantime
+            pass
+    # written under a temporary name: concurrent processes never read a partial grid
+    tmp = '{0}.{1}.tmp'.format(cachefile, os.getpid())
+    grid.tofile(tmp)
+    os.rename(tmp, cachefile)
+    return grid
+
+def cached_warp(ztdfile, width, length, epsg=None, crop=None, resampling='average', cachedir=None):
+    ''' Return warp(ztdfile, ...) from the cache of resampled dates '''
+    key = {'width': width, 'length': length, 'epsg': epsg, 'resampling': resampling,
+        'crop': None if crop is None or crop is False else [float(c) for c in crop]}
+    return cached(ztdfile, key, (length, width),
+        lambda: warp(ztdfile, width, length, epsg, crop, resampling), cachedir)
+
+def reference(grid, rows, cols, nodata=9990.):
+    """ Return grid minus its mean over the lines rows=(first, last) and columns
+    cols=(first, last), ignoring null, NaN and nodata pixels """
+    zone = grid[int(rows[0]):int(rows[1]), int(cols[0]):int(cols[1])]
+    valid = np.logical_and(np.isfinite(zone), np.logical_and(zone != 0, zone < nodata))
+    if not np.any(valid):
+        return grid
+    return grid - np.mean(zone[valid])
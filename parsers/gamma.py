@@ -14,6 +14,8 @@ import os, sys
 import os.path as op
 import glob
 
+import headers
+
 def check_required(required, params):
     for r in required:
         if r not in params:
@@ -21,36 +23,15 @@ def check_required(required, params):
     return True
 
 def _parseParameterFile(filename):
-    with open(filename, mode='r') as par:
-        text = par.read().splitlines()
-        raw_segs = [line.split() for line in text if ':' in line]
-    
-    return dict((i[0][:-1],i[1:]) for i in raw_segs)
+    return headers.read(filename, 'par')
 
 
 def _getParameters(path, par=None, log=False):
-    required_slc = ['nlines', 'width']
-    required_int = ['range_samples','azimuth_lines']
-
-    # path = op.dirname(op.realpath(path))
-    if par == None:
-        par_files = glob.glob('%s/*par' % path)
-    else:
-        par_files = os.path.join(path, par)
-
-
-    for file in par_files:
-        params = _parseParameterFile(file)
-        # print (params)
-
-        if check_required(required_int, params)\
-              or check_required(required_slc, params):
-                if not log:
-                    print('Found parameter file %s' % file)
-                return params
-
-    raise ImportError(
-                    'Parameter file does not hold required parameters')             
+    # parameter files are parsed once and cached in the header registry
+    params = headers.findpar(path, par)
+    if not log:
+        print('Found parameter file %s' % params.filename)
+    return params
 
 
 def readpar(path='./', par=None):
@@ -66,16 +47,80 @@ def readpar(path='./', par=None):
         """
         
         params = _getParameters(path,par,log=True)
-        nrows = int(params['range_samples'][0]) 
-        nlines = int(params['azimuth_lines'][0])
+        nrows, nlines = params.size
         return nlines,nrows
 
-def readgamma(filename,path='./', par=None):
+class GammaRaster(object):
+    """
+    Memory-mapped GAMMA raster (big-endian float32 by default).
+    Windows are converted to native float32 once per read, so that later
+    arithmetic does not byte-swap again.
+
+    >>> gr = opengamma('20070218_20070706.unw')
+    >>> phi = gr.read(rows=(0,500), step=2)
+    >>> for row, block in gr.blocks(256):
+    ...     pass
+    """
+
+    def __init__(self, filename, nlines, nrows, mode='r', dtype='>f4'):
+        self.filename = filename
+        self.shape = (nlines, nrows)
+        self.mode = mode
+        self._map = np.memmap(filename, dtype=np.dtype(dtype), mode=mode, shape=self.shape)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def read(self, rows=None, cols=None, step=1):
+        """
+        :param rows: (first, last) lines of the window (default: all)
+        :param cols: (first, last) columns of the window (default: all)
+        :param step: decimation factor in both directions
+        :returns: native float32 copy of the window
+        """
+        l0, l1 = rows if rows is not None else (0, self.shape[0])
+        c0, c1 = cols if cols is not None else (0, self.shape[1])
+        return self._map[l0:l1:step, c0:c1:step].astype(np.float32)
+
+    def blocks(self, nlines=256, cols=None, step=1):
+        """ Iterate over (first line, native float32 block) of nlines lines """
+        for l0 in range(0, self.shape[0], nlines*step):
+            yield l0, self.read((l0, min(l0 + nlines*step, self.shape[0])), cols, step)
+
+    def write(self, block, row=0, col=0):
+        """ Write a block at line row, column col (converted to big-endian) """
+        block = np.atleast_2d(block)
+        self._map[row:row+block.shape[0], col:col+block.shape[1]] = block
+
+    def flush(self):
+        if self.mode != 'r':
+            self._map.flush()
+
+    def close(self):
+        self.flush()
+        del self._map
+
+def opengamma(filename, path='./', par=None, mode='r'):
+        """ Return a memory-mapped GammaRaster of filename, size read in the
+        parameter file of path """
 
         params = _getParameters(path,par,log=True)
-        nrows = int(params['range_samples'][0]) 
-        nlines = int(params['azimuth_lines'][0])
-        
-        return np.fromfile(filename, dtype='>f4').reshape(nlines, nrows)
+        nrows, nlines = params.size
+        return GammaRaster(filename, nlines, nrows, mode=mode)
+
+def readgamma(filename,path='./', par=None, rows=None, cols=None, step=1):
+        """ Read a GAMMA file (or a window of it) in native float32 """
+
+        with opengamma(filename, path, par) as gr:
+            return gr.read(rows, cols, step)
 
+def writegamma(filename, data, nlines=256):
+        """ Write data in GAMMA big-endian float32 format, by blocks of nlines """
 
+        data = np.atleast_2d(data)
+        with GammaRaster(filename, data.shape[0], data.shape[1], mode='w+') as gr:
+            for l0 in range(0, data.shape[0], nlines):
+                gr.write(data[l0:l0+nlines], l0)
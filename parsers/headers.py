@@ -0,0 +1,220 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Header registry.
+
+Parse ROI_PAC ``.rsc``, GAMMA ``.par`` and ``lect.in`` header files once
+and keep them in a per-process cache keyed by path and modification time,
+so that repeated size lookups in per-interferogram loops are a dict access
+and a ``stat`` call.
+
+Example:
+>>> import headers
+>>> width, length = headers.size('int_20070218_20070706/20070218-20070706_2rlks.int.rsc')
+>>> gt = headers.geotransform('GACOS/20070218.ztd.rsc')
+>>> ncol, nlign = headers.size('lect.in')
+"""
+
+from __future__ import print_function
+import os
+import glob
+
+# required keys to accept a GAMMA parameter file
+required_slc = ['nlines', 'width']
+required_int = ['range_samples', 'azimuth_lines']
+
+# bytes per pixel used to compute FILE_LENGTH (see length.pl)
+pixel_size = {'.int': 8, '.slc': 8, '.unw': 8, '.hgt': 8, '.cor': 8,
+              '.msk': 8, '.r4': 4, '.dem': 2}
+
+_registry = {}
+_parfiles = {}
+
+class Header(dict):
+    """ Parsed header file. Values are kept as read (string for .rsc,
+    list of strings for .par) and converted by the typed accessors """
+
+    def __init__(self, filename, kind, params):
+        dict.__init__(self, params)
+        self.filename = filename
+        self.kind = kind
+
+    def _get(self, *keys):
+        for key in keys:
+            if key in self:
+                value = self[key]
+                if isinstance(value, list):
+                    value = value[0]
+                return value
+        raise KeyError('{0} not found in {1}'.format('/'.join(keys), self.filename))
+
+    def getint(self, *keys):
+        return int(float(self._get(*keys)))
+
+    def getfloat(self, *keys):
+        return float(self._get(*keys))
+
+    @property
+    def width(self):
+        return self.getint('WIDTH', 'range_samples', 'width')
+
+    @property
+    def length(self):
+        return self.getint('FILE_LENGTH', 'azimuth_lines', 'nlines')
+
+    @property
+    def size(self):
+        return self.width, self.length
+
+    @property
+    def steps(self):
+        ''' Return pixel size (xstep, ystep) '''
+        return self.getfloat('X_STEP', 'post_lon', 'post_east'), \
+            self.getfloat('Y_STEP', 'post_lat', 'post_north')
+
+    @property
+    def geotransform(self):
+        ''' Return gdal geotransform (xfirst, xstep, 0, yfirst, 0, ystep) '''
+        xfirst = self.getfloat('X_FIRST', 'corner_lon', 'corner_east')
+        yfirst = self.getfloat('Y_FIRST', 'corner_lat', 'corner_north')
+        xstep, ystep = self.steps
+        return (xfirst, xstep, 0, yfirst, 0, ystep)
+
+def _parse_rsc(filename):
+    params = {}
+    with open(filename, 'r') as rsc:
+        for line in rsc:
+            fields = line.split(None, 1)
+            if len(fields) == 2:
+                params[fields[0]] = fields[1].strip()
+    return params
+
+def _parse_par(filename):
+    with open(filename, 'r') as par:
+        raw_segs = [line.split() for line in par.read().splitlines() if ':' in line]
+    return dict((i[0][:-1], i[1:]) for i in raw_segs)
+
+def _parse_lect(filename):
+    with open(filename, 'r') as lect:
+        values = lect.readline().split()
+    params = {'WIDTH': values[0], 'FILE_LENGTH': values[1]}
+    if len(values) > 2:
+        params['NDATES'] = values[2]
+    return params
+
+def _kind(filename):
+    base = os.path.basename(filename)
+    if base.endswith('.rsc'):
+        return 'rsc'
+    if base.endswith('par'):
+        return 'par'
+    return 'lect'
+
+_parsers = {'rsc': _parse_rsc, 'par': _parse_par, 'lect': _parse_lect}
+
+def read(filename, kind=None):
+    """ Return the Header of filename, parsing it only if it changed
+    since the last call
+    :param kind: 'rsc', 'par' or 'lect' (default: guessed from the name)
+    """
+    key = os.path.abspath(filename)
+    st = os.stat(key)
+    stamp = (st.st_mtime, st.st_size)
+    cached = _registry.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    if kind is None:
+        kind = _kind(key)
+    header = Header(key, kind, _parsers[kind](key))
+    _registry[key] = (stamp, header)
+    return header
+
+def header(filename):
+    ''' Return the Header of a data file or of a header file '''
+    if not filename.endswith('.rsc') and os.path.exists(filename + '.rsc'):
+        filename = filename + '.rsc'
+    return read(filename)
+
+def size(filename):
+    ''' Return width, length of a data file or of a header file '''
+    return header(filename).size
+
+def width(filename):
+    return header(filename).width
+
+def length(filename):
+    return header(filename).length
+
+def steps(filename):
+    return header(filename).steps
+
+def geotransform(filename):
+    return header(filename).geotransform
+
+def _check_required(required, params):
+    for r in required:
+        if r not in params:
+            return False
+    return True
+
+def findpar(path='./', par=None):
+    """ Return the Header of the GAMMA parameter file of directory path
+    holding the image size. The directory lookup is cached on its mtime.
+    :raises: ImportError
+    """
+    if par is not None:
+        par_files = [os.path.join(path, par)]
+    else:
+        key = os.path.abspath(path)
+        stamp = os.stat(key).st_mtime
+        cached = _parfiles.get(key)
+        if cached is not None and cached[0] == stamp:
+            return read(cached[1], 'par')
+        par_files = sorted(glob.glob('%s/*par' % path))
+
+    for parfile in par_files:
+        params = read(parfile, 'par')
+        if _check_required(required_int, params) \
+              or _check_required(required_slc, params):
+            if par is None:
+                _parfiles[key] = (stamp, parfile)
+            return params
+
+    raise ImportError(
+                    'Parameter file does not hold required parameters')
+
+def setlength(filename, nbytes=None):
+    """ Update FILE_LENGTH and YMAX of the .rsc of filename from its size on
+    disk, in place of ROI_PAC length.pl. Return the new length.
+    :param nbytes: bytes per pixel (default: from the file extension)
+    :raises: ValueError if nbytes is not given for an extension not in pixel_size
+    """
+    rscfile = filename + '.rsc'
+    if nbytes is None:
+        extension = os.path.splitext(filename)[1]
+        if extension not in pixel_size:
+            raise ValueError('Unknown pixel size of {0}: give nbytes'.format(filename))
+        nbytes = pixel_size[extension]
+    hdr = read(rscfile, 'rsc')
+    newlength = os.path.getsize(filename) // (hdr.width * nbytes)
+
+    lines = []
+    with open(rscfile, 'r') as rsc:
+        for line in rsc:
+            fields = line.split(None, 1)
+            if fields and fields[0] in ('FILE_LENGTH', 'YMAX'):
+                line = '{0:<14}{1}\n'.format(fields[0], newlength if fields[0] == 'FILE_LENGTH' else newlength - 1)
+            lines.append(line)
+    if 'FILE_LENGTH' not in hdr:
+        lines.append('{0:<14}{1}\n'.format('FILE_LENGTH', newlength))
+    with open(rscfile, 'w') as rsc:
+        rsc.writelines(lines)
+    return newlength
+
+def clear():
+    ''' Empty the registry '''
+    _registry.clear()
+    _parfiles.clear()
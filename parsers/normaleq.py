@@ -0,0 +1,108 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Weighted least squares of many pixels sharing the dates of a cube.
+
+For a matrix G of basis functions at the N dates (N, M) and a weight w
+per date, the normal equations of a pixel are sums over its valid dates:
+GtWG = sum(w g g^T) and GtWd = sum(w g d), i.e. the sums of t, t**2, d,
+t*d... of a linear fit. They are computed for a block of pixels with a
+few matrix products, missing dates (NaN) being ignored, and solved for
+all the pixels at once: there is no call to a solver per pixel. The sums
+of w*d**2, of the weights and of the number of dates are kept with them,
+so that the misfit, the model errors and the RMS are computed without
+going back to the data.
+
+Sums over successive sets of dates add up: equations saved on disk with
+their coefficients are updated with the dates acquired since (a rank-one
+term per date and pixel) and solved again, which gives the fit of all
+the dates without reading the previous ones.
+
+Example:
+>>> import normaleq
+>>> eq = normaleq.NormalEquations(npix, G.shape[1])
+>>> eq.add(G, disp, w)                  # disp (npix, N), NaN where missing
+>>> m, sigmam, rms = eq.solve(mincount=N/6)
+>>> eq = normaleq.open('normaleq', npix, G.shape[1], mode='r+')
+>>> eq.rows(0, 1000).add(G[new], newdisp, w[new])
+"""
+
+from __future__ import print_function
+import numpy as np
+
+def _arrays(npix, M):
+    """ Return the names, shapes and types of the sums """
+    return [('GtWG', (npix, M, M), np.float64), ('GtWd', (npix, M), np.float64),
+            ('dtWd', (npix,), np.float64), ('sumw', (npix,), np.float64),
+            ('count', (npix,), np.int32)]
+
+class NormalEquations(object):
+    """ Normal equations of npix pixels for M basis functions
+    :param sums: arrays of the sums by name (default: zeros in memory)
+    """
+
+    def __init__(self, npix, M, sums=None):
+        self.npix, self.M = npix, M
+        for name, shape, dtype in _arrays(npix, M):
+            setattr(self, name, np.zeros(shape, dtype=dtype) if sums is None else sums[name])
+
+    def rows(self, start, stop):
+        """ Return the equations of pixels start to stop, sharing the sums of
+        self: adding dates to them adds them to self """
+        return NormalEquations(stop - start, self.M,
+            dict((name, getattr(self, name)[start:stop]) for name, _, _ in _arrays(0, 0)))
+
+    def flush(self):
+        for name, _, _ in _arrays(0, 0):
+            array = getattr(self, name)
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def add(self, G, d, w=None):
+        """ Add the dates of G (N, M) to the sums of the pixels
+        :param d: displacements (npix, N), NaN where missing
+        :param w: weight of each date (default: 1)
+        """
+        if w is None:
+            w = np.ones(G.shape[0])
+        valid = ~np.isnan(d)
+        d0 = np.where(valid, d, 0.)
+        vw = valid*w
+        GG = (G[:, :, np.newaxis]*G[:, np.newaxis, :]).reshape(G.shape[0], -1)
+        self.GtWG += np.dot(vw, GG).reshape(-1, self.M, self.M)
+        self.GtWd += np.dot(d0*w, G)
+        self.dtWd += np.dot(d0**2, w)
+        self.sumw += vw.sum(axis=1)
+        self.count += valid.sum(axis=1, dtype=np.int32)
+
+    def solve(self, mincount=0, rcond=1.0e-10):
+        """ Return models, model errors (npix, M) and weighted RMS of the
+        residuals (npix) of the pixels with more than mincount dates (NaN for
+        the others). Errors are the diagonal of (GtWG)^-1 scaled by the misfit
+        divided by the degrees of freedom (as in consInvert)
+        """
+        m = np.ones((self.npix, self.M))*np.nan
+        sigmam = np.ones((self.npix, self.M))*np.nan
+        rms = np.ones(self.npix)*np.nan
+        ok = self.count > max(mincount, self.M)
+        if not np.any(ok):
+            return m, sigmam, rms
+
+        cov = np.linalg.pinv(self.GtWG[ok], rcond=rcond)
+        m[ok] = np.einsum('pij,pj->pi', cov, self.GtWd[ok])
+        # misfit sum(w (d - Gm)**2) = dtWd - m.GtWd at the solution
+        chi2 = np.maximum(self.dtWd[ok] - np.einsum('pi,pi->p', m[ok], self.GtWd[ok]), 0.)
+        var = np.diagonal(cov, axis1=1, axis2=2)
+        sigmam[ok] = np.sqrt(var*(chi2/(self.count[ok] - self.M))[:, np.newaxis])
+        rms[ok] = np.sqrt(chi2/self.sumw[ok])
+        return m, sigmam, rms
+
+def open(prefix, npix, M, mode='r+'):
+    """ Return the normal equations saved in files prefix_GtWG, prefix_GtWd, ...
+    (raw arrays) mapped in memory. With mode='w+', create them with zero sums """
+    sums = dict((name, np.memmap('{0}_{1}'.format(prefix, name), dtype=dtype, mode=mode, shape=shape))
+                for name, shape, dtype in _arrays(npix, M))
+    return NormalEquations(npix, M, sums)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Random access to the pixel time series of a BIP cube.
+
+A cube of displacements (e.g. depl_cumule) is stored line by line, pixel
+by pixel, date by date (BIP, float32): the time series of pixel (i,j)
+is N contiguous values at byte offset (j*ncol+i)*N*4 and a window of
+half-size w is 2w+1 segments of (2w+1)*N values. The cube is mapped in
+memory and only the pages of the requested pixels are read, so that a
+few pixels of a cube larger than the RAM are extracted in milliseconds.
+Values are returned as read (no scaling, no reference), in float64, with
+no-data values set to NaN.
+
+For many or large windows, WindowMean keeps NaN-aware summed-area tables
+(cumulated sums of the values and of the number of valid values, per
+date) of blocks of lines, built when first needed: the mean of any
+window is then a few additions per date, whatever its size. The number
+of lines of a block is chosen so that the tables kept in memory fit in a
+byte budget, and the counts are kept modulo 2**16 (uint16), which is
+exact for windows of less than 2**16 pixels.
+
+Example:
+>>> import pixelseries
+>>> cube = pixelseries.Cube('depl_cumule', ncol, nlign, N)
+>>> disp = cube.series(200, 1200, w=2)*rad2mm
+>>> winds = cube.windows([200,400,450], [1200,1200,3000], w=2)
+>>> last = cube.band(N-1, rows=(1100,1300), cols=(100,300))
+>>> disps = pixelseries.WindowMean(cube, ref=imref).means(ipix, jpix, w=10)*rad2mm
+"""
+
+from __future__ import print_function
+import numpy as np
+from collections import OrderedDict
+
+class Cube(object):
+    """ Read-only BIP cube of shape (nlign, ncol, N)
+    :param nodata: values set to NaN when read
+    """
+
+    def __init__(self, filename, ncol, nlign, N, dtype='<f4', nodata=(9990., 9999.)):
+        self.filename = filename
+        self.ncol, self.nlign, self.N = ncol, nlign, N
+        self.nodata = nodata
+        self.maps = np.memmap(filename, dtype=dtype, mode='r', shape=(nlign, ncol, N))
+
+    def _read(self, block, out=None):
+        ''' Return block in float64 (in out if given) with no-data values set to NaN '''
+        if out is None:
+            data = np.array(block, dtype=np.float64)
+        else:
+            data = out
+            data[...] = block
+        for value in self.nodata:
+            data[data == value] = np.nan
+        return data
+
+    def _clip(self, start, stop, size):
+        return slice(max(int(start), 0), min(int(stop), size))
+
+    def window(self, i, j, w=0):
+        ''' Return the time series of the pixels of the window of half-size w
+        around column i and line j (cropped to the cube), shape (rows, cols, N) '''
+        rows = self._clip(j - w, j + w + 1, self.nlign)
+        cols = self._clip(i - w, i + w + 1, self.ncol)
+        return self._read(self.maps[rows, cols, :])
+
+    def series(self, i, j, w=0):
+        ''' Return the mean time series of the window of half-size w around
+        column i and line j, shape (N,) '''
+        return np.nanmean(self.window(i, j, w), axis=(0, 1))
+
+    def windows(self, ipix, jpix, w=0):
+        """ Return the windows of half-size w around columns ipix and lines jpix
+        (see window), in the order of ipix, jpix. Windows are read in the order
+        of the file, in a single pass over the cube """
+        order = np.lexsort((np.asarray(ipix), np.asarray(jpix)))
+        winds = [None]*len(order)
+        for k in order:
+            winds[k] = self.window(ipix[k], jpix[k], w)
+        return winds
+
+    def band(self, l, rows=None, cols=None, step=1):
+        """ Return date l on lines rows=(start,stop) and columns cols=(start,stop)
+        (default: the full frame), every step pixels. For the full frame of a
+        large cube, use step > 1: every page of the cube holds values of date l
+        """
+        rows = self._clip(rows[0], rows[1], self.nlign) if rows is not None else slice(0, self.nlign)
+        cols = self._clip(cols[0], cols[1], self.ncol) if cols is not None else slice(0, self.ncol)
+        return self._read(self.maps[rows.start:rows.stop:step, cols.start:cols.stop:step, l])
+
+class WindowMean(object):
+    """ Window means of the time series of a Cube from summed-area tables
+    built by blocks of nlines lines, the maxblocks last used being kept in memory
+    :param ref: date subtracted to each pixel before averaging (default: none)
+    :param nlines: lines of a block (default: the most, up to 64, for which
+    maxblocks blocks fit in budget bytes)
+    :param maxw: largest half-size of the windows. Counts are stored as uint16
+    if the windows have less than 2**16 pixels, otherwise as int32
+    """
+
+    def __init__(self, cube, ref=None, nlines=None, maxblocks=4, budget=512*2**20, maxw=127):
+        self.cube, self.ref = cube, ref
+        self.maxw, self.maxblocks = maxw, maxblocks
+        self._counttype = np.uint16 if (2*maxw + 1)**2 < 2**16 else np.int32
+        if nlines is None:
+            # bytes per line: float64 sums and counts of the blocks kept,
+            # plus the mask of valid values of the block being built
+            perline = (cube.ncol + 1)*cube.N*(maxblocks*(8 + np.dtype(self._counttype).itemsize) + 1)
+            nlines = int(min(max(budget//perline - 1, 1), 64))
+        self.nlines = nlines
+        self._blocks = OrderedDict()
+
+    def _block(self, b):
+        """ Return the tables of sums and valid counts of block b, shape
+        (lines+1, ncol+1, N) with a leading row and column of zeros """
+        if b in self._blocks:
+            self._blocks[b] = self._blocks.pop(b)
+            return self._blocks[b]
+        while len(self._blocks) >= self.maxblocks:
+            self._blocks.popitem(last=False)
+        start = b*self.nlines
+        stop = min(start + self.nlines, self.cube.nlign)
+        shape = (stop - start + 1, self.cube.ncol + 1, self.cube.N)
+        # tables built in place, without copy of the block
+        sums = np.zeros(shape)
+        data = self.cube._read(self.cube.maps[start:stop], out=sums[1:, 1:])
+        if self.ref is not None:
+            data -= data[:, :, self.ref:self.ref+1]
+        valid = ~np.isnan(data)
+        data[~valid] = 0.
+        np.cumsum(data, axis=0, out=data)
+        np.cumsum(data, axis=1, out=data)
+        counts = np.zeros(shape, dtype=self._counttype)
+        # uint16 counts wrap around: differences of the tables are exact modulo 2**16
+        np.cumsum(valid, axis=0, dtype=self._counttype, out=counts[1:, 1:])
+        del valid
+        np.cumsum(counts[1:, 1:], axis=1, out=counts[1:, 1:])
+        self._blocks[b] = (sums, counts)
+        return self._blocks[b]
+
+    def mean(self, i, j, w=0):
+        """ Return the mean time series of the window of half-size w around column
+        i and line j (NaN where the window has no valid value), shape (N,)
+        :raises: ValueError if w > maxw """
+        if w > self.maxw:
+            raise ValueError('Window half-size {0} larger than maxw={1}'.format(w, self.maxw))
+        rows = self.cube._clip(j - w, j + w + 1, self.cube.nlign)
+        cols = self.cube._clip(i - w, i + w + 1, self.cube.ncol)
+        total, count = np.zeros(self.cube.N), np.zeros(self.cube.N)
+        if rows.start >= rows.stop or cols.start >= cols.stop:
+            return total*np.nan
+        c0, c1 = cols.start, cols.stop
+        for b in range(rows.start//self.nlines, (rows.stop - 1)//self.nlines + 1):
+            sums, counts = self._block(b)
+            r0 = max(rows.start - b*self.nlines, 0)
+            r1 = min(rows.stop - b*self.nlines, sums.shape[0] - 1)
+            total += sums[r1, c1] - sums[r0, c1] - sums[r1, c0] + sums[r0, c0]
+            count += counts[r1, c1] - counts[r0, c1] - counts[r1, c0] + counts[r0, c0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total/count, np.nan)
+
+    def means(self, ipix, jpix, w=0):
+        """ Return the mean time series of the windows of half-size w around columns
+        ipix and lines jpix, shape (len(ipix), N). Windows are computed in the order
+        of the lines, each block being built once """
+        order = np.lexsort((np.asarray(ipix), np.asarray(jpix)))
+        disps = np.zeros((len(order), self.cube.N))
+        for k in order:
+            disps[k] = self.mean(ipix[k], jpix[k], w)
+        return disps
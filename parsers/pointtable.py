@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Columnar reader for large ASCII point tables.
+
+Tables such as the ``ncycle_topo`` file written by flatten_topo hold one
+row of space separated numbers per point and can reach millions of rows.
+They are parsed by chunks of lines with ``np.fromstring`` (C-level
+parsing), keeping only the requested columns, or by ``np.loadtxt`` for
+numpy >= 1.23 where it is itself a C parser. The parsed table is cached
+as a float32 ``.npy`` sidecar next to the text file and reused as long as
+it is newer than the text file.
+
+Example:
+>>> import pointtable
+>>> i, j, z, phi, coh, deltaz = pointtable.loadtable('ncycle_topo', usecols=(0,1,2,3,5,10))
+"""
+
+from __future__ import print_function
+import os
+import numpy as np
+
+# np.loadtxt is implemented in C since numpy 1.23
+_cloadtxt = tuple(int(v) for v in np.__version__.split('.')[:2]) >= (1, 23)
+
+def _parse(lines, comments):
+    ''' Parse a chunk of complete lines into a (nrows, ncols) float32 array '''
+    if comments is not None and comments in lines:
+        lines = '\n'.join(line.split(comments, 1)[0] for line in lines.splitlines())
+    first = lines.lstrip().split('\n', 1)[0]
+    ncols = len(first.split())
+    if ncols == 0:
+        return None
+    data = np.fromstring(lines, dtype=np.float32, sep=' ')
+    if data.size % ncols != 0:
+        raise ValueError('Inconsistent number of columns in table')
+    return data.reshape(-1, ncols)
+
+def _read(filename, usecols, comments, chunksize):
+    if _cloadtxt:
+        return np.loadtxt(filename, dtype=np.float32, comments=comments, usecols=usecols, ndmin=2)
+    blocks, tail = [], ''
+    with open(filename, 'r') as fid:
+        while True:
+            chunk = fid.read(chunksize)
+            if not chunk:
+                break
+            chunk = tail + chunk
+            cut = chunk.rfind('\n') + 1
+            chunk, tail = chunk[:cut], chunk[cut:]
+            block = _parse(chunk, comments)
+            if block is not None:
+                blocks.append(block if usecols is None else block[:, usecols])
+    if tail.strip():
+        block = _parse(tail, comments)
+        if block is not None:
+            blocks.append(block if usecols is None else block[:, usecols])
+    if len(blocks) == 0:
+        return np.zeros((0, 0 if usecols is None else len(usecols)), dtype=np.float32)
+    return np.concatenate(blocks)
+
+def sidecar(filename):
+    return filename + '.npy'
+
+def loadtable(filename, usecols=None, comments='#', cache=True, chunksize=1 << 24):
+    """ Load the columns usecols of an ASCII table as float32 arrays
+    :param cache: read and write the binary sidecar filename.npy
+    :param chunksize: number of bytes parsed at once
+    :returns: one array per column (as np.loadtxt with unpack=True)
+    """
+    if usecols is not None:
+        usecols = list(usecols)
+    npy = sidecar(filename)
+    if cache and os.path.exists(npy) and os.path.getmtime(npy) >= os.path.getmtime(filename):
+        data = np.load(npy, mmap_mode='r')
+        if usecols is not None:
+            data = data[:, usecols]
+    elif cache:
+        data = _read(filename, None, comments, chunksize)
+        np.save(npy, data)
+        if usecols is not None:
+            data = data[:, usecols]
+    else:
+        data = _read(filename, usecols, comments, chunksize)
+    return tuple(np.array(data[:, k]) for k in range(data.shape[1]))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""ROI_PAC RMG (BIL) reader and writer.
+
+ROI_PAC ``.unw``, ``.hgt`` and ``.cor`` files store two float32 bands
+interleaved by line: for each line, the amplitude (band 1) then the
+phase (band 2). The file is memory-mapped as a ``(length, 2, width)``
+array, so that both bands are zero-copy views and a window of lines is
+read in a single pass, instead of one gdal ReadAsArray per band.
+
+Example:
+>>> import rmg
+>>> amp, phi = rmg.readrmg('20070218-20070706_4rlks.unw')
+>>> with rmg.openrmg('radar_4rlks.hgt') as r:
+...     elev = r.band(2, rows=(0, 500))
+>>> rmg.writermg('out.unw', amp, phi - model, rscfile='20070218-20070706_4rlks.unw.rsc')
+"""
+
+from __future__ import print_function
+import shutil
+import numpy as np
+
+import headers
+
+class RMGRaster(object):
+    """ Memory-mapped two-band line-interleaved float32 raster.
+    mode 'c' (default) is copy-on-write: views can be modified in memory
+    without touching the file """
+
+    def __init__(self, filename, nlines=None, ncols=None, mode='c', dtype='<f4'):
+        if nlines is None or ncols is None:
+            ncols, nlines = headers.size(filename)
+        self.filename = filename
+        self.shape = (nlines, ncols)
+        self.mode = mode
+        self._map = np.memmap(filename, dtype=np.dtype(dtype), mode=mode, shape=(nlines, 2, ncols))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def band(self, band, rows=None):
+        """ Return a view of band 1 (amplitude) or 2 (phase) for lines rows=(first, last) """
+        l0, l1 = rows if rows is not None else (0, self.shape[0])
+        return self._map[l0:l1, band-1, :]
+
+    def read(self, rows=None):
+        """ Return views (amplitude, phase) for lines rows=(first, last) """
+        return self.band(1, rows), self.band(2, rows)
+
+    def blocks(self, nlines=256):
+        """ Iterate over (first line, amplitude, phase) blocks of nlines lines """
+        for l0 in range(0, self.shape[0], nlines):
+            amp, phi = self.read((l0, min(l0 + nlines, self.shape[0])))
+            yield l0, amp, phi
+
+    def write(self, amp, phi, row=0):
+        """ Write amplitude and phase blocks starting at line row """
+        phi = np.atleast_2d(phi)
+        self._map[row:row+phi.shape[0], 0, :] = amp
+        self._map[row:row+phi.shape[0], 1, :] = phi
+
+    def flush(self):
+        if self.mode in ('r+', 'w+'):
+            self._map.flush()
+
+    def close(self):
+        self.flush()
+        del self._map
+
+def openrmg(filename, mode='c'):
+    ''' Open RMG file, size read in filename.rsc '''
+    return RMGRaster(filename, mode=mode)
+
+def readrmg(filename, rows=None):
+    ''' Return copy-on-write views (amplitude, phase) of an RMG file '''
+    return RMGRaster(filename).read(rows)
+
+def writermg(filename, amp, phi, rscfile=None, nlines=256):
+    """ Write amplitude and phase in RMG format in one sequential pass
+    :param amp: amplitude map or scalar
+    :param rscfile: header to be copied to filename.rsc (optional)
+    """
+    phi = np.atleast_2d(phi)
+    length, width = phi.shape
+    amp = np.broadcast_to(amp, phi.shape) if np.ndim(amp) < 2 else amp
+    buf = np.empty((min(nlines, length), 2, width), dtype='<f4')
+    with open(filename, 'wb') as fid:
+        for l0 in range(0, length, nlines):
+            n = min(nlines, length - l0)
+            buf[:n, 0, :] = amp[l0:l0+n]
+            buf[:n, 1, :] = phi[l0:l0+n]
+            buf[:n].tofile(fid)
+    if rscfile is not None:
+        shutil.copy(rscfile, filename + '.rsc')
@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Staging of working files on node-local scratch space.
+
+The files needed by a processing chain are copied from the shared file
+system into a scratch directory (tmpfs or local disk), the chain runs
+there, and only the final products are copied back. Copies back are
+verified with a md5 checksum of the source and of the destination, and
+renamed to their final name only once verified. Symbolic links are copied
+as links: staged in, they point to the absolute path of their target on the
+shared file system (relative links such as ../file.unw would dangle in the
+scratch directory); copied back, they are kept as they are.
+
+Example:
+>>> import staging
+>>> staging.stage_in(['int/int_20070218_20070706/20070218-20070706_sd_2rlks.int'], '/tmp/scratch/int_20070218_20070706')
+>>> staging.stage_out(['/tmp/scratch/int_20070218_20070706/filt_20070218-20070706_sd_4rlks.unw'], 'int/int_20070218_20070706')
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+def md5sum(filename, chunk=1 << 20):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fid:
+        for block in iter(lambda: fid.read(chunk), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def _copylink(src, dest, absolute=False):
+    target = os.readlink(src)
+    if absolute:
+        target = os.path.abspath(os.path.join(os.path.dirname(src), target))
+    if os.path.lexists(dest):
+        os.remove(dest)
+    os.symlink(target, dest)
+
+def copy_checked(src, dest, retry=1):
+    """ Copy src to dest through a temporary file, checking the md5 sums
+    :raises: IOError if the checksums still differ after retry new copies
+    """
+    if os.path.islink(src):
+        _copylink(src, dest)
+        return
+    tmp = dest + '.part'
+    for i in range(retry + 1):
+        shutil.copyfile(src, tmp)
+        if md5sum(src) == md5sum(tmp):
+            shutil.copymode(src, tmp)
+            os.rename(tmp, dest)
+            return
+        logger.warning('Checksum mismatch copying {0} to {1}'.format(src, dest))
+    os.remove(tmp)
+    raise IOError('Failed copying {0} to {1}: checksum mismatch'.format(src, dest))
+
+def stage_in(files, dirname):
+    """ Copy files (and their .rsc) into dirname, created if needed.
+    Return the list of the staged files """
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    staged = []
+    for src in files:
+        for f in (src, src + '.rsc'):
+            if os.path.lexists(f):
+                dest = os.path.join(dirname, os.path.basename(f))
+                if os.path.islink(f):
+                    _copylink(f, dest, absolute=True)
+                else:
+                    shutil.copyfile(f, dest)
+                staged.append(dest)
+    return staged
+
+def stage_out(files, dirname):
+    """ Copy back files (and their .rsc) into dirname with checksums.
+    Missing files are skipped. Return the list of the copied files """
+    copied = []
+    for src in files:
+        for f in (src, src + '.rsc'):
+            if os.path.lexists(f):
+                dest = os.path.join(dirname, os.path.basename(f))
+                copy_checked(f, dest)
+                copied.append(dest)
+    logger.info('{0} files copied back in {1}'.format(len(copied), dirname))
+    return copied
@@ -0,0 +1,114 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Truncated SVD inversions of many pixels sharing a matrix.
+
+The time series of the pixels (or stations) with the same valid dates
+share the matrix A of the basis functions: the solutions of all of them,
+the columns of B, are given by a single SVD of A, eigenvalues below cond
+being cut off. The covariance of the solutions (A^T A)^-1 = V S^-2 V^T
+comes from the same decomposition and is scaled by the misfit of each
+pixel (Tarantola). With bounds, the coseismic steps are bounded by their
+prior solution (without postseismic terms) and the postseismic terms have
+the sign of their coseismic step; the bounded least squares of all the
+pixels are solved together by boundedlsq.
+
+Example:
+>>> import svdinv
+>>> m, sigmam, cov = svdinv.batchInvert(G, d, cond=1.0e-3)           # m (M, P)
+>>> m, sigmam, cov = svdinv.batchConsInvert(G, d, sigmad, indexco, indexpofull, tcar, cond=1.0e-3)
+"""
+
+from __future__ import print_function
+import numpy as np
+
+import boundedlsq
+
+def truncSVD(A, cond):
+    ''' Return U, the inverse of the eigenvalues (zero below cond) and V of the SVD of A '''
+    U, eignv, V = np.linalg.svd(A, full_matrices=False)
+    inv = np.zeros(len(eignv))
+    inv[eignv >= cond] = 1./eignv[eignv >= cond]
+    return U, inv, V
+
+def covSVD(A, cond):
+    ''' Return the covariance (A^T A)^-1 = V S^-2 V^T of the solutions of A (unscaled),
+    NaN if the SVD does not converge '''
+    try:
+        U, inv, V = truncSVD(A, cond)
+        return np.dot(V.T*inv**2, V)
+    except np.linalg.LinAlgError:
+        return np.ones((A.shape[1], A.shape[1]))*float('NaN')
+
+def invSVD(A, B, cond):
+    """ Return the solutions of A x = B (one column per pixel) and their covariance
+    (see covSVD) from the same decomposition (least squares if the SVD does not converge) """
+    try:
+        U, inv, V = truncSVD(A, cond)
+        fsoln = np.dot(V.T, inv[:, np.newaxis]*np.dot(U.T, B))
+        cov = np.dot(V.T*inv**2, V)
+    except np.linalg.LinAlgError:
+        fsoln = np.linalg.lstsq(A, B, rcond=cond)[0]
+        cov = np.ones((A.shape[1], A.shape[1]))*float('NaN')
+    return fsoln, cov
+
+def covScale(A, B, fsoln, cov):
+    """ Scale the covariance of the pixels (columns of B) sharing A by the misfit of each pixel
+    (sigma m **2 = misfit**2 * diag([G.TG]-1))
+    :returns: model errors (one column per pixel) and covariances (one matrix per pixel)
+    """
+    res2 = np.sum((B - np.dot(A, fsoln))**2, axis=0)
+    scale = res2/(A.shape[0] - A.shape[1])
+    sigmam = np.sqrt(np.diag(cov)[:, np.newaxis]*scale)
+    return sigmam, cov[np.newaxis, :, :]*scale[:, np.newaxis, np.newaxis]
+
+def batchInvert(A, B, cond=1.0e-3):
+    """ Solve the unconstrained problems of the columns of B with a single decomposition of A
+    :returns: models, model errors (one column per pixel) and covariances (one matrix per pixel)
+    """
+    fsoln, cov = invSVD(A, B, cond)
+    sigmam, cov = covScale(A, B, fsoln, cov)
+    return fsoln, sigmam, cov
+
+def postBounds(minit, indexco, indexpofull, tcar):
+    """ Return the bounds (P, M) of the pixels of prior solutions minit (M, P): the
+    postseismic term of each coseismic step has the sign of the step, and the step is
+    between 0 and its prior value
+    :param indexco: column of each coseismic step
+    :param indexpofull: column of the postseismic term of each coseismic step
+    :param tcar: characteristic time of each postseismic term (<= 0 without postseismic,
+    steps beyond its length have none)
+    """
+    mmin, mmax = -np.ones(minit.T.shape)*np.inf, np.ones(minit.T.shape)*np.inf
+    for co, po, t in zip(indexco, indexpofull, tcar):
+        if t > 0.:
+            co, po = int(co), int(po)
+            up, down = minit[co] > 0., minit[co] < 0.
+            mmin[up, po], mmax[up, po] = 0, np.inf
+            mmin[up, co], mmax[up, co] = 0, minit[co, up]
+            mmin[down, po], mmax[down, po] = -np.inf, 0
+            mmin[down, co], mmax[down, co] = minit[co, down], 0
+    return mmin, mmax
+
+def batchConsInvert(A, B, sigmad, indexco, indexpofull, tcar, cond=1.0e-3, iter=2000, acc=1e-12):
+    """ Solve the constrained problems of the columns of B at once: the prior solutions
+    without postseismic are given by a single SVD of A, and the bounded least squares of
+    all the columns, each with its own bounds (see postBounds), are solved together
+    starting from the prior solutions. Errors are those of the unconstrained problem,
+    scaled by the misfit of the constrained solutions
+    :param sigmad: uncertainty of each row of A
+    :returns: models, model errors (one column per pixel) and covariances (one matrix per pixel)
+    """
+    # prior solution without postseismic
+    indexpo = [int(po) for po, t in zip(indexpofull, tcar) if t > 0.]
+    minit = np.zeros((A.shape[1], B.shape[1]))
+    minit[np.delete(np.arange(A.shape[1]), indexpo)] = invSVD(np.delete(A, indexpo, 1), B, cond)[0]
+
+    mmin, mmax = postBounds(minit, indexco, indexpofull, tcar)
+    fsoln = boundedlsq.lstsq(A, B, mmin, mmax, x0=minit.T, w=1./sigmad, maxiter=iter, tol=acc).T
+
+    sigmam, cov = covScale(A, B, fsoln, covSVD(A, cond))
+    return fsoln, sigmam, cov
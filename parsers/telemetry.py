@@ -0,0 +1,205 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Per-task timing and resource telemetry.
+
+Each task (a job on one interferogram, a date, ...) records its wall time,
+CPU time of the process and of the external commands it waited for, peak
+resident memory, bytes read and written (including reaped commands, from
+/proc/self/io) and the list of the commands it spawned. Records are
+appended as JSON lines to a file per process, ``<filename>.<host>.<pid>``,
+so that processes on different nodes sharing an NFS directory never write
+to the same file. load() and summary() read the files of all the processes
+of filename.
+
+Example:
+>>> import telemetry
+>>> with telemetry.Recorder('filterROI', '20070218-20070706', 'telemetry.json'):
+...     filter_int(...)
+>>> pool.map(telemetry.Traced(empirical_cor, 'empirical_cor', 'telemetry.json'), range(Nifg))
+>>> print(telemetry.summary('telemetry.json'))
+"""
+
+from __future__ import print_function, division
+import os
+import time
+import json
+import socket
+import resource
+
+# recorders of the tasks running in this process, outermost first
+_current = []
+
+def _io():
+    ''' Return the I/O counters of the process (and of its reaped children) '''
+    try:
+        with open('/proc/self/io', 'r') as fid:
+            return dict((k, int(v)) for k, v in (line.split(':') for line in fid))
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _reset_peak():
+    ''' Reset the peak RSS of the process (Linux >= 4.0). Return True on success '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as fid:
+            fid.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def _peak():
+    ''' Return the peak RSS of the process in kB '''
+    try:
+        with open('/proc/self/status', 'r') as fid:
+            for line in fid:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _cpu(who):
+    r = resource.getrusage(who)
+    return r.ru_utime + r.ru_stime
+
+def _procfile(filename):
+    ''' Return the file of the records of this process '''
+    return '{0}.{1}.{2}'.format(filename, socket.gethostname(), os.getpid())
+
+def _write(filename, record):
+    ''' Append record as one JSON line to the file of this process, the only writer of this file '''
+    line = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+    fd = os.open(_procfile(filename), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+class Recorder(object):
+    """ Context manager recording the task item of job in filename.
+    Nothing is recorded if filename is None. Without Linux support for
+    resetting the peak RSS, maxrss is the peak of the process so far.
+    Records can be nested: the peak of a task includes the peaks of the
+    tasks it encloses """
+
+    def __init__(self, job, item, filename):
+        self.filename = filename
+        self.record = {'job': str(job), 'item': str(item), 'commands': []}
+
+    def __enter__(self):
+        if self.filename is None:
+            return self
+        self.record['host'] = socket.gethostname()
+        self.record['pid'] = os.getpid()
+        self.record['start'] = time.time()
+        self._io = _io()
+        self._cpu = _cpu(resource.RUSAGE_SELF)
+        self._cpu_children = _cpu(resource.RUSAGE_CHILDREN)
+        # resetting the peak of a nested task loses the peak of the enclosing
+        # ones so far: keep it in them before the reset
+        self._inner = 0
+        if _current:
+            _current[-1]._inner = max(_current[-1]._inner, _peak())
+        self._reset = _reset_peak()
+        _current.append(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.filename is None:
+            return
+        _current.remove(self)
+        io = _io()
+        r = self.record
+        r['wall'] = time.time() - r['start']
+        r['cpu'] = _cpu(resource.RUSAGE_SELF) - self._cpu
+        r['cpu_commands'] = _cpu(resource.RUSAGE_CHILDREN) - self._cpu_children
+        r['maxrss_kb'] = max(_peak(), self._inner)
+        r['maxrss_task'] = self._reset
+        if _current:
+            _current[-1]._inner = max(_current[-1]._inner, r['maxrss_kb'])
+        for key, name in (('rchar', 'read'), ('wchar', 'written'),
+                          ('read_bytes', 'disk_read'), ('write_bytes', 'disk_written')):
+            r[name] = io[key] - self._io[key] if key in io and key in self._io else None
+        r['status'] = 'ok' if type is None else type.__name__
+        _write(self.filename, r)
+
+def command(cmd, wall=None, returncode=None):
+    ''' Record an external command spawned by the running task (if any) '''
+    if _current:
+        _current[-1].record['commands'].append({'cmd': cmd, 'wall': wall, 'returncode': returncode})
+
+class Traced(object):
+    """ Picklable wrapper of func recording each call as a task of job
+    :param label: function of the arguments of func returning the item name
+    (default: last positional argument)
+    """
+
+    def __init__(self, func, job, filename, label=None):
+        self.func, self.job, self.filename, self.label = func, job, filename, label
+
+    def __call__(self, *args, **kwargs):
+        if self.label is not None:
+            item = self.label(*args, **kwargs)
+        else:
+            item = args[-1] if args else ''
+        with Recorder(self.job, item, self.filename):
+            return self.func(*args, **kwargs)
+
+def load(filename):
+    ''' Return the list of records of filename, written by all the processes '''
+    dirname, base = os.path.split(os.path.abspath(filename))
+    files = [os.path.join(dirname, f) for f in sorted(os.listdir(dirname))
+        if f == base or f.startswith(base + '.')]
+    records = []
+    for procfile in files:
+        with open(procfile, 'r') as fid:
+            for line in fid:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    k = (len(values) - 1) * q / 100.
+    i = int(k)
+    j = min(i + 1, len(values) - 1)
+    return values[i] + (values[j] - values[i]) * (k - i)
+
+def summary(filename, top=10):
+    """ Return a text summary of the records of filename: per job, wall time
+    percentiles, CPU and command time, memory and I/O, then the top slowest tasks """
+    records = load(filename)
+    jobs = []
+    for r in records:
+        if r['job'] not in jobs:
+            jobs.append(r['job'])
+
+    mb = lambda rs, key: sum(r[key] or 0 for r in rs) / 1.e6
+    lines = ['{0:<20} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9} {6:>10} {7:>7} {8:>7} {9:>9} {10:>10} {11:>10} {12:>6}'.format(
+        'job', 'tasks', 'p50(s)', 'p90(s)', 'p99(s)', 'max(s)', 'total(s)', 'cpu%', 'cmd%',
+        'rss(MB)', 'read(MB)', 'write(MB)', 'fail')]
+    for job in jobs:
+        rs = [r for r in records if r['job'] == job]
+        wall = [r['wall'] for r in rs]
+        total = sum(wall)
+        cpu = sum(r['cpu'] for r in rs)
+        cmd = sum(r['cpu_commands'] for r in rs)
+        lines.append('{0:<20} {1:>6} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f} {6:>10.1f} {7:>7.0f} {8:>7.0f} {9:>9.0f} {10:>10.1f} {11:>10.1f} {12:>6}'.format(
+            job, len(rs), _percentile(wall, 50), _percentile(wall, 90), _percentile(wall, 99), max(wall),
+            total, 100*cpu/total if total > 0 else 0, 100*cmd/total if total > 0 else 0,
+            max(r['maxrss_kb'] for r in rs)/1.e3, mb(rs, 'read'), mb(rs, 'written'),
+            sum(r['status'] != 'ok' for r in rs)))
+
+    lines.append('')
+    lines.append('Slowest tasks:')
+    for r in sorted(records, key=lambda r: r['wall'], reverse=True)[:top]:
+        cmds = sorted(r['commands'], key=lambda c: c['wall'] or 0, reverse=True)
+        slowest = ' (slowest command: {0:.1f}s {1})'.format(cmds[0]['wall'] or 0, cmds[0]['cmd'].split()[0]) if cmds else ''
+        lines.append('{0:<20} {1:<40} {2:>9.1f}s {3}@{4}{5}'.format(r['job'], r['item'], r['wall'], r['host'], r['pid'], slowest))
+    return '\n'.join(lines)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""Work queue on a shared directory.
+
+A coordinator writes one pickled task per file in ``<queue>/todo``. Workers
+started on any node sharing the directory claim a task by renaming it into
+``<queue>/leased`` (an atomic operation, so that each task is run once),
+run it and write the pickled result into ``<queue>/done``. While a task
+runs, its worker touches the lease file; a lease that has not been touched
+for ``lease`` seconds is considered dead and the task is put back in
+``todo``. In the same way, the coordinator touches ``<queue>/coordinator``
+from start() to stop(): idle workers exit when it has not been touched for
+``lease`` seconds (coordinator dead). Times are compared on the file server
+clock, so that nodes do not need to be synchronised. No broker is needed.
+
+A task is a (function name, args, kwargs) tuple: workers resolve the
+function name in the dictionary they are given (usually the globals() of
+the script, which must then be run with the same arguments).
+
+Example:
+>>> import workqueue
+>>> queue = workqueue.WorkQueue('queue_dir')
+>>> # coordinator
+>>> results = queue.map('empirical_cor', [(kk,) for kk in range(Nifg)])
+>>> queue.stop()
+>>> # workers
+>>> workqueue.work(workqueue.WorkQueue('queue_dir'), globals())
+"""
+
+from __future__ import print_function
+import os
+import time
+import socket
+import pickle
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+class WorkQueue(object):
+    """ Shared directory work queue
+    :param lease: seconds without heartbeat after which a task is given to another worker
+    :param poll: seconds between two scans of the queue
+    """
+
+    def __init__(self, dirname, lease=600., poll=2.):
+        self.dirname = os.path.abspath(dirname)
+        self.lease = lease
+        self.poll = poll
+        self._running = None
+        for sub in ('todo', 'leased', 'done'):
+            if not os.path.exists(self._path(sub)):
+                try:
+                    os.makedirs(self._path(sub))
+                except OSError:
+                    # created by another process in the meantime
+                    pass
+
+    def _path(self, *args):
+        return os.path.join(self.dirname, *args)
+
+    def _write(self, filename, obj):
+        ''' Write obj in filename atomically '''
+        tmp = '{0}.{1}.{2}.tmp'.format(filename, socket.gethostname(), os.getpid())
+        with open(tmp, 'wb') as fid:
+            pickle.dump(obj, fid, 2)
+        os.rename(tmp, filename)
+
+    def _read(self, filename):
+        with open(filename, 'rb') as fid:
+            return pickle.load(fid)
+
+    def now(self):
+        ''' Return the current time of the file server '''
+        clock = self._path('clock.{0}.{1}'.format(socket.gethostname(), os.getpid()))
+        with open(clock, 'w'):
+            pass
+        t = os.path.getmtime(clock)
+        os.remove(clock)
+        return t
+
+    # coordinator
+
+    def start(self):
+        ''' Remove the stop flag and give news of the coordinator until stop() '''
+        if os.path.exists(self._path('stop')):
+            os.remove(self._path('stop'))
+        self.touch()
+        self._running = threading.Event()
+        beat = threading.Thread(target=_alive, args=(self, self._running))
+        beat.daemon = True
+        beat.start()
+
+    def stop(self):
+        ''' Ask the workers to exit once the queue is empty '''
+        if self._running is not None:
+            self._running.set()
+        with open(self._path('stop'), 'w'):
+            pass
+
+    def touch(self):
+        ''' Tell the workers that the coordinator is alive '''
+        with open(self._path('coordinator'), 'w'):
+            pass
+
+    def submit(self, name, func, args=(), kwargs={}):
+        ''' Put task name: func(*args, **kwargs) in the queue '''
+        self._write(self._path('todo', name), (func, tuple(args), dict(kwargs)))
+
+    def requeue(self):
+        ''' Put back in the queue the tasks of dead workers. Return their names '''
+        now = self.now()
+        names = []
+        for name in os.listdir(self._path('leased')):
+            lease = self._path('leased', name)
+            try:
+                if now - os.path.getmtime(lease) > self.lease:
+                    os.rename(lease, self._path('todo', name))
+                    logger.warning('Lease of task {0} expired, task put back in the queue'.format(name))
+                    names.append(name)
+            except OSError:
+                # finished or requeued in the meantime
+                pass
+        return names
+
+    def results(self, names):
+        ''' Wait for the tasks names and return their results in the same order
+        :raises: RuntimeError if a task raised an exception
+        '''
+        results, errors = {}, []
+        while len(results) < len(names):
+            for name in names:
+                done = self._path('done', name)
+                if name not in results and os.path.exists(done):
+                    status, value = self._read(done)
+                    os.remove(done)
+                    results[name] = value
+                    if status != 'ok':
+                        logger.critical('Task {0} failed:\n{1}'.format(name, value))
+                        errors.append(name)
+            if len(results) < len(names):
+                self.requeue()
+                time.sleep(self.poll)
+        if errors:
+            raise RuntimeError('Tasks failed: {0}'.format(' '.join(errors)))
+        return [results[name] for name in names]
+
+    def map(self, func, args, kwargs={}, prefix=None):
+        """ Run func(*a, **kwargs) for each a of args on the workers and
+        return the results in the order of args (as Pool.map)
+        :param prefix: prefix of the task names (default: func)
+        """
+        prefix = func if prefix is None else prefix
+        # names unique to this call, so that late results of requeued
+        # tasks are never taken for results of a later call
+        batch = '{0:x}'.format(int(time.time()*1000))
+        names = ['{0}_{1}_{2:05d}'.format(prefix, batch, k) for k in range(len(args))]
+        for name, a in zip(names, args):
+            self.submit(name, func, a, kwargs)
+        logger.info('{0} tasks {1} submitted in {2}'.format(len(names), prefix, self.dirname))
+        return self.results(names)
+
+    # worker
+
+    def claim(self):
+        ''' Lease the next task. Return (name, task) or None if the queue is empty '''
+        for name in sorted(os.listdir(self._path('todo'))):
+            if name.endswith('.tmp'):
+                continue
+            todo, lease = self._path('todo', name), self._path('leased', name)
+            try:
+                # renew the time of the task before publishing the lease, so
+                # that requeue() does not take it for an expired one
+                os.utime(todo, None)
+                os.rename(todo, lease)
+                return name, self._read(lease)
+            except (OSError, IOError):
+                # claimed by another worker (or requeued in the meantime)
+                continue
+        return None
+
+    def heartbeat(self, name):
+        try:
+            os.utime(self._path('leased', name), None)
+        except OSError:
+            pass
+
+    def complete(self, name, status, value):
+        self._write(self._path('done', name), (status, value))
+        try:
+            os.remove(self._path('leased', name))
+        except OSError:
+            pass
+
+    def stopped(self):
+        return os.path.exists(self._path('stop'))
+
+    def alive(self):
+        ''' Return True if the coordinator gave news in the last lease seconds '''
+        try:
+            return self.now() - os.path.getmtime(self._path('coordinator')) <= self.lease
+        except OSError:
+            return False
+
+def _beat(queue, name, event):
+    while not event.wait(queue.lease / 4.):
+        queue.heartbeat(name)
+
+def _alive(queue, event):
+    while not event.wait(queue.lease / 4.):
+        try:
+            queue.touch()
+        except (OSError, IOError):
+            pass
+
+def work(queue, functions, idle=None):
+    """ Run the tasks of queue until the coordinator stops it or dies
+    :param functions: dictionary of the callables that can be run (e.g. globals())
+    :param idle: exit after idle seconds without task if the coordinator gives
+    no news (default: the lease of the queue)
+    """
+    worker = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+    idle = queue.lease if idle is None else idle
+    last = time.time()
+    while True:
+        task = queue.claim()
+        if task is None:
+            if queue.stopped():
+                logger.info('Worker {0} exits'.format(worker))
+                return
+            if time.time() - last > idle and not queue.alive():
+                logger.warning('Worker {0} exits: no task for {1} s and no news of the coordinator'.format(worker, idle))
+                return
+            time.sleep(queue.poll)
+            continue
+
+        name, (func, args, kwargs) = task
+        logger.info('Worker {0} runs task {1}'.format(worker, name))
+        event = threading.Event()
+        beat = threading.Thread(target=_beat, args=(queue, name, event))
+        beat.daemon = True
+        beat.start()
+        try:
+            queue.complete(name, 'ok', functions[func](*args, **kwargs))
+        except KeyboardInterrupt:
+            raise
+        except BaseException:
+            # including sys.exit() in a job
+            queue.complete(name, 'error', traceback.format_exc())
+        finally:
+            event.set()
+            beat.join()
+        last = time.time()
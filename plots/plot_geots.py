@@ -50,6 +50,7 @@ from pylab import *
 from mpl_toolkits.basemap import Basemap  
 
 import docopt
+import headers
 arguments = docopt.docopt(__doc__)
 
 if arguments["--lectfile"] ==  None:
@@ -91,7 +92,7 @@ if arguments["--vmin"] is not  None:
     vmin = np.float(arguments["--vmin"])
 
 # read lect.in 
-ncol, nlign = map(int, open(lecfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lecfile)
 
 if arguments["--crop"] ==  None:
     ibeg,iend,jbeg,jend = 0,nlign,0,ncol
@@ -48,6 +48,7 @@ import matplotlib as mpl
 
 # docopt (command line parser)
 import docopt
+import headers
 
 # read arguments
 arguments = docopt.docopt(__doc__)
@@ -81,7 +82,7 @@ infile = arguments["--name"]
 
 # Read number of col, lines from lect.in
 lectfile = arguments["--lectfile"]
-ncol, nlign = map(int, open(lectfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lectfile)
 
 # fault azimuth
 str=(float(arguments["--strike"])*math.pi)/180
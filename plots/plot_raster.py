@@ -47,6 +47,7 @@ try:
     from nsbas import docopt
 except:
     import docopt
+import headers
 
 import numpy as np
 from numpy.lib.stride_tricks import as_strided
@@ -100,7 +101,7 @@ if sformat == "ROI_PAC":
         nlines, ncols = ds.RasterYSize, ds.RasterXSize
     elif (ds_extension == ".r4" or ds_extension == ""):
         fid = open(infile, 'r')
-        ncols, nlines = map(int, open(lecfile).readline().split(None, 2)[0:2])
+        ncols, nlines = headers.size(lecfile)
         phi = np.fromfile(fid,dtype=np.float32)[:nlines*ncols].reshape((nlines,ncols))
         print("> Driver:   REAL4  band file")
         print("> Size:     ", ncols,'x',nlines,'x')
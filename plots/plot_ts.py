@@ -44,6 +44,7 @@ import scipy.optimize as opt
 import scipy.linalg as lst
 
 import docopt
+import headers
 arguments = docopt.docopt(__doc__)
 infile = arguments["--infile"]
 if arguments["--lectfile"] ==  None:
@@ -58,7 +59,7 @@ if arguments["--imref"] !=  None:
         imref = int(arguments["--imref"]) - 1
 
 # read lect.in 
-ncol, nlign = map(int, open(lecfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lecfile)
 
 if arguments["--crop"] ==  None:
     crop = [0,nlign,0,ncol]
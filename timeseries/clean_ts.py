@@ -55,6 +55,7 @@ import scipy.optimize as opt
 import scipy.linalg as lst
 
 import docopt
+import headers
 arguments = docopt.docopt(__doc__)
 infile = arguments["--infile"]
 outfile = arguments["--outfile"]
@@ -80,7 +81,7 @@ else:
     imref = int(arguments["--imref"]) - 1
 
 # read lect.in 
-ncol, nlign = map(int, open(lecfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lecfile)
 
 if arguments["--clean"] ==  None:
     mask = [0,0,0,0]
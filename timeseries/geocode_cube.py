@@ -34,6 +34,7 @@ from numpy.lib.stride_tricks import as_strided
 import subprocess, shutil, sys, os
 
 import docopt
+import headers
 arguments = docopt.docopt(__doc__)
 infile = arguments["--cube"]
 geomapf = arguments["--geomaptrans"]
@@ -55,7 +56,7 @@ N=len(dates)
 print 'Number images: ', N
 
 # read lect.in 
-ncol, nlign = map(int, open(lecfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lecfile)
 
 # lect cube
 cubei = np.fromfile(infile,dtype=np.float32)
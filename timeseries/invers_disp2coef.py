@@ -18,10 +18,10 @@ At each iteration, (1) estimation of spatial ramps, (2) linear decomposition in
 
 Usage: invers_disp2coef.py  [--cube=<path>] [--lectfile=<path>] [--list_images=<path>] [--aps=<path>] [--refstart=<value>] [--refend=<value>] [--interseismic=<yes/no>] [--threshold_rmsd=<value>] \
 [--coseismic=<values>] [--postseismic=<values>]  [--seasonal=<yes/no>] [--slowslip=<values>] [--semianual=<yes/no>]  [--dem=<yes/no>] [--vector=<path>] \
-[--flat=<0/1/2/3/4/5/6/7/8/9>] [--nfit=<0/1>] [--ivar=<0/1>] [--niter=<value>]  [--spatialiter=<yes/no>]  [--sampling=<value>] [--imref=<value>] [--mask=<path>] \
+[--flat=<0/1/2/3/4/5/6/7/8/9>] [--nfit=<0/1>] [--ivar=<0/1>] [--niter=<value>] [--tol=<value>] [--subsample=<value>] [--checkpoint=<value>] [--resume] [--spatialiter=<yes/no>]  [--sampling=<value>] [--imref=<value>] [--mask=<path>] \
 [--rampmask=<yes/no>] [--threshold_mask=<value>] [--scale_mask=<value>] [--topofile=<path>] [--aspect=<path>] [--perc_topo=<value>] [--perc_los=<value>] \
 [--tempmask=<yes/no>] [--cond=<value>] [--ineq=<value>] [--rmspixel=<path>] [--threshold_rms=<path>] \
-[--crop=<values>] [--fulloutput=<yes/no>] [--geotiff=<path>] [--plot=<yes/no>] [--dateslim=<values>]  \
+[--crop=<values>] [--fulloutput=<yes/no>] [--covariance=<yes/no>] [--geotiff=<path>] [--plot=<yes/no>] [--dateslim=<values>]  \
 [<ibeg>] [<iend>] [<jbeg>] [<jend>]
 
 invers_disp2coef.py -h | --help
@@ -50,6 +50,10 @@ Options:
 4: ax+by+cxy+d 5: ax**2+bx+cy+d, 6: ay**2+by+cx+d, 7: ay**2+by+cx**2+dx+e,
 8: ay**2+by+cx**3+dx**2+ex+f, 9: ax+by+cxy**2+dxy+e
 --niter VALUE           Number of iterations. At the first iteration, image uncertainties is given by aps file or misfit spatial iteration, while for the next itarations, uncertainties are equals to the global RMS of the previous iteration for each map [default: 1]
+--tol VALUE             Stop the iterations when the relative changes from the previous iteration of the RMS of each date, of the coefficient maps, of the ramps (if spatialiter) and of the APS (if ineq) are all below tol (e.g 0.01). Changes are saved in convergence.txt at each iteration (default: 0, niter iterations)
+--subsample VALUE       Subsampling factor of the coefficient maps for the convergence monitoring [default: 10]
+--checkpoint VALUE      Save the state of the inversion in the checkpoint directory at each iteration and every VALUE lines of the time decomposition: cubes and coefficient maps are mapped in files of the directory, removed at the end of the run (default: 0, no checkpoint)
+--resume                Resume an interrupted run from its last checkpoint. Outputs are identical to the ones of an uninterrupted run
 --spatialiter  YES/NO   If yes iterate the spatial estimations at each iterations (defined by niter) on the maps minus the temporal terms (ie. interseismic, coseismic...) [default: no]
 --sampling VALUE        Downsampling factor [default: 1]
 --imref VALUE           Reference image number [default: 1]
@@ -66,6 +70,7 @@ Options:
 --cond VALUE            Condition value for optimization: Singular value smaller than cond are considered zero [default: 1e-3]
 --ineq VALUE            If yes, add ineguality constraints in the inversion: use least square result without post-seismic functions as a first guess to iterate the inversion. Force postseismic to be the same sign and inferior than coseismic steps of the first guess [default: no].
 --fulloutput YES/NO     If yes produce maps of models, residuals, ramps, as well as flatten cube without seasonal and linear term [default: no]
+--covariance YES/NO     If yes save maps of the covariances between the coefficients of each pixel (cov_<function1>_<function2>) [default: no]
 --geotiff PATH          Path to Geotiff to save outputs in tif format. If None save output are saved as .r4 files [default: .r4]
 --plot YES/NO           Display plots [default: yes]
 --refstart VALUE        Stating line number of the area where phase is set to zero [default: None]
@@ -93,6 +98,7 @@ import scipy.optimize as opt
 import scipy.linalg as lst
 import gdal, osr
 import math,sys,getopt
+import json, shutil
 from os import path, environ
 import os
 import matplotlib
@@ -109,6 +115,8 @@ try:
     from nsbas import docopt
 except:
     import docopt
+import headers
+import svdinv
 
 np.warnings.filterwarnings('ignore')
 
@@ -116,141 +124,8 @@ np.warnings.filterwarnings('ignore')
 # Create lib of wavelet functions
 ################################
 
-class pattern:
-    def __init__(self,name,reduction,date):
-        self.name=name
-        self.reduction=reduction
-        self.date=date
-
-    def info(self):
-        print self.name, self.date
-
-### BASIS FUNCTIONS: function of time
-
-def Heaviside(t):
-        h=np.zeros((len(t)))
-        h[t>=0]=1.0
-        return h
-
-def Box(t):
-        return Heaviside(t+0.5)-Heaviside(t-0.5)
-
-class coseismic(pattern):
-      def __init__(self,name,reduction,date):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-
-      def g(self,t):
-        return Heaviside(t-self.to)
-
-class postseismic(pattern):
-      def __init__(self,name,reduction,date,tcar=1):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-          self.tcar=tcar
-
-      def g(self,t):
-        t=(t-self.to)/self.tcar
-        t[t<=0] = 0
-        g = np.log10(1+t)
-        return g
-
-class reference(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-    def g(self,t):
-        return np.ones((t.size))
-
-class interseismic(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=(t-self.to)
-        return func
-
-class sin2var(pattern):
-     def __init__(self,name,reduction,date):
-         pattern.__init__(self,name,reduction,date)
-         self.to=date
-
-     def g(self,t):
-         func=np.zeros(t.size)
-         for i in xrange(t.size):
-             func[i]=math.sin(4*math.pi*(t[i]-self.to))
-         return func
-
-class cos2var(pattern):
-     def __init__(self,name,reduction,date):
-         pattern.__init__(self,name,reduction,date)
-         self.to=date
-
-     def g(self,t):
-         func=np.zeros(t.size)
-         for i in xrange(t.size):
-             func[i]=math.cos(4*math.pi*(t[i]-self.to))
-         return func
-
-class sinvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.sin(2*math.pi*(t[i]-self.to))
-        return func
-
-class cosvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.cos(2*math.pi*(t[i]-self.to))
-        return func
-
-class slowslip(pattern):
-      def __init__(self,name,reduction,date,tcar=1):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-          self.tcar=tcar
-
-      def g(self,t):
-          t=(t-self.to)/self.tcar
-          funct = 0.5*(np.tanh(t)-1) + 1
-          return funct
-
-### KERNEL FUNCTIONS: not function of time
-class corrdem(pattern):
-    def __init__(self,name,reduction,bp0,bp):
-        self.name = name
-        self.reduction = reduction
-        self.bpo=bp0
-        self.bp=bp
-
-    def info(self):
-        print self.name
-
-    def g(self,index):
-        func = (self.bp-self.bpo)
-        return func[index]
-
-class vector(pattern):
-    def __init__(self,name,reduction,vect):
-        self.name = name
-        self.reduction = reduction
-        self.func=vect
-
-    def info(self):
-        print self.name
-
-    def g(self,index):
-        return self.func[index]
+from basisfunctions import coseismic, postseismic, reference, interseismic, sin2var, cos2var, \
+    sinvar, cosvar, slowslip, corrdem, vector, design
 
 def date2dec(dates):
     dates  = np.atleast_1d(dates)
@@ -336,12 +211,25 @@ else:
     refend = int(arguments["--refend"])
 
 # read lect.in
-ncol, nlign = map(int, open(infile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(infile)
 
 if arguments["--niter"] ==  None:
     niter = 1
 else:
     niter = int(arguments["--niter"])
+if arguments["--tol"] ==  None:
+    tol = 0.
+else:
+    tol = float(arguments["--tol"])
+if arguments["--subsample"] ==  None:
+    subsample = 10
+else:
+    subsample = int(arguments["--subsample"])
+if arguments["--checkpoint"] ==  None:
+    checkpoint = 0
+else:
+    checkpoint = int(arguments["--checkpoint"])
+resume = arguments["--resume"]
 if arguments["--spatialiter"] ==  None:
     spatialiter = 'no'
 else:
@@ -440,6 +328,10 @@ if arguments["--fulloutput"] ==  None:
     fulloutput = 'no'
 else:
     fulloutput = arguments["--fulloutput"]
+if arguments["--covariance"] ==  None:
+    covariance = 'no'
+else:
+    covariance = arguments["--covariance"]
 
 if arguments["--plot"] ==  None:
     plot = 'yes'
@@ -906,13 +798,80 @@ print 'Kernels functions, Time:'
 for i in xrange((Mker)):
     kernels[i].info()
 
+#######################################################
+# Checkpoints
+#######################################################
+
+# with --checkpoint, the arrays updated by the iterations are mapped in files of
+# checkdir and the small ones are saved with the progress of the iterations
+checkdir = 'checkpoint'
+statef = os.path.join(checkdir,'state.json')
+start = {'iteration': 0, 'phase': 'spatial', 'row': ibeg}
+if resume:
+    if not os.path.exists(statef):
+        raise Exception('No checkpoint to resume in {}'.format(checkdir))
+    with open(statef) as f:
+        start = json.load(f)
+    if start['shape'] != [nlign,ncol,N] or start['M'] != M or start['crop'] != [ibeg,iend,jbeg,jend]:
+        raise Exception('Checkpoint of another inversion in {}'.format(checkdir))
+    if checkpoint == 0:
+        checkpoint = start['checkpoint']
+    saved = np.load(os.path.join(checkdir,start['arrays']))
+    nfigure = start['nfigure']
+    print
+    print 'Resume from the checkpoint of iteration {0} ({1}, line {2})'.format(start['iteration'],start['phase'],start['row'])
+elif checkpoint > 0 and not os.path.exists(checkdir):
+    os.makedirs(checkdir)
+mapped = []
+
+def state_array(name, shape, dtype=np.float64, value=0.):
+    ''' Return an array filled with value, mapped in checkdir with --checkpoint
+    (the saved array with --resume) '''
+    if checkpoint == 0:
+        array = np.empty(shape, dtype=dtype)
+    else:
+        filename = os.path.join(checkdir,name)
+        if resume:
+            array = np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+            mapped.append(array)
+            return array
+        array = np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+        mapped.append(array)
+    array[:] = value
+    return array
+
+def save_checkpoint(iteration, phase, row, **arrays):
+    ''' Flush the mapped arrays and save the small ones with the progress: the
+    state file is replaced once everything is written '''
+    for array in mapped:
+        array.flush()
+    name = 'state_{0}_{1}_{2}.npz'.format(iteration,phase,row)
+    np.savez(os.path.join(checkdir,name), **arrays)
+    state = {'iteration': iteration, 'phase': phase, 'row': row, 'arrays': name,
+        'shape': [nlign,ncol,N], 'M': M, 'crop': [ibeg,iend,jbeg,jend], 'checkpoint': checkpoint, 'nfigure': nfigure}
+    with open(statef+'.tmp', 'w') as f:
+        json.dump(state, f)
+    os.rename(statef+'.tmp', statef)
+    for old in os.listdir(checkdir):
+        if old.startswith('state_') and old != name:
+            os.remove(os.path.join(checkdir,old))
+
 # initialize matrix model to NaN
 for l in xrange((Mbasis)):
-    basis[l].m = np.ones((iend-ibeg,jend-jbeg))*np.float('NaN')
-    basis[l].sigmam = np.ones((iend-ibeg,jend-jbeg))*np.float('NaN')
+    basis[l].m = state_array('{}_m'.format(basis[l].reduction), (iend-ibeg,jend-jbeg), value=np.float('NaN'))
+    basis[l].sigmam = state_array('{}_sigmam'.format(basis[l].reduction), (iend-ibeg,jend-jbeg), value=np.float('NaN'))
 for l in xrange((Mker)):
-    kernels[l].m = np.ones((iend-ibeg,jend-jbeg))*np.float('NaN')
-    kernels[l].sigmam = np.ones((iend-ibeg,jend-jbeg))*np.float('NaN')
+    kernels[l].m = state_array('{}_m'.format(kernels[l].reduction), (iend-ibeg,jend-jbeg), value=np.float('NaN'))
+    kernels[l].sigmam = state_array('{}_sigmam'.format(kernels[l].reduction), (iend-ibeg,jend-jbeg), value=np.float('NaN'))
+
+# covariances between the coefficients of each pixel
+covmaps = {}
+if covariance=='yes':
+    functions = basis + kernels
+    for l1 in xrange(M):
+        for l2 in xrange(l1+1,M):
+            covmaps[(l1,l2)] = state_array('cov_{}_{}'.format(functions[l1].reduction,functions[l2].reduction),
+                (iend-ibeg,jend-jbeg), value=np.float('NaN'))
 
 # initialize qual
 if apsf=='no':
@@ -931,21 +890,6 @@ else:
     print 'Output uncertainties for first iteration:', inaps
     print
 
-# SVD inversion with cut-off eigenvalues
-def invSVD(A,b,cond):
-    try:
-        U,eignv,V = lst.svd(A, full_matrices=False)
-        s = np.diag(eignv)
-        index = np.nonzero(s<cond)
-        inv = lst.inv(s)
-        inv[index] = 0.
-        fsoln = np.dot( V.T, np.dot( inv , np.dot(U.T, b) ))
-    except:
-        fsoln = lst.lstsq(A,b)[0]
-        #fsoln = lst.lstsq(A,b,rcond=cond)[0]
-    
-    return fsoln
-
 ## inversion procedure 
 def consInvert(A,b,sigmad,ineq='no',cond=1.0e-3, iter=2000,acc=1e-12):
     '''Solves the constrained inversion problem.
@@ -956,80 +900,75 @@ def consInvert(A,b,sigmad,ineq='no',cond=1.0e-3, iter=2000,acc=1e-12):
 
     Subject to:
     mmin < m < mmax
+
+    Return model, model errors and covariance of the model
     '''
 
     if A.shape[0] != len(b):
         raise ValueError('Incompatible dimensions for A and b')
 
+    # a single pixel of the batched inversions
     if ineq == 'no':
-        
-        fsoln = invSVD(A,b,cond)
-        
+        fsoln,sigmam,cov = svdinv.batchInvert(A,b[:,np.newaxis],cond=cond)
     else:
+        fsoln,sigmam,cov = batchConsInvert(A,b[:,np.newaxis],sigmad,cond=cond,iter=iter,acc=acc)
 
-        # prior solution without postseismic 
-        Ain = np.delete(A,indexpo,1)
-        mtemp = invSVD(Ain,b,cond)
-        #print mtemp
-        
-        # rebuild full vector
-        for z in xrange(len(indexpo)):
-            mtemp = np.insert(mtemp,indexpo[z],0)
-        minit = np.copy(mtemp)
-
-        # # initialize bounds
-        mmin,mmax = -np.ones(M)*np.inf, np.ones(M)*np.inf 
-
-        # We here define bounds for postseismic to be the same sign than coseismic
-        # and coseismic inferior or egual to the coseimic initial 
-        for i in xrange(len(indexco)):
-            if (pos[i] > 0.) and (minit[int(indexco[i])]>0.):
-                mmin[int(indexpofull[i])], mmax[int(indexpofull[i])] = 0, np.inf 
-                mmin[int(indexco[i])], mmax[int(indexco[i])] = 0, minit[int(indexco[i])] 
-            if (pos[i] > 0.) and (minit[int(indexco[i])]<0.):
-                mmin[int(indexpofull[i])], mmax[int(indexpofull[i])] = -np.inf , 0
-                mmin[int(indexco[i])], mmax[int(indexco[i])] = minit[int(indexco[i])], 0
-        
-        # print mmin,mmax
-        ####Objective function and derivative
-        _func = lambda x: np.sum(((np.dot(A,x)-b)/sigmad)**2)
-        _fprime = lambda x: 2*np.dot(A.T/sigmad, (np.dot(A,x)-b)/sigmad)
-        
-        bounds=zip(mmin,mmax)
-        res = opt.fmin_slsqp(_func,minit,bounds=bounds,fprime=_fprime, \
-            iter=iter,full_output=True,iprint=0,acc=acc)  
-        fsoln = res[0]
-  
-    # tarantola:
-    # Cm = (Gt.Cov.G)-1 --> si sigma=1 problems
-    # sigma m **2 =  misfit**2 * diag([G.TG]-1)
-    try:
-       varx = np.linalg.inv(np.dot(A.T,A))
-       res2 = np.sum(pow((b-np.dot(A,fsoln)),2))
-       scale = 1./(A.shape[0]-A.shape[1])
-       # scale = 1./A.shape[0]
-       sigmam = np.sqrt(scale*res2*np.diag(varx))
-    except:
-       sigmam = np.ones((A.shape[1]))*float('NaN')
+    return fsoln[:,0],sigmam[:,0],cov[0]
+
+def batchConsInvert(A,B,sigmad,cond=1.0e-3,iter=2000,acc=1e-12):
+    '''Solves the constrained inversion problem (see svdinv.batchConsInvert) for each column of B
+    with the coseismic and postseismic functions of the inversion'''
+    return svdinv.batchConsInvert(A,B,sigmad,indexco,indexpofull,pos,cond=cond,iter=iter,acc=acc)
 
-    return fsoln,sigmam
+def relchange(new,old):
+    ''' Relative change (L2 norm) between two arrays, on values defined in both '''
+    index = np.logical_and(np.isfinite(new),np.isfinite(old))
+    norm = np.sqrt(np.sum(old[index]**2))
+    if norm == 0:
+        return float('NaN')
+    return np.sqrt(np.sum((new[index]-old[index])**2))/norm
 
 # initialization
-maps_flata = np.copy(maps)
-models = np.zeros((nlign,ncol,N))
+maps_flata = state_array('maps_flata', maps.shape, maps.dtype, value=maps)
+models = state_array('models', (nlign,ncol,N))
 
 # prepare flatten maps
-maps_ramp = np.zeros((nlign,ncol,N))
-maps_topo = np.zeros((nlign,ncol,N))
-maps_noramps = np.zeros((nlign,ncol,N))
+maps_ramp = state_array('maps_ramp', (nlign,ncol,N))
+maps_topo = state_array('maps_topo', (nlign,ncol,N))
+maps_noramps = state_array('maps_noramps', (nlign,ncol,N))
 rms = np.zeros((N))
-
-for ii in xrange(niter):
+if seasonal=='yes' or semianual=='yes' or inter=='yes' or vect != None:
+    models_trends = state_array('models_trends', (nlign,ncol,N))
+    models_detrends = state_array('models_detrends', (nlign,ncol,N))
+
+# convergence monitoring: relative changes of aps, rms of the dates, coefficient
+# maps (every subsample pixels) and ramps between two iterations
+convergence = []
+step = sampling*subsample
+rmsdates = np.ones((N))*float('NaN')
+if resume:
+    inaps, rmsdates = saved['inaps'], saved['rmsdates']
+    convergence = [list(c) for c in saved['convergence']]
+    if start['phase'] == 'done':
+        niter = start['iteration']
+
+for ii in xrange(start['iteration'],niter):
     print
     print '---------------'
     print 'iteration: ', ii
     print '---------------'
 
+    # first iteration of a resumed run: the spatial estimation is done if the
+    # checkpoint is in the time decomposition
+    resumed = resume and ii == start['iteration']
+    skipspatial = resumed and start['phase'] == 'temporal'
+
+    # ramps of the previous iteration
+    if resumed:
+        rampprev = saved['rampprev']
+    else:
+        rampprev = np.copy(maps_ramp[ibeg:iend:step,jbeg:jend:step,:])
+
     #############################
     # SPATIAL ITERATION N  ######
     #############################
@@ -3023,7 +2962,7 @@ for ii in xrange(niter):
       fig = plt.figure(nfigure,figsize=(14,10))
     
     # if iteration = 0 or spatialiter > 0, then spatial estimation
-    if (ii==0) or (spatialiter=='yes') :
+    if ((ii==0) or (spatialiter=='yes')) and not skipspatial:
 
       # Loop over the dates
       for l in xrange((N)):
@@ -3220,7 +3159,7 @@ for ii in xrange(niter):
     plt.close('all')
 
     # save rms
-    if (apsf=='no' and ii==0):
+    if (apsf=='no' and ii==0) and not skipspatial:
         # aps from rms
         print
         print 'Use RMS empirical estimation as uncertainties for time decomposition'
@@ -3243,24 +3182,74 @@ for ii in xrange(niter):
     print 'Time decomposition..'
     print
 
-    # initialize aps for each images to 1
-    aps = np.ones((N))
-    n_aps = np.ones((N)).astype(int)
+    if skipspatial:
+        # sums of the lines decomposed before the checkpoint
+        aps, n_aps, res2 = saved['aps'], saved['n_aps'], saved['res2']
+        mprev = list(saved['mprev'])
+        startrow = start['row']
+    else:
+        # initialize aps for each images to 1
+        aps = np.ones((N))
+        n_aps = np.ones((N)).astype(int)
+        res2 = np.zeros((N))
+
+        # coefficients of the previous iteration
+        mprev = [np.copy(f.m[::step,::step]) for f in basis+kernels]
+        startrow = ibeg
     print inaps
 
-    # reiinitialize maps models
-    models = np.zeros((nlign,ncol,N))
+    # reiinitialize maps models of the lines to decompose
+    models[startrow:] = 0.
 
     if seasonal=='yes' or semianual=='yes' or inter=='yes' or vect != None:
-        models_trends = np.zeros((nlign,ncol,N))
-        models_detrends = np.zeros((nlign,ncol,N))
+        models_trends[startrow:] = 0.
+        models_detrends[startrow:] = 0.
+
+    def save_temporal(row):
+        save_checkpoint(ii, 'temporal', row, inaps=inaps, rmsdates=rmsdates, convergence=np.array(convergence),
+            rampprev=rampprev, aps=aps, n_aps=n_aps, res2=res2, mprev=np.array(mprev))
+    if checkpoint > 0 and not skipspatial:
+        save_temporal(ibeg)
 
 
     # ligns = [2014,2157,1840,1960,1951]
     # cols = [100,117,843,189,43]
     # for i,j in zip(ligns,cols):
 
+    # Build G family of function k1(t),k2(t),...,kn(t) for all dates: #
+    #                                                                   #
+    #           |k1(0) .. kM(0)|                                        #
+    # Gfamily = |k1(1) .. kM(1)|                                        #
+    #           |..    ..  ..  |                                        #
+    #           |k1(N) .. kM(N)|                                        #
+    #                                                                   #
+    # each pixel takes the rows of its valid dates
+    Gfamily = design(basis,kernels,dates)
+    indexlin = [0,1] + range(Mbasis,M)
+
     for i in xrange(ibeg,iend,sampling):
+        if i < startrow:
+            continue
+        if checkpoint > 0 and i > startrow and ((i-ibeg)/sampling) % checkpoint == 0:
+            save_temporal(i)
+
+        # inversions of the pixels of the line with the same valid dates (same G) at once:
+        # a single decomposition and covariance of G for all of them (each pixel with its
+        # own bounds if ineq)
+        disps = np.array(maps_flata[i,jbeg:jend:sampling,:],dtype=np.float64)
+        mline,sigmaline = np.zeros((disps.shape[0],M)),np.ones((disps.shape[0],M))*float('NaN')
+        covline = np.ones((disps.shape[0],M,M))*float('NaN')
+        patterns,group = np.unique(~np.isnan(disps),axis=0,return_inverse=True)
+        for g in xrange(len(patterns)):
+            k = np.flatnonzero(patterns[g])
+            pix = np.flatnonzero(group.ravel()==g)
+            if len(k) > N/6:
+                if ineq=='yes':
+                    mt,sigmamt,covt = batchConsInvert(Gfamily[k],disps[pix][:,k].T,inaps[k],cond=rcond)
+                else:
+                    mt,sigmamt,covt = svdinv.batchInvert(Gfamily[k],disps[pix][:,k].T,cond=rcond)
+                mline[pix],sigmaline[pix],covline[pix] = mt.T,sigmamt.T,covt
+
         for j in xrange(jbeg,jend,sampling):
             #print j
 
@@ -3281,27 +3270,17 @@ for ii in xrange(niter):
             # Inisilize m to zero
             m = np.zeros((M))
             sigmam = np.ones((M))*float('NaN')
+            covm = np.ones((M,M))*float('NaN')
 
             if kk > N/6:
-                G=np.zeros((kk,M))
-                # Build G family of function k1(t),k2(t),...,kn(t): #
-                #                                                   #
-                #           |k1(0) .. kM(0)|                        #
-                # Gfamily = |k1(1) .. kM(1)|                        #
-                #           |..    ..  ..  |                        #
-                #           |k1(N) .. kM(N)|                        #
-                #                                                   #
+                G = Gfamily[k]
 
                 rmsd = maxrmsd + 1
 
                 if inter=='yes' and iteration is True:
-                    Glin=np.zeros((kk,2+Mker))
-                    for l in xrange((2)):
-                        Glin[:,l]=basis[l].g(tabx)
-                    for l in xrange((Mker)):
-                        Glin[:,2+l]=kernels[l].g(k)
+                    Glin = G[:,indexlin]
 
-                    mt,sigmamt = consInvert(Glin,taby,inaps[k],cond=rcond)
+                    mt,sigmamt,covt = consInvert(Glin,taby,inaps[k],cond=rcond)
 
                     # compute rmsd
                     mdisp[k] = np.dot(Glin,mt)
@@ -3310,16 +3289,11 @@ for ii in xrange(niter):
                     rmsd = np.sqrt(np.sum(pow((disp[k] - mdisp[k]),2))/kk)
                     # print i,j,rmsd,maxrmsd
 
-                G=np.zeros((kk,M))
-                for l in xrange((Mbasis)):
-                    G[:,l]=basis[l].g(tabx)
-                for l in xrange((Mker)):
-                    G[:,Mbasis+l]=kernels[l].g(k)
-
                 # if only ref + seasonal: ref + cos + sin
                 #print rmsd
                 if rmsd >= maxrmsd or inter!='yes':
-                    mt,sigmamt = consInvert(G,taby,inaps[k],cond=rcond,ineq=ineq)
+                    jj = (j-jbeg)/sampling
+                    mt,sigmamt,covt = mline[jj],sigmaline[jj],covline[jj]
 
                 # rebuild full vectors
                 if Mker>0:
@@ -3338,6 +3312,12 @@ for ii in xrange(niter):
                     kernels[l].m[i-ibeg,j-jbeg] = m[Mbasis+l]
                     kernels[l].sigmam[i-ibeg,j-jbeg] = sigmam[Mbasis+l]
 
+                if covariance=='yes':
+                    indexm = range(mt.shape[0]-Mker) + range(Mbasis,M)
+                    covm[np.ix_(indexm,indexm)] = covt
+                    for (l1,l2),covmap in covmaps.items():
+                        covmap[i-ibeg,j-jbeg] = covm[l1,l2]
+
                 # forward model in original order
                 mdisp[k] = np.dot(G,m)
 
@@ -3355,6 +3335,9 @@ for ii in xrange(niter):
                 # count number of pixels per dates
                 n_aps[k] = n_aps[k] + 1.0
 
+                # misfit of each date
+                res2[k] = res2[k] + (disp[k]-mdisp[k])**2
+
                 # save new aps for each maps
                 # maps_aps[i,j,k] = aps_tmp
 
@@ -3384,9 +3367,39 @@ for ii in xrange(niter):
     np.savetxt('aps_{}.txt'.format(ii), aps.T, fmt=('%.6f'))
     # set apsf is yes for iteration
     apsf=='yes'
+    # convergence: changes from the previous iteration
+    rmsprev, rmsdates = rmsdates, np.sqrt(res2/np.maximum(n_aps-1,1))
+    if ii > 0:
+        daps = relchange(aps,inaps)
+        drms = relchange(rmsdates,rmsprev)
+        dcoeff = np.nanmax([relchange(f.m[::step,::step],prev) for f,prev in zip(basis+kernels,mprev)])
+        dramp = relchange(maps_ramp[ibeg:iend:step,jbeg:jend:step,:],rampprev)
+    else:
+        daps, drms, dcoeff, dramp = [float('NaN')]*4
+    convergence.append([ii,daps,drms,dcoeff,dramp])
+    print
+    print 'Relative changes from the previous iteration: aps {0}, rms {1}, coefficients {2}, ramps {3}'.format(daps,drms,dcoeff,dramp)
+    np.savetxt('convergence.txt', np.array(convergence), fmt=('%i','%.6e','%.6e','%.6e','%.6e'),
+        header='iteration aps rms coefficients ramps')
+
     # update aps for next iterations
     inaps = np.copy(aps)
 
+    # ramps only change with spatialiter and aps only weight the inversions with ineq
+    changes = [drms,dcoeff]
+    if spatialiter=='yes':
+        changes.append(dramp)
+    if ineq=='yes':
+        changes.append(daps)
+    converged = ii > 0 and np.max(changes) < tol
+    if checkpoint > 0:
+        save_checkpoint(ii+1, 'done' if converged else 'spatial', ibeg, inaps=inaps, rmsdates=rmsdates,
+            convergence=np.array(convergence), rampprev=maps_ramp[ibeg:iend:step,jbeg:jend:step,:])
+    if converged:
+        print
+        print 'Convergence reached after {0} iterations (tol: {1})'.format(ii+1,tol)
+        break
+
 # del maps_aps
 
 #######################################################
@@ -3647,6 +3660,22 @@ else:
         kernels[l].sigmam.flatten().astype('float32').tofile(fid)
         fid.close()
 
+# save covariances
+for (l1,l2),covmap in covmaps.items():
+    name = 'cov_{}_{}'.format(functions[l1].reduction,functions[l2].reduction)
+    if geotiff is not None:
+        ds = driver.Create('{}.tif'.format(name), jend-jbeg, iend-ibeg, 1, gdal.GDT_Float32)
+        band = ds.GetRasterBand(1)
+        band.WriteArray(covmap)
+        ds.SetGeoTransform(gt)
+        ds.SetProjection(proj)
+        band.FlushCache()
+        del ds
+    else:
+        fid = open('{}.r4'.format(name), 'wb')
+        covmap.flatten().astype('float32').tofile(fid)
+        fid.close()
+
 
 #######################################################
 # Compute Amplitude and phase seasonal
@@ -3837,3 +3866,7 @@ fig.savefig('inversion.eps', format='EPS',dpi=150)
 
 if plot=='yes':
     plt.show()
+
+# outputs are saved: remove the checkpoint
+if checkpoint > 0:
+    shutil.rmtree(checkdir)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+#
+# PyGdalSAR: An InSAR post-processing package
+# written in Python-Gdal
+#
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""\
+invers_disp2lin.py
+-------------
+Quick-look temporal decomposition of the time series delay maps (depl_cumule (BIP format) and images_retenues):
+weighted fit of a reference and a linear term (and optionally seasonal terms) of each pixel, without spatial
+estimations nor iterations. The cube is read by blocks of lines and the fits of a block are solved at once in
+closed form from the sums over the valid dates of each pixel. Coefficient maps are written with the names of
+invers_disp2coef.py (ref_coeff, lin_coeff, coswt_coeff, sinwt_coeff, ...) with their uncertainties (*_sigcoeff)
+and the RMS of the residuals of each pixel (rmsd_map).
+With --incremental=yes, the sums of each pixel (normal equations) are saved next to the coefficient maps
+(normaleq_* and normaleq.json). The next runs only read the dates added to the list of images since, add them
+to the sums and solve them again: the coefficients are those of a fit of all dates. All dates are fitted again
+if the basis functions, the crop, the reference image or the weights of the previous dates changed.
+
+Usage: invers_disp2lin.py [--cube=<path>] [--lectfile=<path>] [--list_images=<path>] [--aps=<path>] [--imref=<value>] \
+[--seasonal=<yes/no>] [--dateslim=<values>] [--crop=<values>] [--nlines=<value>] [--incremental=<yes/no>] [--geotiff=<path>]
+
+invers_disp2lin.py -h | --help
+
+Options:
+-h --help               Show this screen
+--cube PATH             Path to displacement file [default: depl_cumule]
+--lectfile PATH         Path to the lect.in file (output of invers_pixel) [default: lect.in]
+--list_images PATH      Path to list images file made of 5 columns containing for each images 1) number 2) Doppler freq (not read) 3) date in YYYYMMDD format 4) numerical date 5) perpendicular baseline [default: images_retenues]
+--aps PATH              Path to the APS file giving an input error to each dates: dates are weighted by 1/aps**2 (default: no weighting)
+--imref VALUE           Reference image number [default: 1]
+--seasonal YES/NO       If yes, add seasonal terms in the fit [default: no]
+--dateslim VALUE        Datemin,Datemax time series (e.g 20140101,20200101)
+--crop VALUE            Define a region of interest for the temporal decomposition (default: 0,nlign,0,ncol)
+--nlines VALUE          Number of lines of the cube read and fitted at once [default: 256]
+--incremental YES/NO    If yes, save the normal equations and only add new dates to the previous ones [default: no]
+--geotiff PATH          Path to Geotiff to save outputs in tif format. If None save output are saved as .r4 files
+"""
+
+from __future__ import print_function
+import os
+import json
+import numpy as np
+import time
+from datetime import datetime as datetimes
+
+import docopt
+import headers
+import normaleq
+from basisfunctions import reference, interseismic, cosvar, sinvar, design
+
+def date2dec(dates):
+    dates  = np.atleast_1d(dates)
+    times = []
+    for date in dates:
+        x = datetimes.strptime('{}'.format(date),'%Y%m%d')
+        dec = float(x.strftime('%j'))/365.1
+        year = float(x.strftime('%Y'))
+        times.append(year + dec)
+    return times
+
+# read arguments
+arguments = docopt.docopt(__doc__)
+if arguments["--cube"] ==  None:
+    cubef = "depl_cumule"
+else:
+    cubef = arguments["--cube"]
+if arguments["--lectfile"] ==  None:
+    infile = "lect.in"
+else:
+    infile = arguments["--lectfile"]
+if arguments["--list_images"] ==  None:
+    listim = "images_retenues"
+else:
+    listim = arguments["--list_images"]
+if arguments["--aps"] ==  None:
+    apsf = None
+else:
+    apsf = arguments["--aps"]
+if arguments["--imref"] ==  None:
+    imref = 0
+else:
+    imref = int(arguments["--imref"]) - 1
+if arguments["--seasonal"] ==  None:
+    seasonal = 'no'
+else:
+    seasonal = arguments["--seasonal"]
+if arguments["--nlines"] ==  None:
+    nlines = 256
+else:
+    nlines = int(arguments["--nlines"])
+if arguments["--incremental"] ==  None:
+    incremental = 'no'
+else:
+    incremental = arguments["--incremental"]
+
+ncol, nlign = headers.size(infile)
+
+if arguments["--crop"] ==  None:
+    crop = [0,nlign,0,ncol]
+else:
+    crop = map(float,arguments["--crop"].replace(',',' ').split())
+ibeg,iend,jbeg,jend = int(crop[0]),int(crop[1]),int(crop[2]),int(crop[3])
+
+if arguments["--geotiff"] ==  None:
+    geotiff = None
+else:
+    import gdal
+    geotiff = arguments["--geotiff"]
+    georef = gdal.Open(geotiff)
+    gt = georef.GetGeoTransform()
+    proj = georef.GetProjection()
+    driver = gdal.GetDriverByName('GTiff')
+
+# load images_retenues file
+nb,idates,dates,base=np.loadtxt(listim, comments='#', usecols=(0,1,3,5), unpack=True,dtype='i,i,f,f')
+Nall = len(dates)
+idateref = int(idates[imref])
+
+if arguments["--dateslim"] is not  None:
+    dmin,dmax = arguments["--dateslim"].replace(',',' ').split()
+    datemin = date2dec(dmin)[0]
+    datemax = date2dec(dmax)[0]
+else:
+    datemin, datemax = int(np.min(dates)), int(np.max(dates))+1
+
+# clean dates
+indexd = np.flatnonzero(np.logical_and(dates<datemax,dates>datemin))
+idates,dates = idates[indexd],dates[indexd]
+N = len(dates)
+print('Number images: ', N)
+
+# weights of the dates
+if apsf is None:
+    w = np.ones((N))
+else:
+    inaps = np.loadtxt(apsf, comments='#', dtype='f')[indexd]
+    minaps = np.nanpercentile(inaps,2)
+    inaps[inaps<minaps] = minaps
+    print('Input uncertainties:', inaps)
+    w = 1./inaps**2
+
+basis = [
+    reference(name='reference',date=datemin,reduction='ref'),
+    interseismic(name='interseismic',reduction='lin',date=datemin),
+    ]
+if seasonal == 'yes':
+    indexseas = len(basis)
+    basis.append(cosvar(name='seas. var (cos)',reduction='coswt',date=datemin))
+    basis.append(sinvar(name='seas. var (sin)',reduction='sinwt',date=datemin))
+M = len(basis)
+G = design(basis,[],dates)
+
+for l in range(M):
+    basis[l].m = np.ones((iend-ibeg,jend-jbeg))*np.nan
+    basis[l].sigmam = np.ones((iend-ibeg,jend-jbeg))*np.nan
+rmsmap = np.ones((iend-ibeg,jend-jbeg))*np.nan
+
+# normal equations of the pixels, kept next to the coefficient maps with --incremental
+statef = 'normaleq.json'
+state = json.loads(json.dumps({'cube': [nlign,ncol], 'crop': [ibeg,iend,jbeg,jend], 'imref': idateref,
+    'basis': [f.spec() for f in basis], 'idates': [int(d) for d in idates], 'weights': [float(x) for x in w]}))
+new = np.arange(N)
+eqs = None
+if incremental == 'yes':
+    update = False
+    if os.path.exists(statef):
+        with open(statef) as f:
+            previous = json.load(f)
+        weights = dict(zip(state['idates'],state['weights']))
+        same = all(previous[key] == state[key] for key in ('cube','crop','imref','basis'))
+        # previous dates must still be fitted with the same weights
+        kept = all(weights.get(d) == x for d, x in zip(previous['idates'],previous['weights']))
+        if same and kept:
+            update = True
+            new = np.flatnonzero([d not in previous['idates'] for d in state['idates']])
+            print('Update of the normal equations with {0} new dates: {1}'.format(len(new),idates[new]))
+        else:
+            print('Basis functions, crop, reference or weights changed: fit of all dates')
+        # removed until the update is complete
+        os.remove(statef)
+    eqs = normaleq.open('normaleq', (iend-ibeg)*(jend-jbeg), M, mode='r+' if update else 'w+')
+
+# cube mapped in memory: only the lines of a block are in memory at once
+cube = np.memmap(cubef, dtype=np.float32, mode='r', shape=(nlign,ncol,Nall))
+read = np.concatenate(([imref],indexd[new]))
+
+t = time.time()
+for i in range(ibeg,iend,nlines):
+    i1 = min(i+nlines,iend)
+    if len(new) > 0:
+        # dates to fit only, the first one being the reference
+        block = np.array(cube[i:i1,jbeg:jend,:][:,:,read], dtype=np.float64)
+        block[block>9990] = np.nan
+        # reference to imref and NaN for zero values (as invers_disp2coef.py)
+        block = block - block[:,:,:1]
+        zero = block==0.
+        zero[:,:,read==imref] = False
+        block[zero] = np.nan
+        disp = block[:,:,1:].reshape(-1,len(new))
+
+    if eqs is None:
+        eq = normaleq.NormalEquations((i1-i)*(jend-jbeg),M)
+    else:
+        eq = eqs.rows((i-ibeg)*(jend-jbeg),(i1-ibeg)*(jend-jbeg))
+    if len(new) > 0:
+        eq.add(G[new],disp,w[new])
+    m, sigmam, rms = eq.solve(mincount=N/6)
+
+    shape = (i1-i,jend-jbeg)
+    for l in range(M):
+        basis[l].m[i-ibeg:i1-ibeg,:] = m[:,l].reshape(shape)
+        basis[l].sigmam[i-ibeg:i1-ibeg,:] = sigmam[:,l].reshape(shape)
+    rmsmap[i-ibeg:i1-ibeg,:] = rms.reshape(shape)
+    print('Lines {0}-{1} fitted'.format(i,i1))
+print('Fit time for {0} lines: {1}'.format(iend-ibeg,time.time() - t))
+
+if eqs is not None:
+    eqs.flush()
+    with open(statef, 'w') as f:
+        json.dump(state, f)
+
+#######################################################
+# Save functions in binary file
+#######################################################
+
+def save(name, data):
+    if geotiff is not None:
+        ds = driver.Create('{}.tif'.format(name), jend-jbeg, iend-ibeg, 1, gdal.GDT_Float32)
+        band = ds.GetRasterBand(1)
+        band.WriteArray(data)
+        ds.SetGeoTransform(gt)
+        ds.SetProjection(proj)
+        band.FlushCache()
+        del ds
+    else:
+        fid = open('{}.r4'.format(name), 'wb')
+        data.flatten().astype('float32').tofile(fid)
+        fid.close()
+
+for l in range(M):
+    save('{}_coeff'.format(basis[l].reduction), basis[l].m)
+    save('{}_sigcoeff'.format(basis[l].reduction), basis[l].sigmam)
+save('rmsd_map', rmsmap)
+
+# amplitude and phase of the seasonal terms
+if seasonal == 'yes':
+    cosine, sine = basis[indexseas].m, basis[indexseas+1].m
+    sigcosine, sigsine = basis[indexseas].sigmam, basis[indexseas+1].sigmam
+    save('ampwt_coeff', np.sqrt(cosine**2+sine**2))
+    save('ampwt_sigcoeff', np.sqrt(sigcosine**2+sigsine**2))
+    save('phiwt_coeff', np.arctan2(sine,cosine))
+    save('phiwt_sigcoeff', (sigcosine*abs(sine)+sigsine*abs(cosine))/(sigcosine**2+sigsine**2))
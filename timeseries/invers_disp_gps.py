@@ -313,76 +313,7 @@ def consInvert(A,b,sigmad,ineq='no',cond=1.0e-10, iter=2000,acc=1e-09):
     return fsoln,sigmam
 
 ### Define basis functions for plot
-class pattern:
-    def __init__(self,name,reduction,date):
-        self.name=name
-        self.reduction=reduction
-        self.date=date
-    
-    def info(self):
-        print self.name, self.date
-
-def Heaviside(t):
-        h=np.zeros((len(t)))
-        h[t>=0]=1.0
-        return h
-
-class coseismic(pattern):
-      def __init__(self,name,reduction,date):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-
-      def g(self,t):
-        return (Heaviside(t-self.to))
-
-class postseismic(pattern):
-      def __init__(self,name,reduction,date,tcar=1):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-          self.tcar=tcar
-
-      def g(self,t):
-        t=(t-self.to)/self.tcar
-        t[t<=0] = 0
-        g = np.log10(1+t)
-        return g
-
-class reference(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-    def g(self,t):
-        return np.ones((t.size))
-
-class interseismic(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=(t-self.to)
-        return func
-
-class sinvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.sin(2*math.pi*(t[i]-self.to))
-        return func
-
-class cosvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.cos(2*math.pi*(t[i]-self.to))
-        return func
+from basisfunctions import coseismic, postseismic, reference, interseismic, sinvar, cosvar, design
 
 datemin, datemax = np.int(np.min(manifold.tmin)), np.int(np.max(manifold.tmax))+1 
 # datemin, datemax= 2003, 2011
@@ -447,16 +378,17 @@ for jj in xrange((manifold.Npoints)):
         i = i+1
 
     pt.md, pt.md_lin, pt.d_lin, md, md_lin = [], [], [], [], []
+    # basis functions at the dates of the station and at the dates of the plots,
+    # shared by all components
+    G = design(basis,[],pt.t)
+    tdec = np.arange(datemin, datemax, 0.01)
+    Gdec = design(basis,[],tdec)
     # iter over all components
     for i in xrange(len(pt.comp)):
         print pt.comp[i]
         # inversion model
         mdisp=np.ones((pt.Nt))*float('NaN')
 
-        G=np.zeros((pt.Nt,M))
-        for l in xrange((M)):
-            G[:,l]=basis[l].g(pt.t)
-
         # Inisilize m
         m = np.zeros((M))
 
@@ -472,25 +404,15 @@ for jj in xrange((manifold.Npoints)):
         mdisp = np.dot(G,m)
         pt.md.append(mdisp)
         
-        dmisp_lin = np.zeros((pt.Nt))
-        G=np.zeros((pt.Nt,2))
-        for l in xrange((1)):
-            G[:,l+1]=basis[l+1].g(pt.t)
-        mdisp_lin = np.dot(G[:,:],m[0:2])
+        # linear term only (interseismic)
+        mdisp_lin = G[:,1]*m[1]
         pt.md_lin.append(mdisp-mdisp_lin)
         pt.d_lin.append(pt.d[i]-mdisp_lin)
 
-        tdec = np.arange(datemin, datemax, 0.01)
-        G=np.zeros((len(tdec),M))
-        for l in xrange((M)):
-            G[:,l]=basis[l].g(tdec)
-        model = np.dot(G[:,:M],m[:M])
+        model = np.dot(Gdec,m)
         md.append(model)
 
-        G=np.zeros((len(tdec),2))
-        for l in xrange((1)):
-            G[:,l+1]=basis[l+1].g(tdec)
-        model_lin = np.dot(G[:,:],m[0:2])
+        model_lin = Gdec[:,1]*m[1]
         md_lin.append(model-model_lin)
 
         
@@ -10,7 +10,7 @@ invers_disp_pixel.py
 -------------
 Temporal inversions of the time series delays of selected pixels (used depl_cumule (BIP format) and images_retenues, output of invers_pixel). 
 
-Usage: invers_disp_pixel.py --cols=<values> --ligns=<values> [--cube=<path>] [--list_images=<path>] [--windowsize=<value>] [--windowrefsize=<value>]  [--lectfile=<path>] [--aps=<path>] \
+Usage: invers_disp_pixel.py (--stations=<path> | --cols=<values> --ligns=<values>) [--cube=<path>] [--list_images=<path>] [--windowsize=<value>] [--windowrefsize=<value>]  [--lectfile=<path>] [--aps=<path>] \
 [--interseismic=<value>] [--threshold_rmsd=<value>] [--coseismic=<value>] [--postseismic=<value>] [--seasonal=<yes/no>] [--vector=<path>] [--info=<path>]\
 [--semianual=<yes/no>]  [--dem=<yes/no>] [--imref=<value>] [--cond=<value>] [--slowslip=<value>] [--ineq=<value>] \
 [--name=<value>] [--rad2mm=<value>] [--plot=<yes/no>] [<iref>] [<jref>] [--bounds=<value>] [--dateslim=<values>] 
@@ -21,6 +21,7 @@ Options:
 -h --help               Show this screen
 --ncols VALUE           Pixel column numbers (eg. 200,400,450) 
 --nligns VALUE          Pixel lign numbers  (eg. 1200,1200,3000) 
+--stations PATH         Text file of name, column, lign for each station: batch mode extracting all stations in one pass and inverting them together, coefficients, sigmas and RMS written in Stations_<name>.txt (figures only if --plot=yes)
 --cube PATH             Path to displacement file [default: depl_cumul_flat]
 --list_images PATH      Path to list images file made of 5 columns containing for each images 1) number 2) Doppler freq (not read) 3) date in YYYYMMDD format 4) numerical date 5) perpendicular baseline [default: images_retenues]
 --windowsize VALUE      Number of pixels around the pixel defining the window [default: 0]
@@ -81,143 +82,17 @@ import time
 
 # docopt (command line parser)
 import docopt
+import headers
+import svdinv
+import pixelseries
 
 
 ########################################################################
 # Define basis functions
 ########################################################################
 
-
-class pattern:
-    def __init__(self,name,reduction,date):
-        self.name=name
-        self.reduction=reduction
-        self.date=date
-    
-    def info(self):
-        print self.name, self.date
-
-def Heaviside(t):
-        h=np.zeros((len(t)))
-        h[t>=0]=1.0
-        return h
-
-class coseismic(pattern):
-      def __init__(self,name,reduction,date):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-
-      def g(self,t):
-        return (Heaviside(t-self.to))
-
-class postseismic(pattern):
-      def __init__(self,name,reduction,date,tcar=1):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-          self.tcar=tcar
-
-      def g(self,t):
-        t=(t-self.to)/self.tcar
-        t[t<=0] = 0
-        g = np.log10(1+t)
-        return g
-
-class reference(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-    def g(self,t):
-        return np.ones((t.size))
-
-class interseismic(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=(t-self.to)
-        return func
-
-class sinvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.sin(2*math.pi*(t[i]-self.to))
-        return func
-
-class cosvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.cos(2*math.pi*(t[i]-self.to))
-        return func
-
-class sin2var(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.sin(4*math.pi*(t[i]-self.to))
-        return func
-
-class cos2var(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.cos(4*math.pi*(t[i]-self.to))
-        return func
-
-class slowslip(pattern):
-      def __init__(self,name,reduction,date,tcar=1):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-          self.tcar=tcar
-
-      def g(self,t):
-          t=(t-self.to)/self.tcar
-          funct = 0.5*(np.tanh(t)-1) + 1
-          return funct
-
-### KERNEL FUNCTIONS: not function of time
-class corrdem(pattern):
-    def __init__(self,name,reduction,bp0,bp):
-        self.name = name
-        self.reduction = reduction
-        self.bpo=bp0
-        self.bp=bp
-
-    def info(self):
-        print self.name
-
-    def g(self,index):
-        func = (self.bp-self.bpo)
-        return func[index]        
-
-class vector(pattern):
-    def __init__(self,name,reduction,vect):
-        self.name = name
-        self.reduction = reduction
-        self.func = vect
-
-    def info(self):
-        print self.name
-
-    def g(self,index):
-        return self.func[index]
+from basisfunctions import coseismic, postseismic, reference, interseismic, sinvar, cosvar, \
+    sin2var, cos2var, slowslip, corrdem, vector, design
 
 def date2dec(dates):
     dates  = np.atleast_1d(dates)
@@ -340,7 +215,11 @@ else:
     rad2mm = float(arguments["--rad2mm"]) 
 
 if arguments["--plot"] ==  None:
-    plot = 'yes'
+    # no figures by default in batch mode
+    if arguments["--stations"] ==  None:
+        plot = 'yes'
+    else:
+        plot = 'no'
 else:
     plot = arguments["--plot"]
 
@@ -353,18 +232,24 @@ if len(pos)>0 and len(cos) != len(pos):
     raise Exception("coseimic and postseismic lists are not the same size")
 
 
-ipix = map(int,arguments["--cols"].replace(',',' ').split())
-jpix = map(int,arguments["--ligns"].replace(',',' ').split())
-if len(jpix) != len(ipix):
-   raise Exception("ncols and nligns lists are not the same size")
+if arguments["--stations"] ==  None:
+    stationf = None
+    ipix = np.array(map(int,arguments["--cols"].replace(',',' ').split()))
+    jpix = np.array(map(int,arguments["--ligns"].replace(',',' ').split()))
+    if len(jpix) != len(ipix):
+       raise Exception("ncols and nligns lists are not the same size")
+else:
+    stationf = arguments["--stations"]
+    # name, column, lign
+    names,ipix,jpix = np.atleast_1d(*np.loadtxt(stationf,comments='#',unpack=True,dtype='S16,i,i'))
 # number of pixels
 Npix = len(ipix)
 # bounds plots
-istart,iend = np.min(ipix) - 100, np.max(ipix) + 100
-jstart,jend = np.min(jpix) - 100, np.max(jpix) + 100
+istart,iend = max(np.min(ipix) - 100,0), np.max(ipix) + 100
+jstart,jend = max(np.min(jpix) - 100,0), np.max(jpix) + 100
 
 # read lect.in 
-ncol, nlign = map(int, open(infile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(infile)
 
 # load images_retenues file
 nb,idates,dates,base=np.loadtxt(listim, comments='#', usecols=(0,1,3,5), unpack=True,dtype='i,i,f,f')
@@ -383,25 +268,38 @@ else:
 indexd = np.flatnonzero(np.logical_and(dates<datemax,dates>datemin))
 nb,idates,dates,base = nb[indexd],idates[indexd],dates[indexd],base[indexd]
 
-# lect cube
-# ATTENTION: here i convert rad to mm
-cubei = np.fromfile(cubef,dtype=np.float32)*rad2mm
-cube = as_strided(cubei[:nlign*ncol*N])
-print 'Number of line in the cube: ', cube.shape
-kk = np.flatnonzero(np.logical_or(cube==9990, cube==9999))
-cube[kk] = float('NaN')
-maps = cube.reshape((nlign,ncol,N))
-
-# set to NaN lakes and ocean, new image ref.
-cst = np.copy(maps[:,:,imref])
-for l in xrange((N)):
-    d = as_strided(maps[:,:,l])
-    maps[:,:,l] = maps[:,:,l] - cst
+# lect cube: only the selected pixels are read
+cube = pixelseries.Cube(cubef, ncol, nlign, N)
+
+def reduce_window(wind):
+    ''' Return the mean time series of an extracted window.
+    ATTENTION: here i convert rad to mm and set the reference image '''
+    wind = wind*rad2mm
+    wind = wind - wind[:,:,imref:imref+1]
+    return np.nanmean(wind[:,:,indexd],axis=(0,1))
+
+# NaN-aware summed-area tables of the cube referenced to imref, built by blocks of lines when needed
+means = pixelseries.WindowMean(cube, ref=imref, maxw=max(w,int(wref)))
+
+def windowed(ipix, jpix, w):
+    ''' Return the mean time series of the windows of half-size w around columns ipix and lines jpix:
+    from the summed-area tables if reading their blocks of lines costs less than reading the windows '''
+    lines = np.unique(np.concatenate([np.arange(max(j-w,0),min(j+w+1,nlign)) for j in jpix]))
+    if len(np.unique(lines//means.nlines))*means.nlines*ncol < len(ipix)*(2*w+1)**2:
+        return means.means(ipix,jpix,w)[:,indexd]*rad2mm
+    return np.array([reduce_window(wind) for wind in cube.windows(ipix,jpix,w)])
+
+def extract(i, j, w):
+    ''' Return the mean time series of the window of half-size w around column i and line j '''
+    return windowed([i],[j],w)[0]
+
+def lastmap(rows=None, cols=None, step=1):
+    ''' Return the last date (in mm, relative to the reference image) '''
+    return (cube.band(indexd[-1], rows, cols, step) - cube.band(imref, rows, cols, step))*rad2mm
 
 # new number of dates
 N = len(dates)
-maps = as_strided(maps[:,:,indexd])
-print 'Reshape cube: ', maps.shape
+print 'Number of dates: ', N
 
 
 # arbitrary set the max rms at pi/2
@@ -447,30 +345,35 @@ if infof is not None:
       fid.close()
 
 # plot pixels on map
-fig = plt.figure(1,figsize=(12,8))
-if arguments["--bounds"] is not  None:
-    vmax,vmin = np.nanmax(ylim), np.nanmin(ylim)
-else:
-    vmax = np.nanpercentile(maps[:,:,-1],80)
-    vmin = np.nanpercentile(maps[:,:,-1],10)
-
-ax = fig.add_subplot(1,2,1)
-ax.imshow(maps[jstart:jend,istart:iend,-1], vmax=vmax, vmin=vmin, alpha=0.6)
-ax.scatter(ipix-istart,jpix-jstart,marker='x',color='black',s=15.)
-if iref is not None and jref is not None:
-    ax.scatter(iref-istart,jref-jstart,marker='x',color='red',s=20.)
-for i in xrange((Npix)):
-    ax.text(ipix[i]-istart,jpix[i]-jstart,i)
-plt.suptitle('Black cross: pixels, red cross: reference point')
-
-ax = fig.add_subplot(1,2,2)
-ax.imshow(maps[:,:,-1], vmax=vmax, vmin=vmin, alpha=0.6)
-ax.scatter(ipix,jpix,marker='x',color='black',s=15.)
-ax.scatter(iref,jref,marker='x',color='red',s=20.)
-for i in xrange((Npix)):
-    ax.text(ipix[i],jpix[i],i)
-plt.suptitle('Black cross: pixels, red cross: reference point')
-plt.savefig('Map_{}.pdf'.format(output), format='PDF')
+if stationf is None or plot == 'yes':
+    # full frame decimated to about 1000 pixels
+    step = max(1, int(max(nlign,ncol)/1000))
+    lastfull = lastmap(step=step)
+    lastcrop = lastmap(rows=(jstart,jend), cols=(istart,iend))
+    fig = plt.figure(1,figsize=(12,8))
+    if arguments["--bounds"] is not  None:
+        vmax,vmin = np.nanmax(ylim), np.nanmin(ylim)
+    else:
+        vmax = np.nanpercentile(lastfull,80)
+        vmin = np.nanpercentile(lastfull,10)
+
+    ax = fig.add_subplot(1,2,1)
+    ax.imshow(lastcrop, vmax=vmax, vmin=vmin, alpha=0.6)
+    ax.scatter(ipix-istart,jpix-jstart,marker='x',color='black',s=15.)
+    if iref is not None and jref is not None:
+        ax.scatter(iref-istart,jref-jstart,marker='x',color='red',s=20.)
+    for i in xrange((Npix)):
+        ax.text(ipix[i]-istart,jpix[i]-jstart,i)
+    plt.suptitle('Black cross: pixels, red cross: reference point')
+
+    ax = fig.add_subplot(1,2,2)
+    ax.imshow(lastfull, vmax=vmax, vmin=vmin, alpha=0.6, extent=(-0.5,ncol-0.5,nlign-0.5,-0.5))
+    ax.scatter(ipix,jpix,marker='x',color='black',s=15.)
+    ax.scatter(iref,jref,marker='x',color='red',s=20.)
+    for i in xrange((Npix)):
+        ax.text(ipix[i],jpix[i],i)
+    plt.suptitle('Black cross: pixels, red cross: reference point')
+    plt.savefig('Map_{}.pdf'.format(output), format='PDF')
 # plt.show()
 # sys.exit()
 
@@ -559,6 +462,10 @@ M = Mbasis + Mker
 for i in xrange((Mbasis)):
     basis[i].info()
 
+# basis and kernel functions for all dates: each pixel takes the rows of its valid dates
+Gfamily = design(basis,kernels,dates)
+indexlin = [0,1] + range(Mbasis,M)
+
 ## inversion procedure 
 def consInvert(A,b,sigmad,ineq='no',cond=1.0e-3, iter=2000,acc=1e-12):
     '''Solves the constrained inversion problem.
@@ -569,94 +476,99 @@ def consInvert(A,b,sigmad,ineq='no',cond=1.0e-3, iter=2000,acc=1e-12):
 
     Subject to:
     mmin < m < mmax
+
+    Return model and model errors
     '''
 
     if A.shape[0] != len(b):
         raise ValueError('Incompatible dimensions for A and b')
 
+    # a single station of the batched inversions
     if ineq == 'no':
-        
-        try:
-          U,eignv,V = lst.svd(A, full_matrices=False)
-          s = np.diag(eignv)
-          print 
-          print 'Eigenvalues:', eignv
-          index = np.nonzero(s<cond)
-          inv = lst.inv(s)
-          inv[index] = 0.
-          fsoln = np.dot( V.T, np.dot( inv , np.dot(U.T, b) ))
-          print 'SVD solution:', fsoln
-          print
-        except:
-          fsoln = lst.lstsq(A,b,rcond=cond)[0]
-
-
+        fsoln,sigmam = svdinv.batchInvert(A,b[:,np.newaxis],cond=cond)[:2]
     else:
+        fsoln,sigmam = batchConsInvert(A,b[:,np.newaxis],sigmad,cond=cond,iter=iter,acc=acc)[:2]
+    print 'Solution:', fsoln[:,0]
+    print 'model errors:', sigmam[:,0]
 
-        Ain = np.delete(A,indexpo,1)
-        try:
-          U,eignv,V = lst.svd(Ain, full_matrices=False)
-          s = np.diag(eignv)
-          print 
-          print 'Eigenvalues:', eignv
-          index = np.nonzero(s<cond)
-          inv = lst.inv(s)
-          inv[index] = 0.
-          mtemp = np.dot( V.T, np.dot( inv , np.dot(U.T, b) ))
-        except:
-          mtemp = lst.lstsq(Ain,b,rcond=cond)[0]
-          
-        # print mtemp
-        # print indexpo
-        # rebuild full vector
-        for z in xrange(len(indexpo)):
-            mtemp = np.insert(mtemp,indexpo[z],0)
-            # print mtemp
-        minit = np.copy(mtemp)
-        print 'Prior model:', minit
-        print
-        # # initialize bounds
-        mmin,mmax = -np.ones(M)*np.inf, np.ones(M)*np.inf 
-
-        # We here define bounds for postseismic to be the same sign than coseismic
-        # and coseisnic inferior or egal to the coseimic initial 
-        for i in xrange(len(indexco)):
-            if (pos[i] > 0.) and (minit[int(indexco[i])]>0.):
-                mmin[int(indexpofull[i])], mmax[int(indexpofull[i])] = 0, np.inf 
-                mmin[int(indexco[i])], mmax[int(indexco[i])] = 0, minit[int(indexco[i])] 
-            if (pos[i] > 0.) and (minit[int(indexco[i])]<0.):
-                mmin[int(indexpofull[i])], mmax[int(indexpofull[i])] = -np.inf , 0
-                mmin[int(indexco[i])], mmax[int(indexco[i])] = minit[int(indexco[i])], 0
-        
-        # print mmin,mmax
-        ####Objective function and derivative
-        _func = lambda x: np.sum(((np.dot(A,x)-b)/sigmad)**2)
-        _fprime = lambda x: 2*np.dot(A.T/sigmad, (np.dot(A,x)-b)/sigmad)
-        
-        bounds=zip(mmin,mmax)
-        res = opt.fmin_slsqp(_func,minit,bounds=bounds,fprime=_fprime, \
-            iter=iter,full_output=True,iprint=0,acc=acc)  
-        fsoln = res[0]
-	
-        print 'Optimization:', fsoln
-        print
+    return fsoln[:,0],sigmam[:,0]
 
-    # tarantola:
-    # Cm = (Gt.Cov.G)-1 --> si sigma=1 problems
-    # sigma m **2 =  misfit**2 * diag([G.TG]-1)
-    try:
-       varx = np.linalg.inv(np.dot(A.T,A))
-       res2 = np.sum(pow((b-np.dot(A,fsoln)),2))
-       scale = 1./(A.shape[0]-A.shape[1])
-       # scale = 1./A.shape[0]
-       sigmam = np.sqrt(scale*res2*np.diag(varx))
-    except:
-       sigmam = np.ones((A.shape[1]))*float('NaN')
+def batchConsInvert(A,B,sigmad,cond=1.0e-3,iter=2000,acc=1e-12):
+    '''Solves the constrained inversion problem (see svdinv.batchConsInvert) for each column of B
+    with the coseismic and postseismic functions of the inversion'''
+    return svdinv.batchConsInvert(A,B,sigmad,indexco,indexpofull,pos,cond=cond,iter=iter,acc=acc)
 
-    print 'model errors:'
-    print sigmam
+def rms(A,B,fsoln):
+    '''RMS of the residuals of each column of B'''
+    return np.sqrt(np.sum((B - np.dot(A,fsoln))**2,axis=0)/A.shape[0])
 
-    return fsoln,sigmam
+if stationf is not None:
+    # extract all stations in one pass over the cube
+    t = time.time()
+    disps = windowed(ipix,jpix,w)
+    if iref is not None:
+        disps = disps - extract(iref,jref,wref)
+    print 'Extraction time for {} stations: {}'.format(Npix,time.time() - t)
+
+    if apsf is None:
+        sigmad = np.ones((N))
+    else:
+        sigmad = inaps
+
+    mstat,sigmastat = np.ones((Npix,M))*float('NaN'),np.ones((Npix,M))*float('NaN')
+    rmsstat,npts = np.ones((Npix))*float('NaN'),np.zeros((Npix),dtype=int)
+
+    # stations with the same valid dates share the same G matrix
+    t = time.time()
+    valid = ~np.isnan(disps)
+    patterns,group = np.unique(valid,axis=0,return_inverse=True)
+    for g in xrange(len(patterns)):
+        k = np.flatnonzero(patterns[g])
+        kk = len(k)
+        sta = np.flatnonzero(group==g)
+        npts[sta] = kk
+        # do only this if more than N/6 points left
+        if kk <= N/6:
+            continue
+
+        G = Gfamily[k]
+        d = disps[sta][:,k].T
+        mstat[sta],sigmastat[sta] = 0.,0.
+
+        full = np.ones((len(sta)),dtype=bool)
+        if inter=='yes' and iteration is True:
+            # keep reference/interseismic/kernels only if rmsd < threshold_rmsd
+            mt,sigmamt = svdinv.batchInvert(G[:,indexlin],d,cond=rcond)[:2]
+            rmst = rms(G[:,indexlin],d,mt)
+            full = rmst >= maxrmsd
+            mstat[np.ix_(sta[~full],indexlin)] = mt[:,~full].T
+            sigmastat[np.ix_(sta[~full],indexlin)] = sigmamt[:,~full].T
+            rmsstat[sta[~full]] = rmst[~full]
+
+        if np.any(full):
+            if ineq == 'yes':
+                # bounds depend on each station
+                mt,sigmamt = batchConsInvert(G,d[:,full],sigmad[k],cond=rcond)[:2]
+            else:
+                mt,sigmamt = svdinv.batchInvert(G,d[:,full],cond=rcond)[:2]
+            rmst = rms(G,d[:,full],mt)
+            mstat[sta[full]],sigmastat[sta[full]],rmsstat[sta[full]] = mt.T,sigmamt.T,rmst
+    print 'Inversion time for {} stations: {}'.format(Npix,time.time() - t)
+
+    # save coefficients
+    reductions = [basis[l].reduction for l in xrange(Mbasis)] + [kernels[l].reduction for l in xrange(Mker)]
+    outfile = 'Stations_{}.txt'.format(output)
+    fid = open(outfile,'w')
+    fid.write('# station column lign {} {} rms npts\n'.format(' '.join(reductions),' '.join(['sig_'+r for r in reductions])))
+    for n in xrange(Npix):
+        fid.write('{} {} {} {} {} {:.6f} {}\n'.format(names[n],ipix[n],jpix[n],
+            ' '.join(['{:.6f}'.format(v) for v in mstat[n]]),' '.join(['{:.6f}'.format(v) for v in sigmastat[n]]),
+            rmsstat[n],npts[n]))
+    fid.close()
+    print 'Save coefficients, sigmas and RMS of the stations in', outfile
+
+    if plot != 'yes':
+        sys.exit()
 
 # plot diplacements maps
 nfigure = 10
@@ -702,16 +614,14 @@ for jj in xrange((Npix)):
     xlim=date2num(np.array([xmin,xmax]))
 
     # extract data
-    wind = as_strided(maps[j-w:j+w+1,i-w:i+w+1,:])
     if infof is not None:
       infm = np.nanmean(info[j-w:j+w+1,i-w:i+w+1])
     if iref is not None:
-        windref = as_strided(maps[jref-wref:jref+wref+1,iref-wref:iref+wref+1,:])
-        dispref = np.nanmean(windref,axis=(0,1))
+        dispref = extract(iref,jref,wref)
     else:
         dispref = np.zeros((N))
 
-    disp = np.nanmean(wind,axis=(0,1)) - dispref
+    disp = extract(i,j,w) - dispref
     #aps = np.nanstd(wind,axis=(0,1))
 
     # inversion model
@@ -726,6 +636,11 @@ for jj in xrange((Npix)):
     sigmad = aps  
     print 'data uncertainties', sigmad    
 
+    # nothing to invert or plot (e.g. station outside the cube)
+    if kk <= N/6:
+        print 'Not enough data for pixel {} {}, skip'.format(i,j)
+        continue
+
     # do only this if more than N/2 points left
     if kk > N/6:
         # Inisilize m
@@ -734,14 +649,12 @@ for jj in xrange((Npix)):
         # inversion
         t = time.time()
 
+        G = Gfamily[k]
+
         rmsd = maxrmsd + 1
         if inter=='yes' and iteration is True:
 
-            Glin=np.zeros((kk,2+Mker))
-            for l in xrange((2)):
-                Glin[:,l]=basis[l].g(tabx)
-            for l in xrange((Mker)):
-                Glin[:,2+l]=kernels[l].g(k)
+            Glin = G[:,indexlin]
 
             # print k
             # print sigmad
@@ -758,12 +671,6 @@ for jj in xrange((Npix)):
             print 'rmsd:', rmsd
             print 
 
-        G=np.zeros((kk,M))
-        for l in xrange((Mbasis)):
-            G[:,l]=basis[l].g(tabx)
-        for l in xrange((Mker)):
-            G[:,Mbasis+l]=kernels[l].g(k)
-
         if rmsd >= maxrmsd or inter!='yes': 
             mt,sigmamt = consInvert(G,taby,sigmad[k],cond=rcond, ineq=ineq)
 
@@ -818,16 +725,10 @@ for jj in xrange((Npix)):
     
     # plot data and model minus dem error and seasonal terms
     if seasonal=='yes':
-            G=np.zeros((kk,2))
-            for l in xrange((2)):
-                G[:,l]=basis[l+indexseas].g(tabx)
-            disp_seas[k] = disp_seas[k] + np.dot(G[:,:],m[indexseas:indexseas+2])
+            disp_seas[k] = disp_seas[k] + np.dot(G[:,indexseas:indexseas+2],m[indexseas:indexseas+2])
         
     if semianual=='yes':
-            G=np.zeros((kk,2))
-            for l in xrange((2)):
-                G[:,l]=basis[l+indexsemi].g(tabx)
-            disp_seas[k] = disp_seas[k] +  np.dot(G[:,:],m[indexsemi:indexsemi+2])
+            disp_seas[k] = disp_seas[k] +  np.dot(G[:,indexsemi:indexsemi+2],m[indexsemi:indexsemi+2])
             
     if semianual=='yes' or seasonal=='yes':
         ax2.plot(x,disp-disp_seas-demerr,'o',label='data -seasonal')
@@ -840,8 +741,7 @@ for jj in xrange((Npix)):
     mseas = np.zeros(len(tdec))
 
     G=np.zeros((len(tdec),M))
-    for l in xrange((Mbasis)):
-        G[:,l]=basis[l].g(tdec)
+    G[:,:Mbasis] = design(basis,[],tdec)
     for l in xrange((Mker)):
         G[:,Mbasis+l]=np.interp(tdec,tabx,kernels[l].g(k))
     model = np.dot(G,m)
@@ -861,16 +761,10 @@ for jj in xrange((Npix)):
         ax.plot(t,model-model_dem,'-r')
         
     if seasonal=='yes':
-        G=np.zeros((len(tdec),2))
-        for l in xrange((2)):
-            G[:,l]=basis[l+indexseas].g(tdec)
-        mseas = mseas + np.dot(G[:,:],m[indexseas:indexseas+2])
+        mseas = mseas + np.dot(G[:,indexseas:indexseas+2],m[indexseas:indexseas+2])
         
     if semianual=='yes':
-        G=np.zeros((len(tdec),2))
-        for l in xrange((2)):
-            G[:,l]=basis[l+indexsemi].g(tdec)
-        mseas = mseas + np.dot(G[:,:],m[indexsemi:indexsemi+2])
+        mseas = mseas + np.dot(G[:,indexsemi:indexsemi+2],m[indexsemi:indexsemi+2])
             
     if seasonal=='yes' or semianual=='yes':
         ax2.plot(t,model-mseas-model_dem,'-r')
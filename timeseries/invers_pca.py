@@ -59,6 +59,7 @@ import scipy.signal
 import argparse
 # docopt (command line parser)
 from nsbas import docopt
+import headers
 
 #====================
 def date2dec(date):
@@ -138,7 +139,7 @@ if __name__ == "__main__":
   else:
     infile = arguments["--lectfile"]
 
-  ncol, nlign = map(int, open(infile).readline().split(None, 2)[0:2])
+  ncol, nlign = headers.size(infile)
   nb,idates,dt,base=np.loadtxt(listim, comments='#', usecols=(0,1,3,5), unpack=True,dtype='i,i,f,f')
   N=len(dt)
   print 'Number images: ', N
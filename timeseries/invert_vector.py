@@ -64,130 +64,8 @@ import docopt
 # Create lib of basis functions
 ################################
 
-class pattern:
-    def __init__(self,name,reduction,date):
-        self.name=name
-        self.reduction=reduction
-        self.date=date
-
-    def info(self):
-        print self.name, self.date
-
-### BASIS FUNCTIONS: function of time
-
-def Heaviside(t):
-        h=np.zeros((len(t)))
-        h[t>=0]=1.0
-        return h
-
-def Box(t):
-        return Heaviside(t+0.5)-Heaviside(t-0.5)
-
-class coseismic(pattern):
-      def __init__(self,name,reduction,date):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-
-      def g(self,t):
-        return Heaviside(t-self.to)
-
-
-class postseismic(pattern):
-      def __init__(self,name,reduction,date,tcar=1):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-          self.tcar=tcar
-
-      def g(self,t):
-        t=(t-self.to)/self.tcar
-        t[t<=0] = 0
-        g = np.log10(1+t)
-        return g
-
-class reference(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-    def g(self,t):
-        return np.ones((t.size))
-
-class interseismic(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=(t-self.to)
-        return func
-
-class sin2var(pattern):
-     def __init__(self,name,reduction,date):
-         pattern.__init__(self,name,reduction,date)
-         self.to=date
-
-     def g(self,t):
-         func=np.zeros(t.size)
-         for i in xrange(t.size):
-             func[i]=math.sin(4*math.pi*(t[i]-self.to))
-         return func
-
-class cos2var(pattern):
-     def __init__(self,name,reduction,date):
-         pattern.__init__(self,name,reduction,date)
-         self.to=date
-
-     def g(self,t):
-         func=np.zeros(t.size)
-         for i in xrange(t.size):
-             func[i]=math.cos(4*math.pi*(t[i]-self.to))
-         return func
-
-class sinvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.sin(2*math.pi*(t[i]-self.to))
-        return func
-
-class cosvar(pattern):
-    def __init__(self,name,reduction,date):
-        pattern.__init__(self,name,reduction,date)
-        self.to=date
-
-    def g(self,t):
-        func=np.zeros(t.size)
-        for i in xrange(t.size):
-            func[i]=math.cos(2*math.pi*(t[i]-self.to))
-        return func
-
-class slowslip(pattern):
-      def __init__(self,name,reduction,date,tcar=1):
-          pattern.__init__(self,name,reduction,date)
-          self.to=date
-          self.tcar = tcar
-
-      def g(self,t):
-          t=(t-self.to)/self.tcar
-          funct = 0.5*(np.tanh(t)-1) + 1
-          return funct
-
-### KERNEL FUNCTIONS: not function of time
-class corrdem(pattern):
-    def __init__(self,name,reduction,bp0,bp):
-        self.name = name
-        self.reduction = reduction
-        self.bpo=bp0
-        self.bp=bp
-
-    def info(self):
-        print self.name
-
-    def g(self,index):
-        func = (self.bp-self.bpo)
-        return func[index]
+from basisfunctions import coseismic, postseismic, reference, interseismic, sinvar, cosvar, \
+    sin2var, cos2var, slowslip, corrdem, design
 
 ################################
 # Initialization
@@ -340,6 +218,9 @@ M = Mbasis + Mker
 for i in xrange((Mbasis)):
     basis[i].info()
 
+# basis and kernel functions for all dates: each vector takes the rows of its valid dates
+Gfamily = design(basis,kernels,dates)
+
 # SVD inversion with cut-off eigenvalues
 def invSVD(A,b,cond=0.1):
     try:
@@ -388,11 +269,7 @@ for jj in xrange((Nv)):
     print 'data uncertainties', sigmad
     
     m = np.zeros((M))
-    G=np.zeros((kk,M))
-    for l in xrange((Mbasis)):
-        G[:,l]=basis[l].g(tabx)
-    for l in xrange((Mker)):
-        G[:,Mbasis+l]=kernels[l].g(k)
+    G = Gfamily[k]
 
     m = invSVD(G,taby)
     mdisp[k] = np.dot(G,m)
@@ -418,8 +295,7 @@ for jj in xrange((Nv)):
     tdec = np.array([float(date.strftime('%Y')) + float(date.strftime('%j'))/365.1 for date in t])
 
     G=np.zeros((len(tdec),M))
-    for l in xrange((Mbasis)):
-        G[:,l]=basis[l].g(tdec)
+    G[:,:Mbasis] = design(basis,[],tdec)
     for l in xrange((Mker)):
         G[:,Mbasis+l]=np.interp(tdec,tabx,kernels[l].g(k))
     model = np.dot(G,m)
@@ -66,6 +66,8 @@ import datetime
 
 # docopt (command line parser)
 import docopt
+import headers
+import pixelseries
 
 # read arguments
 arguments = docopt.docopt(__doc__)
@@ -159,19 +161,19 @@ sse_time = sse[::2]
 sse_car = sse[1::2]  
 
 # create a list of pixels
-ipix = map(int,arguments["--cols"].replace(',',' ').split())
-jpix = map(int,arguments["--ligns"].replace(',',' ').split())
+ipix = np.array(map(int,arguments["--cols"].replace(',',' ').split()))
+jpix = np.array(map(int,arguments["--ligns"].replace(',',' ').split()))
 if len(jpix) != len(ipix):
     raise Exception("ncols and nligns lists are not the same size")
 # number of pixels
 Npix = len(ipix)
 # bounds plots
-istart,iend = np.min(ipix) - 100, np.max(ipix) + 100
-jstart,jend = np.min(jpix) - 100, np.max(jpix) + 100
+istart,iend = max(np.min(ipix) - 100,0), np.max(ipix) + 100
+jstart,jend = max(np.min(jpix) - 100,0), np.max(jpix) + 100
 
 
 # read lect.in 
-ncol, nlign = map(int, open(infile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(infile)
 
 #initialize figures
 nfigure=0
@@ -188,11 +190,11 @@ if apsf is not None:
 else:
   inaps = np.ones((N))
 
-# lect cube
-cube = np.fromfile(cubef,dtype=np.float32)*rad2mm
-maps = cube.reshape((nlign,ncol,N))
-print 'Reshape cube: ', maps.shape
-listplot = [maps[:,:,-1]] 
+# lect cube: only the selected pixels and the plotted area of the last date are read
+cube = pixelseries.Cube(cubef, ncol, nlign, N)
+lastmap = np.ones((nlign,ncol))*float('NaN')
+lastmap[jstart:jend,istart:iend] = cube.band(N-1, rows=(jstart,jend), cols=(istart,iend))*rad2mm
+listplot = [lastmap]
 titles = ['Depl. Cumul.']
 
 if slopef is not None:
@@ -369,9 +371,9 @@ for k in xrange(len(ipix)):
       demcor = alpha*base
 
     # plot data
-    disp = as_strided(maps[j,i,:])
+    disp = cube.series(i,j)*rad2mm
     if iref is not None:
-        dispref = as_strided(maps[jref,iref,:])
+        dispref = cube.series(iref,jref)*rad2mm
     else:
         dispref = np.zeros((N))
     disp = disp - dispref
@@ -18,6 +18,7 @@ matplotlib.use('TkAgg')
 
 import matplotlib.pyplot as plt
 import numpy as np
+import headers
 import matplotlib.cm as cm
 import matplotlib.dates as mdates
 from matplotlib.dates import date2num
@@ -72,7 +73,7 @@ print(n_compo)
 
 
 S = np.fromfile(S, dtype='float32')
-ncol, nlign = map(int, open(lect).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lect)
 date, idates, dt =np.loadtxt(images, comments='#', usecols=(1,3,4),unpack=True,dtype='i,f,f')
 N = len(A)
 dates_EQ = ['20170917', '20170921', '20180205', '20170501']
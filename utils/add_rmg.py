@@ -32,6 +32,7 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from pylab import *
 import docopt
+import rmg
 
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -63,65 +64,28 @@ else:
 # print remove
 
 gdal.UseExceptions()
-# Open int
-ds = gdal.Open(infile,gdal.GA_ReadOnly)
-ds_band1 = ds.GetRasterBand(1)
-ds_band2 = ds.GetRasterBand(2)
-
-# # Attributes
-# print("> Driver:   ", ds.GetDriver().ShortName)
-# print("> Size:     ", ds.RasterXSize,'x',ds.RasterYSize,'x',ds.RasterCount)
-# print("> Datatype: ", gdal.GetDataTypeName(ds_band2.DataType))
-# print
-
-amp = ds_band1.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)
-phi = ds_band2.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)
-nlign,ncol = ds.RasterYSize, ds.RasterXSize
+# Open int: both bands are read in one pass
+amp, phi = rmg.readrmg(infile)
+nlign,ncol = phi.shape
 temp = np.copy(phi)
 kk = np.nonzero(temp==0.0)
 temp[kk]=np.float('NaN')
 
-del ds
-
 if remove is not "no":
-    ds = gdal.Open(remove,gdal.GA_ReadOnly)
-    # print("> Driver:   ", ds.GetDriver().ShortName)
-    # print("> Size:     ", ds.RasterXSize,'x',ds.RasterYSize,'x',ds.RasterCount)
-    # print("> Datatype: ", gdal.GetDataTypeName(ds_band2.DataType))
-    # print
-    ds_band2 = ds.GetRasterBand(2)
-    remphi = ds_band2.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)[:nlign,:ncol]
+    remphi = rmg.openrmg(remove).band(2)[:nlign,:ncol]
     temp -= remphi
-    del ds
 
 #Open new model
 if add is not "no":
-    ds = gdal.Open(add,gdal.GA_ReadOnly)
-    # print("> Driver:   ", ds.GetDriver().ShortName)
-    # print("> Size:     ", ds.RasterXSize,'x',ds.RasterYSize,'x',ds.RasterCount)
-    # print("> Datatype: ", gdal.GetDataTypeName(ds_band2.DataType))
-    # print
-    ds_band2 = ds.GetRasterBand(2)
-    addphi = ds_band2.ReadAsArray(0, 0, ds.RasterXSize, ds.RasterYSize)[:nlign,:ncol]
+    addphi = rmg.openrmg(add).band(2)[:nlign,:ncol]
     temp += addphi
-    del ds
 
 kk = np.nonzero(temp > -10000)
 out = np.zeros((nlign,ncol))
 out[kk]=temp[kk]
 
-# Create new file
-drv = gdal.GetDriverByName("roi_pac")
-# Creer l'image, avec le chemin, largeur, hauteur
-dst_ds = drv.Create(outfile, ncol, nlign, 2, gdal.GDT_Float32)
-# Sortir les 2 bandes (float)
-dst_band1 = dst_ds.GetRasterBand(1)
-dst_band2 = dst_ds.GetRasterBand(2)
-# Write new data
-dst_band1.WriteArray(amp,0,0)
-dst_band2.WriteArray(out,0,0)
-# close image
-del dst_ds
+# Create new file, amplitude and phase written in one pass
+rmg.writermg(outfile, amp, out, rscfile=infile + ".rsc")
 
 # plot
 if plot=="yes":
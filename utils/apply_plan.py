@@ -0,0 +1,45 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+#
+# PyGdalSAR: An InSAR post-processing package
+# written in Python-Gdal
+#
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""\
+apply_plan.py
+-------------
+Write unwrapped IFGs planned with --plan=yes (correct_ifg_from_gacos.py, invert_ramp_topo_unw.py,
+correct_ramp_unw.py, correct_rgaz_unw.py): all the corrections planned on an IFG are applied in a
+single read and write of the original file. Intermediate IFGs are only written if given.
+
+Usage: apply_plan.py [--nlines=<value>] <outfile>...
+
+Options:
+-h --help           Show this screen.
+<outfile>           Planned IFG(s) to be written (IFG.plan must exist)
+--nlines VALUE      Number of lines read and written at once [default: 256]
+"""
+
+from __future__ import print_function
+import os
+import docopt
+import corrections
+
+# read arguments
+arguments = docopt.docopt(__doc__)
+if arguments["--nlines"] == None:
+    nlines = 256
+else:
+    nlines = int(arguments["--nlines"])
+
+for outfile in arguments["<outfile>"]:
+    if not os.path.exists(corrections.planfile(outfile)):
+        print('No plan for {0}, skip'.format(outfile))
+        continue
+    plan = corrections.Plan.load(outfile)
+    print('{0} = {1} {2}'.format(outfile, plan.infile, ' '.join(str(m) for m in plan.models)))
+    plan.apply(outfile, nlines=nlines)
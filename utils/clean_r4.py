@@ -45,6 +45,7 @@ import matplotlib.cm as cm
 from pylab import *
 
 import docopt
+import headers
 arguments = docopt.docopt(__doc__)
 infile = arguments["--infile"]
 outfile = arguments["--outfile"]
@@ -82,7 +83,7 @@ else:
     refstart,refend = ref[0], ref[1]
 
 # read lect.in 
-ncol, nlign = map(int, open(lecfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lecfile)
 fid = open(infile, 'r')
 m = np.fromfile(fid,dtype=np.float32).reshape((nlign,ncol))
 # m[m==0.0] = np.float('NaN')
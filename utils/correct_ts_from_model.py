@@ -54,36 +54,10 @@ import matplotlib.dates as mdates
 import datetime
 import os
 
-###############################################################
-# define basis functioGns for plot
-def Heaviside(t):
-    h=np.zeros((len(t)))
-    h[t>=0]=1.0
-    return h
-
-def coseismic(time,to,step):
-    return step*Heaviside(time-to)
-
-def postseismic(time,to,tcar,trans):
-       t=(time-to)/tcar
-       t[t<=0] = 0
-       g = np.log10(1+t)
-       return trans*g
-
-def linear(time,v):
-    return v*(time-datemin)
-
-def seasonal(time,a,b):
-    return a*np.cos(2*np.pi*(time-datemin)) + b*np.sin(2*np.pi*(time-datemin))
-
-def slowslip(time,to,tcar):
-          t=(time-to)/tcar
-          funct = 0.5*(np.tanh(t)-1) + 1
-          return funct
-###############################################################
-
 # docopt (command line parser)
 import docopt
+import headers
+from basisfunctions import interseismic, cosvar, sinvar, coseismic, postseismic, slowslip, design
 
 # read arguments
 arguments = docopt.docopt(__doc__)
@@ -169,7 +143,7 @@ N = len(idates)
 base = base - base[imref]
 print 'Number images: ', N
 # read lect.in 
-ncol, nlign = map(int, open(infile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(infile)
 
 # lect cube
 maps = np.fromfile(cubef,dtype=np.float32)[:nlign*ncol*N].reshape((nlign,ncol,N))
@@ -252,7 +226,7 @@ for i in xrange((M)):
 sse_times = sse[::2]
 sse_car = sse[1::2] 
 L = len(sse_times)
-ssemaps=np.zeros((M,nlign,ncol))
+ssemaps=np.zeros((L,nlign,ncol))
 for i in xrange(L):
     try:
       ds = gdal.Open('sse{}_coeff_clean.tif'.format(i), gdal.GA_ReadOnly)
@@ -282,55 +256,57 @@ for l in xrange((N)):
     model[:,:,l] =  demcor[:,:,l] + refmap
 
 
-for i in xrange(ibeg,iend): # lines
-    for j in xrange(jbeg,jend): # cols
-
-        lin, a, b = 0, 0, 0
-        steps, trans, sse = np.zeros(len(cotimes)), np.zeros(len(postimes)),np.zeros(len(sse_times))
-        if slopef is not None:
-            lin = slopemap[i,j]
-        if cosf is not None:
-            a,b = cosmap[i,j], sinmap[i,j]
-        for l in xrange(len(cotimes)):
-            steps[l] = coseismaps[l,i,j]
-            trans[l] = postmaps[l,i,j]
-        for l in xrange(len(sse_times)):
-            sse[l] = ssemaps[l,i,j]
-        ###################################################
-        model[i,j,:] = model[i,j,:] + linear(tdec,lin) + seasonal(tdec, a, b)
-        for l in xrange((M)):
-            model[i,j,:] = model[i,j,:] + coseismic(tdec, cotimes[l], steps[l]) + \
-            postseismic(tdec,cotimes[l],postimes[l],trans[l])
-        for l in xrange((L)):
-            model[i,j,:] = model[i,j,:] + sse[l]*slowslip(tdec,sse_times[l],sse_car[l])
-        ####################################################
-        maps_clean[i,j,:] = maps[i,j,:] - model[i,j,:]
-
-        ###############################################################
-        # plot TS
-        if (i in ipix and j==jpix[ipix.index(i)]):
-            ax = fig.add_subplot(Npix,1,k+1)
-            print 'plot TS: {0}-{1}'.format(i,j)
-            x = [date2num(datetime.datetime.strptime('{}'.format(d),'%Y%m%d')) for d in idates]
-
-            dmax = str(datemax) + '0101'
-            dmin = str(datemin) + '0101'
-            xmin = datetime.datetime.strptime('{}'.format(dmin),'%Y%m%d') 
-            xmax = datetime.datetime.strptime('{}'.format(dmax),'%Y%m%d')
-            xlim=date2num(np.array([xmin,xmax]))
-            ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y/%m/%d"))
-            # t = np.array([xmin + datetime.timedelta(days=d) for d in range(0, 2920)]) 
-            # print coseismic(tdec, cotimes[0], steps[0])*rad2mm
-            # print postseismic(tdec,cotimes[0],postimes[0],trans[0])*rad2mm
-            # print
-            ax.plot(x,(maps[i,j,:]-demcor[i,j])*rad2mm,'o',label='line: {}, col: {}'.format(i,j))
-            if np.std(model[i,j,:]) > 0:
-                plt.plot(x,(model[i,j,:]-demcor[i,j])*rad2mm,'-r')
-            plt.legend(loc='best', fontsize='x-small')
-            ax.set_xlim(xlim)
-            if arguments["--bounds"] is not  None:
-                ax.set_ylim(ylim)
-            k = k+1
+# basis functions at the dates of the cube and their coefficient maps
+basis, coeffs = [], []
+if slopef is not None:
+    basis.append(interseismic(name='interseismic',reduction='lin',date=datemin))
+    coeffs.append(slopemap)
+if cosf is not None:
+    basis.append(cosvar(name='seas. var (cos)',reduction='coswt',date=datemin))
+    coeffs.append(cosmap)
+    basis.append(sinvar(name='seas. var (sin)',reduction='sinwt',date=datemin))
+    coeffs.append(sinmap)
+for l in xrange((M)):
+    basis.append(coseismic(name='coseismic {}'.format(l),reduction='cos{}'.format(l),date=cotimes[l]))
+    coeffs.append(coseismaps[l])
+    if postimes[l] > 0:
+        basis.append(postseismic(name='postseismic {}'.format(l),reduction='post{}'.format(l),date=cotimes[l],tcar=postimes[l]))
+        coeffs.append(postmaps[l])
+for l in xrange((L)):
+    basis.append(slowslip(name='sse {}'.format(l),reduction='sse{}'.format(l),date=sse_times[l],tcar=sse_car[l]))
+    coeffs.append(ssemaps[l])
+G = design(basis,[],tdec)
+
+# model of the cropped area: one function at a time for all pixels
+for l in xrange(len(basis)):
+    model[ibeg:iend,jbeg:jend,:] += coeffs[l][ibeg:iend,jbeg:jend,np.newaxis]*G[:,l]
+maps_clean[ibeg:iend,jbeg:jend,:] = maps[ibeg:iend,jbeg:jend,:] - model[ibeg:iend,jbeg:jend,:]
+
+###############################################################
+# plot TS
+for n in xrange((Npix)):
+    i, j = ipix[n], jpix[n]
+    if i < ibeg or i >= iend or j < jbeg or j >= jend:
+        print 'pixel {0}-{1} outside of the crop, skip'.format(i,j)
+        continue
+    ax = fig.add_subplot(Npix,1,k+1)
+    print 'plot TS: {0}-{1}'.format(i,j)
+    x = [date2num(datetime.datetime.strptime('{}'.format(d),'%Y%m%d')) for d in idates]
+
+    dmax = str(datemax) + '0101'
+    dmin = str(datemin) + '0101'
+    xmin = datetime.datetime.strptime('{}'.format(dmin),'%Y%m%d') 
+    xmax = datetime.datetime.strptime('{}'.format(dmax),'%Y%m%d')
+    xlim=date2num(np.array([xmin,xmax]))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y/%m/%d"))
+    ax.plot(x,(maps[i,j,:]-demcor[i,j])*rad2mm,'o',label='line: {}, col: {}'.format(i,j))
+    if np.std(model[i,j,:]) > 0:
+        plt.plot(x,(model[i,j,:]-demcor[i,j])*rad2mm,'-r')
+    plt.legend(loc='best', fontsize='x-small')
+    ax.set_xlim(xlim)
+    if arguments["--bounds"] is not  None:
+        ax.set_ylim(ylim)
+    k = k+1
 
 
 # save fig
@@ -38,6 +38,7 @@ from pylab import *
 
 # docopt (command line parser)
 import docopt
+import headers
 
 # read arguments
 arguments = docopt.docopt(__doc__)
@@ -50,7 +51,7 @@ else:
     lecfile = arguments["--lectfile"]
 
 # read lect.in 
-ncol, nlign = map(int, open(lecfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lecfile)
 
 if arguments["<ibeg>"] ==  None:
     ibeg = 0
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
+import headers
 from numpy.lib.stride_tricks import as_strided
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -60,7 +61,7 @@ def date2dec(dates):
 
 cmap=cm.rainbow
 fig = plt.figure(3,figsize=(12,8))
-ncol, nlign = map(int, open('lect.in').readline().split(None, 2)[0:2])
+ncol, nlign = headers.size('lect.in')
 m = np.fromfile('acp_1',dtype=np.float32)[:nlign*ncol].reshape((nlign,ncol))
 vmax = np.nanpercentile(m,95)
 vmin = np.nanpercentile(m,5)
@@ -33,6 +33,7 @@ from numpy.lib.stride_tricks import as_strided
 from decimal import Decimal
 
 import docopt
+import headers
 arguments = docopt.docopt(__doc__)
 infile = arguments["--infile"]
 outfile = arguments["--outfile"]
@@ -53,7 +54,7 @@ if arguments["--precision"] ==  None:
 else:
    prec = int(arguments["--precision"])
 
-ncol, nlign = map(int, open(lecfile).readline().split(None, 2)[0:2])
+ncol, nlign = headers.size(lecfile)
 fid = open(latfile, 'r')
 lat = np.fromfile(fid,dtype=np.float32)
 for i in xrange(len(lat)):
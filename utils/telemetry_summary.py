@@ -0,0 +1,39 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+############################################
+#
+# PyGdalSAR: An InSAR post-processing package
+# written in Python-Gdal
+#
+############################################
+# Author        : Simon DAOUT (Oxford)
+############################################
+
+"""\
+telemetry_summary.py
+-------------
+Summarise the task records written with --telemetry by nsb_filtflatunw.py, invert_ramp_topo_unw.py
+or correct_ifg_from_gacos.py: wall time percentiles, CPU share of python and of external commands,
+peak memory and I/O per job type, and slowest tasks.
+
+Usage: telemetry_summary.py --infile=<path> [--top=<value>]
+
+Options:
+-h --help           Show this screen.
+--infile PATH       Telemetry file given with --telemetry (records of all the processes)
+--top VALUE         Number of slowest tasks to display [default: 10]
+"""
+
+from __future__ import print_function
+import docopt
+import telemetry
+
+# read arguments
+arguments = docopt.docopt(__doc__)
+infile = arguments["--infile"]
+if arguments["--top"] == None:
+    top = 10
+else:
+    top = int(arguments["--top"])
+
+print(telemetry.summary(infile, top=top))